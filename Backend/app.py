@@ -265,7 +265,14 @@
 
 from flask import Flask
 from flask_cors import CORS
+from flask_session import Session
+from cachelib import FileSystemCache
 from routes.query import query_bp
+from utils.llm_client import llm_clients
+from utils.result_handles import result_store
+from utils.model_router import model_router
+from utils.pool import pool_stats
+from utils.metrics import CONTENT_TYPE, render_metrics
 import os
 from datetime import timedelta
 
@@ -291,6 +298,24 @@ else:
     app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
     app.config['SESSION_COOKIE_SECURE'] = False
 
+# Server-side sessions: the cookie only carries a session id, and the session
+# data (DB URI, mode, ...) stays on the server. Defaults to files under
+# instance/sessions; SESSION_TYPE=redis with SESSION_REDIS_URL shares sessions
+# across instances.
+app.config['SESSION_TYPE'] = os.getenv('SESSION_TYPE', 'cachelib')
+app.config['SESSION_PERMANENT'] = True
+app.config['SESSION_KEY_PREFIX'] = 'dbassistant:'
+if app.config['SESSION_TYPE'] == 'redis':
+    from redis import Redis
+    app.config['SESSION_REDIS'] = Redis.from_url(os.getenv('SESSION_REDIS_URL', 'redis://localhost:6379'))
+else:
+    app.config['SESSION_CACHELIB'] = FileSystemCache(
+        os.getenv('SESSION_FILE_DIR', os.path.join(app.instance_path, 'sessions')),
+        threshold=int(os.getenv('SESSION_FILE_THRESHOLD', 5000)),
+        mode=0o600,
+    )
+Session(app)
+
 # NEW DYNAMIC CORS CONFIGURATION
 # This will read allowed URLs from an environment variable
 origins = os.getenv('CORS_ORIGINS', 'http://localhost:5173').split(',')
@@ -315,6 +340,20 @@ def health_check():
     """Simple health check endpoint to verify the server is running"""
     return {'status': 'healthy', 'message': 'AI Database Assistant is running'}, 200
 
+@app.route('/pool-stats', methods=['GET'])
+def get_pool_stats():
+    """Returns connection pool statistics for every shared database engine and the LLM client"""
+    return {
+        **pool_stats(),
+        'llm': {**llm_clients.stats(), 'models': model_router.stats()},
+        'results': result_store.stats(),
+    }, 200
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Latency, token, cache and pool metrics in the Prometheus text format"""
+    return render_metrics(), 200, {'Content-Type': CONTENT_TYPE}
+
 @app.route('/', methods=['GET'])
 def root():
     """Root endpoint providing API information"""
@@ -325,10 +364,19 @@ def root():
         'endpoints': {
             '/connect': 'POST - Connect to database',
             '/disconnect': 'POST - Disconnect from database',
-            '/query': 'POST - Execute natural language query',
-            '/history': 'GET - Get query history',
+            '/query': 'POST - Execute natural language query ({"async": true} queues a job)',
+            '/query/stream': 'POST - Execute query, streaming progress as Server-Sent Events',
+            '/jobs/<job_id>': 'GET - Async query job status',
+            '/jobs/<job_id>/result': 'GET - Async query job result',
+            '/results/<result_id>': 'GET - Page through a large query result (?cursor=&limit=)',
+            '/export': 'POST - Stream a full query result as csv, ndjson, arrow or parquet',
+            '/rate-limit': 'GET - LLM queue depth and expected wait',
+            '/history': 'GET - Change history (?limit=&cursor=&reverted=&q=&since=&until=)',
+            '/history/<change_id>': 'GET - One change from the history',
             '/revert': 'POST - Revert a database change',
-            '/health': 'GET - Health check'
+            '/health': 'GET - Health check',
+            '/pool-stats': 'GET - Connection pool statistics',
+            '/metrics': 'GET - Prometheus metrics'
         }
     }, 200
 
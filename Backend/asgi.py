@@ -0,0 +1,117 @@
+# Backend/asgi.py
+#
+# ASGI entry point: the same API contract as app.py, served by Quart on an
+# event loop so a single process can keep hundreds of queries in flight
+# while they wait on the LLM and the database.
+#
+# Run with: hypercorn asgi:app --bind 0.0.0.0:$PORT
+
+from cachelib import FileSystemCache, RedisCache
+from quart import Quart
+from quart_cors import cors
+from routes.async_query import async_query_bp
+from utils.llm_client import llm_clients
+from utils.result_handles import result_store
+from utils.model_router import model_router
+from utils.pool import pool_stats
+from utils.metrics import CONTENT_TYPE, render_metrics
+from utils.quart_session import ServerSideSessionInterface
+import os
+from datetime import timedelta
+
+app = Quart(__name__)
+
+app.secret_key = os.getenv('FLASK_SECRET_KEY', os.urandom(24))
+
+app.config['SESSION_COOKIE_HTTPONLY'] = True
+app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(hours=2)
+
+# Server-side sessions, in the same store app.py gives Flask-Session: the
+# cookie only carries a session key, and the connection details stay on the
+# server (utils/quart_session.py). The change history lives in utils/history.py.
+if os.getenv('SESSION_TYPE', 'cachelib') == 'redis':
+    from redis import Redis
+    session_cache = RedisCache(Redis.from_url(os.getenv('SESSION_REDIS_URL', 'redis://localhost:6379')))
+else:
+    session_cache = FileSystemCache(
+        os.getenv('SESSION_FILE_DIR', os.path.join(app.instance_path, 'sessions')),
+        threshold=int(os.getenv('SESSION_FILE_THRESHOLD', 5000)),
+        mode=0o600,
+    )
+app.session_interface = ServerSideSessionInterface(session_cache)
+
+if os.getenv('RENDER'): # RENDER is an env var automatically set by Render.com
+    app.config['SESSION_COOKIE_SAMESITE'] = 'None'
+    app.config['SESSION_COOKIE_SECURE'] = True
+else:
+    # Development settings (for localhost)
+    app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
+    app.config['SESSION_COOKIE_SECURE'] = False
+
+origins = os.getenv('CORS_ORIGINS', 'http://localhost:5173').split(',')
+
+app = cors(app,
+           allow_credentials=True,
+           allow_origin=origins,
+           allow_headers=['Content-Type', 'Authorization'],
+           allow_methods=['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS']
+)
+
+app.register_blueprint(async_query_bp)
+
+
+@app.route('/health', methods=['GET'])
+async def health_check():
+    """Simple health check endpoint to verify the server is running"""
+    return {'status': 'healthy', 'message': 'AI Database Assistant is running'}, 200
+
+@app.route('/pool-stats', methods=['GET'])
+async def get_pool_stats():
+    """Returns connection pool statistics for every shared database engine and the LLM client"""
+    return {
+        **pool_stats(),
+        'llm': {**llm_clients.stats(), 'models': model_router.stats()},
+        'results': result_store.stats(),
+    }, 200
+
+@app.route('/metrics', methods=['GET'])
+async def get_metrics():
+    """Latency, token, cache and pool metrics in the Prometheus text format"""
+    return render_metrics(), 200, {'Content-Type': CONTENT_TYPE}
+
+@app.route('/', methods=['GET'])
+async def root():
+    """Root endpoint providing API information"""
+    return {
+        'name': 'AI Database Assistant API',
+        'version': '1.0.0',
+        'llm_provider': 'Groq (FREE)',
+        'server': 'asgi',
+        'endpoints': {
+            '/connect': 'POST - Connect to database',
+            '/disconnect': 'POST - Disconnect from database',
+            '/query': 'POST - Execute natural language query',
+            '/results/<result_id>': 'GET - Page through a large query result (?cursor=&limit=)',
+            '/export': 'POST - Stream a full query result as csv, ndjson, arrow or parquet',
+            '/rate-limit': 'GET - LLM queue depth and expected wait',
+            '/history': 'GET - Change history (?limit=&cursor=&reverted=&q=&since=&until=)',
+            '/history/<change_id>': 'GET - One change from the history',
+            '/revert': 'POST - Revert a database change',
+            '/health': 'GET - Health check',
+            '/pool-stats': 'GET - Connection pool statistics',
+            '/metrics': 'GET - Prometheus metrics'
+        }
+    }, 200
+
+
+@app.errorhandler(404)
+async def not_found(error):
+    return {'error': 'Endpoint not found'}, 404
+
+@app.errorhandler(500)
+async def internal_error(error):
+    return {'error': 'Internal server error'}, 500
+
+
+if __name__ == '__main__':
+    app.run(host='0.0.0.0', port=5000)
@@ -0,0 +1,235 @@
+# Backend/routes/async_query.py
+#
+# ASGI (Quart) versions of the /connect, /disconnect, /query, /results,
+# /export, /history and /revert routes, served by asgi.py. Same request/response contract as
+# routes/query.py, but the handlers are coroutines: while a query waits on
+# Groq or the database, the event loop serves other requests instead of
+# holding a thread.
+
+import asyncio
+import traceback
+import uuid
+
+from quart import Blueprint, Response, jsonify, request, session
+from sqlalchemy import text
+
+from utils.agent_cache import agent_cache
+from utils.db import build_db_uri
+from utils.export import ExportError, start_export
+from utils.history import history_store, page_args
+from utils.llm import arun_llm_query
+from utils.negotiation import encode_response
+from utils.pool import database_identity, get_engine, get_mongo_client
+from utils.rate_limit import rate_limiter
+from utils.result_handles import result_store
+from utils.undo import RevertConflict, RevertError, undo_change
+
+# Create a Blueprint for all our routes
+async_query_bp = Blueprint('async_query', __name__)
+
+
+def _test_connection(db_uri, db_type, mode):
+    """
+    Blocking connection test against the shared sync pool, which is what
+    /query uses (its database tools are sync), so this also warms it.
+    """
+    if db_type != 'mongodb':
+        with get_engine(db_uri, mode).connect() as connection:
+            connection.execute(text('SELECT 1'))
+    else:
+        get_mongo_client(db_uri, mode).admin.command('ping')  # Will raise an exception if cannot connect
+
+
+def negotiated(payload, status=200):
+    """ Response in the layout/compression the client asked for (see routes/query.py). """
+    body, headers = encode_response(payload, request.headers.get('Accept'), request.headers.get('Accept-Encoding'))
+    return Response(body, status=status, headers=headers)
+
+
+async def _iterate_in_thread(chunks):
+    """Drives a blocking chunk generator from the event loop, one chunk per worker-thread hop."""
+    try:
+        while True:
+            chunk = await asyncio.to_thread(next, chunks, None)
+            if chunk is None:
+                break
+            yield chunk
+    finally:
+        chunks.close()
+
+
+@async_query_bp.route('/connect', methods=['POST'])
+async def connect():
+    """
+    Handles POST requests to establish a database connection.
+    Tests the credentials and, if successful, stores them in the session.
+    """
+    try:
+        data = await request.get_json()
+        if not data:
+            return jsonify({'error': 'Missing connection data'}), 400
+
+        try:
+            db_uri, db_type = build_db_uri(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        mode = data.get('mode', 'read-only')  # Default to read-only
+
+        await asyncio.to_thread(_test_connection, db_uri, db_type, mode)
+
+        # Store the successful URI and other details in the user's session
+        session['db_uri'] = db_uri
+        session['db_type'] = db_type
+        session['mode'] = mode
+        session['sid'] = uuid.uuid4().hex
+
+        return jsonify({'message': 'Connection successful'}), 200
+
+    except Exception as e:
+        print(f"Connection failed: {traceback.format_exc()}")
+        return jsonify({'error': f'Connection failed: {str(e)}'}), 500
+
+
+@async_query_bp.route('/disconnect', methods=['POST'])
+async def disconnect():
+    """ Clears the user's session, securely removing all connection data. """
+    if 'db_uri' in session:
+        # Prebuilt agents hold the connection; don't keep them for a database the user left
+        agent_cache.invalidate(database_identity(session['db_uri']), session.get('mode'))
+        # Open result cursors each pin a pooled connection
+        result_store.release(database_identity(session['db_uri']), owner=session.get('sid'))
+    session.clear()
+    return jsonify({'message': 'Successfully disconnected'}), 200
+
+
+@async_query_bp.route('/query', methods=['POST'])
+async def query():
+    """
+    Handles user queries. Retrieves connection details from the session
+    and awaits the async LangChain agent.
+    """
+    if 'db_uri' not in session:
+        return jsonify({'error': 'Not connected to a database. Please connect first.'}), 401
+
+    try:
+        data = await request.get_json()
+        if not data or 'query' not in data:
+            return jsonify({'error': 'Missing query in request body'}), 400
+
+        result = await arun_llm_query(
+            data.get('query'), session['db_uri'], session['db_type'],
+            session.get('mode', 'read-only'), session, fast=data.get('fast'),
+        )
+        session.modified = True
+
+        return negotiated(result)
+
+    except Exception as e:
+        print(f"Query failed: {traceback.format_exc()}")
+        return jsonify({'error': f'An unexpected error occurred: {str(e)}'}), 500
+
+
+@async_query_bp.route('/results/<result_id>', methods=['GET'])
+async def get_result_page(result_id):
+    """ Pages through a large result held behind a server-side handle (see routes/query.py). """
+    if 'db_uri' not in session:
+        return jsonify({'error': 'Not connected to a database.'}), 401
+
+    handle = result_store.get(result_id, database_identity(session['db_uri']))
+    if handle is None:
+        return jsonify({'error': 'Result not found or expired. Run the query again.'}), 404
+    try:
+        # Fetching the page reads from a sync cursor
+        page = await asyncio.to_thread(
+            result_store.page, handle, request.args.get('cursor'), request.args.get('limit')
+        )
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor or limit.'}), 400
+    except Exception as e:
+        print(f"Result paging failed: {traceback.format_exc()}")
+        return jsonify({'error': f'Failed to fetch results: {str(e)}'}), 500
+    return negotiated(page)
+
+
+@async_query_bp.route('/export', methods=['POST'])
+async def export_result():
+    """ Streams the full result of a statement as a file (see routes/query.py). """
+    if 'db_uri' not in session:
+        return jsonify({'error': 'Not connected to a database.'}), 401
+
+    data = await request.get_json() or {}
+    try:
+        chunks, mimetype, filename = await asyncio.to_thread(
+            start_export, session['db_uri'], session['db_type'], session.get('mode', 'read-only'),
+            data.get('sql'), data.get('format'),
+        )
+    except ExportError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"Export failed: {traceback.format_exc()}")
+        return jsonify({'error': f'Export failed: {str(e)}'}), 500
+
+    return Response(_iterate_in_thread(chunks), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename="{filename}"',
+        'X-Accel-Buffering': 'no',
+    })
+
+
+@async_query_bp.route('/rate-limit', methods=['GET'])
+async def get_rate_limit():
+    """ Returns the LLM queue depth and expected wait, so the UI can show it. """
+    return jsonify(rate_limiter.stats(session.get('sid')))
+
+
+@async_query_bp.route('/history', methods=['GET'])
+async def get_history():
+    """ Returns a page of the current session's changes (same parameters as routes/query.py). """
+    if 'db_uri' not in session:
+        return jsonify({'error': 'Not connected to a database.'}), 401
+
+    try:
+        entries, next_cursor = await asyncio.to_thread(
+            history_store.page, session.get('sid'), **page_args(request.args)
+        )
+    except ValueError as e:
+        return jsonify({'error': f'Invalid history parameters: {e}'}), 400
+    return jsonify({'history': entries, 'next_cursor': next_cursor})
+
+
+@async_query_bp.route('/history/<int:change_id>', methods=['GET'])
+async def get_history_entry(change_id):
+    """ Returns one change from the current session's history. """
+    if 'db_uri' not in session:
+        return jsonify({'error': 'Not connected to a database.'}), 401
+
+    entry = await asyncio.to_thread(history_store.get, session.get('sid'), change_id)
+    if entry is None:
+        return jsonify({'error': 'Change not found.'}), 404
+    return jsonify(entry)
+
+
+@async_query_bp.route('/revert', methods=['POST'])
+async def revert_change():
+    """ Reverts a change by applying its captured before-image (see utils/undo.py). """
+    if 'db_uri' not in session or session.get('mode') != 'read-write':
+        return jsonify({'error': 'Must be in read-write mode to revert changes.'}), 403
+
+    try:
+        data = await request.get_json()
+        entry = await asyncio.to_thread(
+            undo_change, session['db_uri'], session['db_type'], session['mode'],
+            session.get('sid'), data.get('history_id'),
+        )
+        return jsonify({
+            'message': f"Successfully reverted change: {entry['description']} ({entry['rows_restored']} rows restored)",
+            'change': entry,
+        })
+
+    except RevertConflict as e:
+        return jsonify({'error': str(e)}), 409
+    except RevertError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"Revert failed: {traceback.format_exc()}")
+        return jsonify({'error': f'An unexpected error occurred during revert: {str(e)}'}), 500
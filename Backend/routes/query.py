@@ -66,15 +66,43 @@
 #         # Catch any exceptions during processing and return an 'error' message
 #         return jsonify({'error': str(e)}), 500
 
-from flask import Blueprint, request, jsonify, session
-from sqlalchemy import create_engine
+from flask import Blueprint, Response, request, jsonify, session
+from flask.sessions import SecureCookieSession
+from sqlalchemy import text
+from utils.agent_cache import agent_cache
+from utils.db import build_db_uri
+from utils.export import ExportError, start_export
+from utils.history import history_store, page_args
 from utils.llm import run_llm_query
+from utils.pool import database_identity, get_engine, get_mongo_client
+from utils.jobs import QueueFull, job_queue
+from utils.negotiation import encode_response
+from utils.rate_limit import rate_limiter
+from utils.result_handles import result_store
+from utils.streaming import stream_query
+from utils.undo import RevertConflict, RevertError, undo_change
 import json
 import traceback
+import uuid
 
 # Create a Blueprint for all our routes
 query_bp = Blueprint('query', __name__)
 
+def detached_session():
+    """
+    Copy of the session for work that runs outside the request (streams, jobs),
+    where the request-bound `session` proxy is no longer available.
+    """
+    return SecureCookieSession(dict(session))
+
+def negotiated(payload, status=200):
+    """
+    Response in the layout and compression the client asked for via Accept /
+    Accept-Encoding (columnar JSON, MessagePack, Arrow; zstd/br/gzip). Plain JSON by default.
+    """
+    body, headers = encode_response(payload, request.headers.get('Accept'), request.headers.get('Accept-Encoding'))
+    return Response(body, status=status, headers=headers)
+
 @query_bp.route('/connect', methods=['POST'])
 def connect():
     """
@@ -86,69 +114,30 @@ def connect():
         if not data:
             return jsonify({'error': 'Missing connection data'}), 400
 
-        db_type = data.get('db_type')
-        
-        # Construct the database URI based on the selected type
-        if db_type in ['postgresql', 'mysql', 'supabase']:
-            # For Supabase and cloud databases, check if connection_string is provided
-            connection_string = data.get('connection_string')
-            
-            if connection_string:
-                # Use the full connection string directly
-                if db_type == 'supabase':
-                    # Supabase uses PostgreSQL protocol
-                    if not connection_string.startswith('postgresql://'):
-                        connection_string = 'postgresql://' + connection_string
-                    db_uri = connection_string.replace('postgresql://', 'postgresql+psycopg2://')
-                elif db_type == 'postgresql':
-                    if connection_string.startswith('postgresql://') or connection_string.startswith('postgres://'):
-                        db_uri = connection_string.replace('postgresql://', 'postgresql+psycopg2://').replace('postgres://', 'postgresql+psycopg2://')
-                    else:
-                        db_uri = 'postgresql+psycopg2://' + connection_string
-                else:  # mysql
-                    if not connection_string.startswith('mysql://'):
-                        connection_string = 'mysql://' + connection_string
-                    db_uri = connection_string.replace('mysql://', 'mysql+pymysql://')
-            else:
-                # Use individual credentials (legacy support)
-                user = data.get('user')
-                password = data.get('password')
-                host = data.get('host')
-                dbname = data.get('dbname')
-                port = data.get('port', 5432 if db_type in ['postgresql', 'supabase'] else 3306)
-
-                if not all([user, password, host, dbname]):
-                    return jsonify({'error': 'Missing connection details. Provide either a connection string or individual credentials.'}), 400
-
-                if db_type in ['postgresql', 'supabase']:
-                    db_uri = f"postgresql+psycopg2://{user}:{password}@{host}:{port}/{dbname}"
-                else:  # mysql
-                    db_uri = f"mysql+pymysql://{user}:{password}@{host}:{port}/{dbname}"
-
-        elif db_type == 'mongodb':
-            db_uri = data.get('connection_string') or data.get('db_uri')
-            if not db_uri:
-                return jsonify({'error': 'Missing connection string for MongoDB'}), 400
-        else:
-            return jsonify({'error': 'Unsupported database type'}), 400
+        try:
+            db_uri, db_type = build_db_uri(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        mode = data.get('mode', 'read-only')  # Default to read-only
 
-        # Test the connection to ensure credentials are valid
+        # Test the connection to ensure credentials are valid. The engine/client
+        # comes from the shared registry, so this also warms the pool that the
+        # following /query calls will reuse.
         if db_type != 'mongodb':
-            engine = create_engine(db_uri)
-            connection = engine.connect()
-            connection.close()
+            engine = get_engine(db_uri, mode)
+            with engine.connect() as connection:
+                connection.execute(text('SELECT 1'))
         else:
             # Test MongoDB connection
-            from pymongo import MongoClient
-            client = MongoClient(db_uri, serverSelectionTimeoutMS=5000)
-            client.server_info()  # Will raise an exception if cannot connect
-            client.close()
+            client = get_mongo_client(db_uri, mode)
+            client.admin.command('ping')  # Will raise an exception if cannot connect
         
         # Store the successful URI and other details in the user's session
         session['db_uri'] = db_uri
-        session['db_type'] = db_type if db_type != 'supabase' else 'postgresql'  # Treat Supabase as PostgreSQL
-        session['mode'] = data.get('mode', 'read-only')  # Default to read-only
-        session['history'] = []  # Initialize an empty history log
+        session['db_type'] = db_type
+        session['mode'] = mode
+        session['sid'] = uuid.uuid4().hex  # Owner id for async jobs and the change history
 
         return jsonify({'message': 'Connection successful'}), 200
 
@@ -159,6 +148,11 @@ def connect():
 @query_bp.route('/disconnect', methods=['POST'])
 def disconnect():
     """ Clears the user's session, securely removing all connection data. """
+    if 'db_uri' in session:
+        # Prebuilt agents hold the connection; don't keep them for a database the user left
+        agent_cache.invalidate(database_identity(session['db_uri']), session.get('mode'))
+        # Open result cursors each pin a pooled connection
+        result_store.release(database_identity(session['db_uri']), owner=session.get('sid'))
     session.clear()
     return jsonify({'message': 'Successfully disconnected'}), 200
 
@@ -167,6 +161,7 @@ def query():
     """
     Handles user queries. Retrieves connection details from the session
     and passes the query to the appropriate LangChain agent.
+    With {"async": true}, the query is queued and a job id is returned at once.
     """
     if 'db_uri' not in session:
         return jsonify({'error': 'Not connected to a database. Please connect first.'}), 401
@@ -181,54 +176,176 @@ def query():
         db_type = session['db_type']
         mode = session.get('mode', 'read-only')
 
+        if data.get('async'):
+            owner = session.setdefault('sid', uuid.uuid4().hex)
+            try:
+                job = job_queue.submit(
+                    run_llm_query, user_query, db_uri, db_type, mode, detached_session(),
+                    fast=data.get('fast'), owner=owner,
+                )
+            except QueueFull as e:
+                return jsonify({'error': str(e)}), 503, {'Retry-After': '5'}
+            return jsonify({
+                'job_id': job.id,
+                'status': job.status,
+                'status_url': f'/jobs/{job.id}',
+            }), 202
+
         # Run the query using the LLM utility
-        result = run_llm_query(user_query, db_uri, db_type, mode, session)
+        result = run_llm_query(user_query, db_uri, db_type, mode, session, fast=data.get('fast'))
         
         # The run_llm_query function will now handle history logging,
         # so we just need to save the session state.
         session.modified = True
 
-        return jsonify(result)
+        return negotiated(result)
 
     except Exception as e:
         print(f"Query failed: {traceback.format_exc()}")
         return jsonify({'error': f'An unexpected error occurred: {str(e)}'}), 500
 
+@query_bp.route('/query/stream', methods=['POST'])
+def query_stream():
+    """
+    Same as /query, but streams progress as Server-Sent Events: tool calls,
+    generated SQL, partial rows, LLM tokens and finally the answer.
+    """
+    if 'db_uri' not in session:
+        return jsonify({'error': 'Not connected to a database. Please connect first.'}), 401
+
+    data = request.get_json()
+    if not data or 'query' not in data:
+        return jsonify({'error': 'Missing query in request body'}), 400
+
+    events = stream_query(
+        run_llm_query, data.get('query'), session['db_uri'], session['db_type'],
+        session.get('mode', 'read-only'), detached_session(), fast=data.get('fast'),
+    )
+    return Response(events, mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',  # Stop reverse proxies from buffering the stream
+    })
+
+@query_bp.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """ Returns the status of an async query job (and its result once finished). """
+    job = job_queue.get(job_id, owner=session.get('sid'))
+    if job is None:
+        return jsonify({'error': 'Job not found or expired.'}), 404
+    return jsonify(job.to_dict())
+
+@query_bp.route('/jobs/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    """ Returns the result of a finished job, or 202 while it is still queued/running. """
+    job = job_queue.get(job_id, owner=session.get('sid'))
+    if job is None:
+        return jsonify({'error': 'Job not found or expired.'}), 404
+    if not job.done:
+        return jsonify(job.to_dict(include_result=False)), 202
+    if job.status == 'failed':
+        return jsonify({'error': job.error}), 500
+    return negotiated(job.result)
+
+@query_bp.route('/results/<result_id>', methods=['GET'])
+def get_result_page(result_id):
+    """
+    Pages through a large result held behind a server-side handle (the `result_id`
+    of a /query response). Pass the previous page's `next_cursor` as `?cursor=`
+    and optionally `?limit=` rows per page.
+    """
+    if 'db_uri' not in session:
+        return jsonify({'error': 'Not connected to a database.'}), 401
+
+    handle = result_store.get(result_id, database_identity(session['db_uri']))
+    if handle is None:
+        return jsonify({'error': 'Result not found or expired. Run the query again.'}), 404
+    try:
+        return negotiated(result_store.page(handle, request.args.get('cursor'), request.args.get('limit')))
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor or limit.'}), 400
+    except Exception as e:
+        print(f"Result paging failed: {traceback.format_exc()}")
+        return jsonify({'error': f'Failed to fetch results: {str(e)}'}), 500
+
+@query_bp.route('/export', methods=['POST'])
+def export_result():
+    """
+    Streams the full result of a statement (the `sql` of a /query answer) as a file:
+    {"sql": "...", "format": "csv" | "ndjson" | "arrow" | "parquet"}.
+    Rows are read from a server-side cursor and encoded batch by batch.
+    """
+    if 'db_uri' not in session:
+        return jsonify({'error': 'Not connected to a database.'}), 401
+
+    data = request.get_json() or {}
+    try:
+        chunks, mimetype, filename = start_export(
+            session['db_uri'], session['db_type'], session.get('mode', 'read-only'),
+            data.get('sql'), data.get('format'),
+        )
+    except ExportError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"Export failed: {traceback.format_exc()}")
+        return jsonify({'error': f'Export failed: {str(e)}'}), 500
+
+    return Response(chunks, mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename="{filename}"',
+        'X-Accel-Buffering': 'no',
+    })
+
+@query_bp.route('/rate-limit', methods=['GET'])
+def get_rate_limit():
+    """ Returns the LLM queue depth and expected wait, so the UI can show it. """
+    return jsonify(rate_limiter.stats(session.get('sid')))
+
 @query_bp.route('/history', methods=['GET'])
 def get_history():
-    """ Returns the history of changes for the current session. """
+    """
+    Returns a page of the current session's changes, newest first.
+    Query parameters: limit, cursor (the previous page's next_cursor),
+    reverted (true/false), q (text search), since/until (ISO timestamps).
+    """
     if 'db_uri' not in session:
         return jsonify({'error': 'Not connected to a database.'}), 401
-    
-    return jsonify({'history': session.get('history', [])})
+
+    try:
+        entries, next_cursor = history_store.page(session.get('sid'), **page_args(request.args))
+    except ValueError as e:
+        return jsonify({'error': f'Invalid history parameters: {e}'}), 400
+    return jsonify({'history': entries, 'next_cursor': next_cursor})
+
+@query_bp.route('/history/<int:change_id>', methods=['GET'])
+def get_history_entry(change_id):
+    """ Returns one change from the current session's history. """
+    if 'db_uri' not in session:
+        return jsonify({'error': 'Not connected to a database.'}), 401
+
+    entry = history_store.get(session.get('sid'), change_id)
+    if entry is None:
+        return jsonify({'error': 'Change not found.'}), 404
+    return jsonify(entry)
 
 @query_bp.route('/revert', methods=['POST'])
 def revert_change():
-    """ Reverts a specific change from the history log. """
+    """ Reverts a change by applying its captured before-image (see utils/undo.py). """
     if 'db_uri' not in session or session.get('mode') != 'read-write':
         return jsonify({'error': 'Must be in read-write mode to revert changes.'}), 403
 
     try:
         data = request.get_json()
-        history_id = data.get('history_id')
+        entry = undo_change(
+            session['db_uri'], session['db_type'], session['mode'], session.get('sid'), data.get('history_id')
+        )
+        return jsonify({
+            'message': f"Successfully reverted change: {entry['description']} ({entry['rows_restored']} rows restored)",
+            'change': entry,
+        })
 
-        if history_id is None or not (0 <= history_id < len(session.get('history', []))):
-            return jsonify({'error': 'Invalid history ID.'}), 400
-
-        history_entry = session['history'][history_id]
-        if history_entry.get('reverted', False):
-             return jsonify({'error': 'This change has already been reverted.'}), 400
-
-        # (Simplified Revert Logic)
-        # In a real implementation, this would call a utility function to perform
-        # the opposite action based on the snapshot.
-        
-        # For now, we'll just mark it as reverted.
-        history_entry['reverted'] = True
-        session.modified = True
-        
-        return jsonify({'message': f"Successfully reverted change: {history_entry['description']}"})
-        
+    except RevertConflict as e:
+        return jsonify({'error': str(e)}), 409
+    except RevertError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         print(f"Revert failed: {traceback.format_exc()}")
-        return jsonify({'error': f'An unexpected error occurred during revert: {str(e)}'})
\ No newline at end of file
+        return jsonify({'error': f'An unexpected error occurred during revert: {str(e)}'}), 500
\ No newline at end of file
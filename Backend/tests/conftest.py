@@ -0,0 +1,18 @@
+# Backend/tests/conftest.py
+#
+# Run from Backend/: python -m pytest -q
+# The stores under utils/ pick their file paths from the environment at
+# import time, so point them at a scratch directory before anything imports them.
+
+import os
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+_scratch = tempfile.mkdtemp(prefix='dbassistant-tests-')
+os.environ.setdefault('GROQ_API_KEY', 'test')
+os.environ.setdefault('HISTORY_DB_PATH', os.path.join(_scratch, 'history.db'))
+os.environ.setdefault('EXAMPLES_DB_PATH', os.path.join(_scratch, 'examples.db'))
+os.environ.setdefault('PROFILES_DB_PATH', os.path.join(_scratch, 'profiles.db'))
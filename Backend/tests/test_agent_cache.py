@@ -0,0 +1,27 @@
+from utils.agent_cache import AgentCache, agent_cache
+from utils.pool import EngineRegistry, database_identity
+
+
+def test_reuses_executor_for_same_fingerprint_and_resource():
+    cache, engine = AgentCache(), object()
+    first = cache.get('db', 'postgresql', 'read-only', False, 'fp', object, resource=engine)
+    assert cache.get('db', 'postgresql', 'read-only', False, 'fp', object, resource=engine) is first
+    assert cache.get('db', 'postgresql', 'read-only', False, 'fp2', object, resource=engine) is not first
+
+
+def test_rebuilds_when_the_pooled_resource_changed():
+    cache = AgentCache()
+    first = cache.get('db', 'mongodb', 'read-only', False, 'fp', object, resource=object())
+    assert cache.get('db', 'mongodb', 'read-only', False, 'fp', object, resource=object()) is not first
+
+
+def test_closing_a_pooled_engine_drops_its_agents(tmp_path):
+    registry = EngineRegistry(max_engines=1)
+    first_uri, second_uri = f'sqlite:///{tmp_path}/a.db', f'sqlite:///{tmp_path}/b.db'
+    engine = registry.get(first_uri, 'read-only')
+    agent_cache.get(database_identity(first_uri), 'postgresql', 'read-only', False, 'fp', object, resource=engine)
+    assert agent_cache.invalidate(database_identity(first_uri)) == 1
+
+    agent_cache.get(database_identity(first_uri), 'postgresql', 'read-only', False, 'fp', object, resource=engine)
+    registry.get(second_uri, 'read-only')  # Evicts the first engine (LRU)
+    assert agent_cache.invalidate(database_identity(first_uri)) == 0
@@ -0,0 +1,93 @@
+import pytest
+
+from utils import cost_guard
+from utils.cost_guard import PlanEstimate, QueryTooExpensive, guard_sql
+from utils.undo import UNDO_MAX_ROWS
+
+
+def _planner(estimates):
+    """A fake SQLDatabase._execute: EXPLAIN of a statement returns its preset (rows, cost)."""
+    explained = []
+
+    def estimate(execute, dialect, sql):
+        explained.append(sql)
+        for marker, (rows, cost) in estimates.items():
+            if marker in sql:
+                return PlanEstimate(rows, cost)
+        raise AssertionError(f'unexpected EXPLAIN: {sql}')
+    return estimate, explained
+
+
+@pytest.fixture
+def budgets(monkeypatch):
+    monkeypatch.setattr(cost_guard, 'QUERY_COST_GUARD_ENABLED', True)
+    monkeypatch.setattr(cost_guard, 'QUERY_MAX_ESTIMATED_ROWS', 10000)
+    monkeypatch.setattr(cost_guard, 'QUERY_MAX_ESTIMATED_COST', 5000)
+    monkeypatch.setattr(cost_guard, 'QUERY_AUTO_LIMIT', 100)
+
+
+def _guard(monkeypatch, dialect, sql, estimates):
+    estimate, explained = _planner(estimates)
+    monkeypatch.setattr(cost_guard, 'estimate_sql', estimate)
+    return guard_sql(None, dialect, sql), explained
+
+
+def test_limit_is_appended_to_the_statement_keeping_order_by(budgets, monkeypatch):
+    (sql, note), _ = _guard(monkeypatch, 'mysql', 'SELECT id FROM events ORDER BY created_at DESC;',
+                            {'LIMIT 100': (100, 50), 'events': (500000, 40000)})
+    assert sql == 'SELECT id FROM events ORDER BY created_at DESC LIMIT 100'
+    assert 'limited_result' not in sql
+    assert 'capped at 100 rows' in note
+
+
+def test_union_gets_a_limit_over_the_whole_result(budgets, monkeypatch):
+    (sql, _), _ = _guard(monkeypatch, 'postgresql', 'SELECT a FROM t UNION SELECT b FROM u ORDER BY 1',
+                         {'LIMIT 100': (100, 50), 'UNION': (50000, 9000)})
+    assert sql == 'SELECT a FROM t UNION SELECT b FROM u ORDER BY 1 LIMIT 100'
+
+
+def test_mysql_offset_comma_count_reads_the_count(budgets, monkeypatch):
+    # `LIMIT 20000, 5` returns 5 rows: the offset is not the row count
+    (sql, note), _ = _guard(monkeypatch, 'mysql', 'SELECT id FROM events ORDER BY id LIMIT 20000, 5',
+                            {'events': (500000, 100)})
+    assert sql == 'SELECT id FROM events ORDER BY id LIMIT 20000, 5'
+    assert note == ''
+
+
+def test_larger_explicit_limit_is_clamped_and_offset_kept(budgets, monkeypatch):
+    (sql, note), _ = _guard(monkeypatch, 'mysql', 'SELECT id FROM events ORDER BY id LIMIT 20, 50000',
+                            {'LIMIT 100': (100, 50), 'events': (500000, 40000)})
+    assert sql == 'SELECT id FROM events ORDER BY id LIMIT 100 OFFSET 20'
+    assert note
+
+
+def test_small_explicit_limit_over_cost_budget_is_refused(budgets, monkeypatch):
+    with pytest.raises(QueryTooExpensive):
+        _guard(monkeypatch, 'postgresql', 'SELECT * FROM a, b LIMIT 10', {'FROM a': (10, 90000)})
+
+
+def test_fetch_first_counts_as_a_limit(budgets, monkeypatch):
+    (sql, note), _ = _guard(monkeypatch, 'postgresql', 'SELECT id FROM events FETCH FIRST 5 ROWS ONLY',
+                            {'events': (500000, 100)})
+    assert note == ''
+
+
+def test_unparseable_read_is_refused_rather_than_wrapped(budgets, monkeypatch):
+    with pytest.raises(QueryTooExpensive):
+        _guard(monkeypatch, 'postgresql', 'SELECT * FROM events WHERE (', {'events': (500000, 40000)})
+
+
+def test_writes_are_never_rewritten(budgets, monkeypatch):
+    (sql, note), explained = _guard(monkeypatch, 'mysql', 'DELETE FROM events WHERE id < 10 LIMIT 5',
+                                    {'events': (9, 1)})
+    assert (sql, note) == ('DELETE FROM events WHERE id < 10 LIMIT 5', '')
+    assert len(explained) == 1
+
+
+def test_write_cap_defaults_to_the_undo_capture_limit(monkeypatch):
+    assert cost_guard.QUERY_MAX_WRITE_ROWS == UNDO_MAX_ROWS
+    monkeypatch.setattr(cost_guard, 'QUERY_COST_GUARD_ENABLED', True)
+    (sql, _), _ = _guard(monkeypatch, 'postgresql', 'UPDATE events SET seen = true', {'events': (100000, 9e9)})
+    assert sql == 'UPDATE events SET seen = true'
+    with pytest.raises(QueryTooExpensive):
+        _guard(monkeypatch, 'postgresql', 'DELETE FROM events', {'events': (UNDO_MAX_ROWS + 1, 1)})
@@ -0,0 +1,23 @@
+import asyncio
+import re
+
+import app as flask_app
+import asgi as quart_app
+
+
+def _routes(app):
+    rules = {re.sub(r'<\w+:', '<', rule.rule) for rule in app.url_map.iter_rules()}
+    return rules - {'/', '/static/<filename>'}
+
+
+def test_flask_listing_matches_its_routes():
+    listed = flask_app.app.test_client().get('/').get_json()['endpoints']
+    assert set(listed) == _routes(flask_app.app)
+
+
+def test_quart_listing_matches_its_routes():
+    async def fetch():
+        response = await quart_app.app.test_client().get('/')
+        return await response.get_json()
+    listed = asyncio.run(fetch())['endpoints']
+    assert set(listed) == _routes(quart_app.app)
@@ -0,0 +1,62 @@
+import pytest
+
+from utils.intent_router import classify_question, resolve_table
+
+
+@pytest.mark.parametrize('question, name, table, limit', [
+    ('Hi!', 'greeting', None, None),
+    ('thanks a lot', 'thanks', None, None),
+    ('what can you do?', 'help', None, None),
+    ('Please list all tables', 'list_tables', None, None),
+    ('What tables are there?', 'list_tables', None, None),
+    ('how many tables are there?', 'list_tables', None, None),
+    ('describe `orders`', 'describe', 'orders', None),
+    ('show me the columns of the order items table', 'describe', 'order items', None),
+    ('how many rows in users?', 'count', 'users', None),
+    ('How many customers are there', 'count', 'customers', None),
+    ('show 5 rows from products', 'preview', 'products', 5),
+    ('could you show the first 20 rows of orders please', 'preview', 'orders', 20),
+    ('preview inventory', 'preview', 'inventory', None),
+])
+def test_classifies_metadata_questions(question, name, table, limit):
+    intent = classify_question(question)
+    assert (intent.name, intent.table, intent.limit) == (name, table, limit)
+
+
+@pytest.mark.parametrize('question', [
+    'show orders where total > 100',
+    'hello, list tables',
+    'describe users; drop table users',
+    'which customers spent the most last month and what did they buy? ' * 3,
+    '',
+])
+def test_unclear_questions_go_to_the_agent(question):
+    assert classify_question(question) is None
+
+
+TABLES = ['Order_Items', 'users', 'categories', 'orders']
+
+
+@pytest.mark.parametrize('question', [
+    'how many customers ordered in March',
+    'count orders by status',
+    'show me orders from last week',
+    'show me the top 5 customers by revenue',
+    'explain the drop in sales last month',
+])
+def test_questions_with_conditions_dont_resolve_to_a_table(question):
+    # These match a pattern, but the captured "table" is not one, so the agent answers them
+    intent = classify_question(question)
+    assert intent is None or resolve_table(intent.table, TABLES) is None
+
+
+def test_resolve_table_spellings():
+    assert resolve_table('order items', TABLES) == 'Order_Items'
+    assert resolve_table('category', TABLES) == 'categories'
+    assert resolve_table('user', TABLES) == 'users'
+    assert resolve_table('products', TABLES) is None
+
+
+def test_resolve_table_prefers_exact_and_refuses_ambiguity():
+    assert resolve_table('user', ['users', 'user']) == 'user'
+    assert resolve_table('status', ['statu', 'statuses']) is None
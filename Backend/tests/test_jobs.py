@@ -0,0 +1,46 @@
+import threading
+import time
+
+import pytest
+
+from utils.jobs import JobQueue, QueueFull
+
+
+def wait_done(job, timeout=2):
+    deadline = time.time() + timeout
+    while not job.done and time.time() < deadline:
+        time.sleep(0.01)
+    return job
+
+
+def test_finished_fields_are_set_before_the_job_is_done():
+    jobs = JobQueue(workers=1, retention=0)
+    job = jobs.submit(lambda: {'error': 'boom'})
+    while True:
+        # Read status first, as pollers do: once it says done, the rest must be in place
+        if job.done:
+            assert job.finished_at is not None and job.error == 'boom'
+            break
+    assert job.status == 'failed'
+    jobs._sweep()  # Compares finished_at of done jobs
+    assert jobs.get(job.id) is None
+
+
+def test_successful_and_raising_jobs():
+    jobs = JobQueue(workers=2)
+    ok = wait_done(jobs.submit(lambda: {'response': 'hi'}, owner='s'))
+    assert ok.to_dict()['status'] == 'succeeded' and ok.to_dict()['result'] == {'response': 'hi'}
+    failed = wait_done(jobs.submit(lambda: 1 / 0, owner='s'))
+    assert failed.status == 'failed' and 'division by zero' in failed.error
+    assert jobs.get(ok.id, owner='other') is None
+
+
+def test_full_backlog_is_rejected():
+    release = threading.Event()
+    jobs = JobQueue(workers=1, max_pending=1)
+    jobs.submit(release.wait)
+    time.sleep(0.05)  # The worker has taken the first job
+    jobs.submit(release.wait)
+    with pytest.raises(QueueFull):
+        jobs.submit(release.wait)
+    release.set()
@@ -0,0 +1,42 @@
+import gzip
+import json
+
+from utils import negotiation
+from utils.negotiation import COLUMNAR_JSON, JSON, arrow_values, encode_response, to_columnar
+
+PAYLOAD = {'response': 'ok', 'columns': ['id', 'code'], 'rows': [[1, 'a'], [2, 7], [3, None]]}
+
+
+def test_plain_json_by_default():
+    body, headers = encode_response(PAYLOAD, '*/*')
+    assert headers['Content-Type'] == JSON and json.loads(body) == PAYLOAD
+
+
+def test_columnar_layout_and_types():
+    columnar = to_columnar(PAYLOAD)
+    assert columnar['data'] == [[1, 2, 3], ['a', 7, None]]
+    assert columnar['types'] == ['integer', 'mixed']
+
+
+def test_mixed_and_object_columns_become_strings_for_arrow():
+    assert arrow_values(['a', 7, None, True], 'mixed') == ['a', '7', None, 'true']
+    assert arrow_values([{'k': 1}, [1, 2]], 'object') == ['{"k": 1}', '[1, 2]']
+    assert arrow_values([1, 2], 'integer') == [1, 2]
+
+
+def test_failed_arrow_encoding_falls_back_to_columnar_json(monkeypatch):
+    def fail(payload):
+        raise OverflowError('int too big to convert')
+
+    monkeypatch.setattr(negotiation, 'pa', object())  # Offer Arrow as if pyarrow were installed
+    monkeypatch.setattr(negotiation, '_to_arrow', fail)
+    body, headers = encode_response(PAYLOAD, negotiation.ARROW)
+    assert headers['Content-Type'] == COLUMNAR_JSON
+    assert json.loads(body)['data'] == [[1, 2, 3], ['a', 7, None]]
+
+
+def test_large_bodies_are_compressed():
+    payload = {'columns': ['n'], 'rows': [[i] for i in range(1000)]}
+    body, headers = encode_response(payload, JSON, 'gzip')
+    assert headers['Content-Encoding'] == 'gzip'
+    assert json.loads(gzip.decompress(body)) == payload
@@ -0,0 +1,45 @@
+from utils.query_cache import QueryCache, normalize_question, signature, similarity
+
+
+def cache_with(question, similarity_threshold=1.1):
+    cache = QueryCache(similarity=similarity_threshold)
+    cache.put('db', 'fp', question, 'SELECT 1', 'answer', [(1,)])
+    return cache
+
+
+def test_normalization_folds_filler_synonyms_and_plurals():
+    assert normalize_question('Can you show me the number of customers?') == normalize_question('how many customer')
+
+
+def test_exact_normalized_match_hits():
+    cache = cache_with('How many orders were placed in 2023?')
+    assert cache.get('db', 'fp', 'how many orders were placed in 2023') is not None
+    assert cache.get('other-db', 'fp', 'how many orders were placed in 2023') is None
+    assert cache.get('db', 'new-fp', 'how many orders were placed in 2023') is None
+
+
+def test_near_duplicates_miss_by_default():
+    cache = cache_with('list customers with their total order value in 2023 sorted by total value descending')
+    assert cache.get('db', 'fp', 'list customers with their total order value in 2023 sorted by value descending') is None
+
+
+def test_swapped_words_are_not_similar():
+    first = normalize_question('customers referred most users')
+    second = normalize_question('users referred most customers')
+    assert similarity(first, second) < 0.9
+    cache = cache_with('customers referred most users', similarity_threshold=0.6)
+    assert cache.get('db', 'fp', 'users referred most customers') is None
+
+
+def test_direction_negation_and_numbers_must_match():
+    question = 'list customers with their total order value in 2023 sorted by total value descending'
+    cache = cache_with(question, similarity_threshold=0.8)
+    assert cache.get('db', 'fp', question.replace('descending', 'ascending')) is None
+    assert cache.get('db', 'fp', question.replace('2023', '2024')) is None
+    assert cache.get('db', 'fp', question.replace('with', 'without')) is None
+    # Same words, one extra filler-free word: a near duplicate
+    assert cache.get('db', 'fp', question.replace('order value', 'order value amount')) is not None
+
+
+def test_signature_keeps_order():
+    assert signature(normalize_question('top 5 highest')) != signature(normalize_question('highest top 5'))
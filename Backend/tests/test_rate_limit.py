@@ -0,0 +1,49 @@
+import asyncio
+
+import pytest
+
+from utils.rate_limit import RateLimiter, RateLimitTimeout
+
+
+def test_grants_immediately_with_capacity():
+    limiter = RateLimiter(rpm=60, tpm=10000, max_wait=1)
+    assert limiter.acquire(100, session='a') < 0.1
+    assert limiter.stats()['queue_depth'] == 0
+
+
+def test_times_out_and_leaves_queue_empty():
+    limiter = RateLimiter(rpm=1, tpm=10000, max_wait=0.2)
+    limiter.acquire(10, session='a')
+    with pytest.raises(RateLimitTimeout):
+        limiter.acquire(10, session='a')
+    assert limiter.stats()['queue_depth'] == 0
+
+
+def test_sessions_take_turns():
+    limiter = RateLimiter(rpm=60, tpm=10000)
+    tickets = [limiter._enqueue_locked(session, 1) for session in ('a', 'a', 'b')]
+    with limiter._cond:
+        assert limiter._try_grant_locked(tickets[0]) == 0
+        # Session b is served before a's second call
+        assert limiter._try_grant_locked(tickets[1]) is None
+        assert limiter._try_grant_locked(tickets[2]) == 0
+        assert limiter._try_grant_locked(tickets[1]) == 0
+
+
+def test_cancelled_async_waiter_is_removed_from_the_queue():
+    limiter = RateLimiter(rpm=1, tpm=10000, max_wait=5)
+
+    async def scenario():
+        await limiter.aacquire(10, session='a')  # Uses the only request this minute
+        waiter = asyncio.create_task(limiter.aacquire(10, session='a'))
+        await asyncio.sleep(0.1)
+        assert limiter.stats()['queue_depth'] == 1
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert limiter.stats()['queue_depth'] == 0
+        # Capacity comes back; the next caller is at the head of the queue, not behind a dead ticket
+        limiter._requests.level = limiter._requests.capacity
+        assert await asyncio.wait_for(limiter.aacquire(10, session='b'), timeout=1) < 1
+
+    asyncio.run(scenario())
@@ -0,0 +1,42 @@
+from utils.result_cache import ResultCache, normalize_sql, referenced_tables
+
+
+def test_tables_from_joins_comma_joins_and_subqueries():
+    sql = ('SELECT * FROM orders o, customers AS c JOIN shop.regions r ON r.id = c.region_id '
+           'WHERE o.customer_id = c.id AND o.id IN (SELECT order_id FROM order_items)')
+    assert referenced_tables(sql, 'postgresql') == {'orders', 'customers', 'regions', 'order_items'}
+
+
+def test_ctes_are_not_tables():
+    sql = 'WITH recent AS (SELECT * FROM orders) SELECT * FROM recent JOIN users ON users.id = recent.user_id'
+    assert referenced_tables(sql, 'postgresql') == {'orders', 'users'}
+
+
+def test_write_targets():
+    assert referenced_tables("UPDATE `Users` SET name = 'x'", 'mysql') == {'users'}
+    assert referenced_tables('INSERT INTO audit (id) SELECT id FROM users', 'postgresql') == {'audit', 'users'}
+    assert referenced_tables('DELETE FROM orders WHERE id = 1;', 'mysql') == {'orders'}
+
+
+def test_unparseable_statement_has_no_known_tables():
+    assert referenced_tables('SELEC * FORM (', 'postgresql') == set()
+
+
+def test_normalize_sql_folds_keywords_but_keeps_identifiers():
+    assert normalize_sql('select  *\nfrom orders ;', 'mysql') == normalize_sql('SELECT * FROM orders', 'mysql')
+    assert normalize_sql('SELECT * FROM `Orders`', 'mysql') != normalize_sql('SELECT * FROM `orders`', 'mysql')
+    assert normalize_sql('SELECT * FROM Orders', 'mysql') != normalize_sql('SELECT * FROM orders', 'mysql')
+    assert normalize_sql("SELECT 'A'", 'postgresql') != normalize_sql("SELECT 'a'", 'postgresql')
+
+
+def test_write_to_comma_joined_table_invalidates_the_read():
+    cache = ResultCache()
+    read = 'SELECT * FROM orders o, customers c WHERE o.customer_id = c.id'
+    cache.put('db', read, [(1,)], referenced_tables(read, 'postgresql'))
+    cache.invalidate('db', referenced_tables("UPDATE customers SET name = 'x'", 'postgresql'))
+    assert cache.get('db', read) is None
+
+
+def test_shortest_table_ttl_applies():
+    cache = ResultCache(table_ttls={'orders': 5})
+    assert cache.ttl_for({'orders', 'countries'}) == 5
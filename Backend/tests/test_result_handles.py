@@ -0,0 +1,74 @@
+import pytest
+from sqlalchemy import create_engine, text
+
+from utils.rate_limit import current_session
+from utils import result_handles
+from utils.result_handles import ResultStore, describe_handle
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f'sqlite:///{tmp_path}/rows.db')
+    with engine.begin() as connection:
+        connection.execute(text('CREATE TABLE items (id INTEGER, name TEXT)'))
+        connection.execute(text('INSERT INTO items VALUES (:id, :name)'),
+                           [{'id': i, 'name': f'item {i}'} for i in range(100)])
+    return engine
+
+
+def test_small_results_get_no_handle(engine):
+    store = ResultStore()
+    columns, rows, handle = store.open_sql(engine, 'db', 'SELECT * FROM items LIMIT 5', preview_rows=10)
+    assert columns == ['id', 'name'] and len(rows) == 5 and handle is None
+
+
+def test_agent_gets_a_count_and_preview_stats(engine):
+    store = ResultStore()
+    _, rows, handle = store.open_sql(engine, 'db', 'SELECT * FROM items ORDER BY id', preview_rows=10)
+    assert handle.row_count == 100
+    assert handle.preview_stats['id'] == {'nulls': 0, 'min': 0, 'max': 9}
+    summary = describe_handle(handle, len(rows))
+    assert 'first 10 of 100 rows' in summary and "Columns (first 10 rows): id (min 0, max 9, 0 nulls)" in summary
+
+
+def test_count_is_bounded(engine, monkeypatch):
+    monkeypatch.setattr(result_handles, 'RESULT_COUNT_LIMIT', 50)
+    _, rows, handle = ResultStore().open_sql(engine, 'db', 'SELECT * FROM items', preview_rows=10)
+    assert handle.row_count is None and handle.count_limit == 50
+    assert 'first 10 of more than 50 rows' in describe_handle(handle, len(rows))
+
+
+def test_pages_and_counts_lazily(engine):
+    store = ResultStore()
+    _, rows, handle = store.open_sql(engine, 'db', 'SELECT * FROM items ORDER BY id', preview_rows=10)
+    assert len(rows) == 10
+    assert not handle.counted and not handle.stats
+
+    page = store.page(handle, cursor='5', limit=30)
+    assert handle.counted and page['row_count'] == 100
+    assert handle.stats['id'] == {'nulls': 0, 'min': 0, 'max': 99}
+    assert [row[0] for row in page['rows']] == list(range(5, 35))
+    assert store.page(handle, cursor='90', limit=30)['next_cursor'] is None
+    assert store.get(handle.id, 'other-db') is None
+
+
+def test_open_cursors_are_capped_per_database(engine):
+    store = ResultStore(max_open_per_database=2)
+    handles = [store.open_sql(engine, 'db', 'SELECT * FROM items', preview_rows=10)[2] for _ in range(4)]
+    assert [handle.is_open for handle in handles] == [False, False, True, True]
+    # A closed cursor is reopened transparently
+    assert store.page(handles[0], cursor='50', limit=5)['rows'][0][0] == 50
+
+
+def test_release_only_drops_the_sessions_handles(engine):
+    store = ResultStore()
+    token = current_session.set('alice')
+    mine = store.open_sql(engine, 'db', 'SELECT * FROM items', preview_rows=10)[2]
+    current_session.reset(token)
+    token = current_session.set('bob')
+    theirs = store.open_sql(engine, 'db', 'SELECT * FROM items', preview_rows=10)[2]
+    current_session.reset(token)
+
+    store.release('db', owner='alice')
+    assert store.get(mine.id, 'db') is None and not mine.is_open
+    assert store.get(theirs.id, 'db') is theirs
@@ -0,0 +1,63 @@
+import threading
+
+import pytest
+from sqlalchemy import text
+
+from utils.schema_cache import SchemaCache, get_sql_database
+from utils.sql_validator import SQLValidationError
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = get_sql_database(f'sqlite:///{tmp_path}/shop.db', cache=SchemaCache())
+    with db._engine.begin() as connection:
+        connection.execute(text('CREATE TABLE orders (id INTEGER PRIMARY KEY, total NUMERIC)'))
+        connection.execute(text('INSERT INTO orders VALUES (1, 5), (2, 500)'))
+        connection.execute(text('CREATE VIEW big_orders AS SELECT * FROM orders WHERE total > 100'))
+    db._cache.mark_stale(db.identity)
+    return db
+
+
+def test_views_can_be_queried(db):
+    assert db.run('SELECT id, total FROM big_orders') == '[(2, 500)]'
+    assert 'big_orders' not in db.get_usable_table_names()
+
+
+def test_unknown_tables_are_still_refused(db):
+    with pytest.raises(SQLValidationError, match='Available tables: big_orders, orders'):
+        db.run('SELECT * FROM invoices')
+
+
+def test_repaired_reads_say_what_ran(db):
+    result = db.run('SELECT totl FROM orders WHERE id = 2')
+    assert result.startswith('[(500,)]')
+    assert "column 'totl' -> 'total'" in result and 'ran: SELECT total FROM orders WHERE id = 2' in result
+
+
+def test_concurrent_reflection_on_a_shared_database(tmp_path):
+    db = get_sql_database(f'sqlite:///{tmp_path}/wide.db', cache=SchemaCache())
+    names = [f'table_{i}' for i in range(30)]
+    with db._engine.begin() as connection:
+        for name in names:
+            connection.execute(text(f'CREATE TABLE {name} (id INTEGER PRIMARY KEY, value TEXT)'))
+    db._cache.mark_stale(db.identity)
+    entry = db._schema_entry()
+    errors = []
+
+    def describe():
+        try:
+            for _ in range(5):
+                info = db.get_table_info(names)
+                assert all(f'CREATE TABLE {name}' in info for name in names)
+                # Forget the cached definitions (as a schema change would) so the next round reflects again
+                with entry.reflect_lock:
+                    entry.table_info.clear()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=describe) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
@@ -0,0 +1,91 @@
+import pytest
+
+from utils.sql_validator import SQLValidationError, validate_sql
+
+TABLES = ['users', 'order_items', 'Orders']
+COLUMNS = {
+    'users': ['id', 'name', 'status'],
+    'order_items': ['id', 'order_id', 'quantity'],
+    'Orders': ['id', 'user_id', 'total'],
+}
+
+
+def validate(sql, dialect='postgresql'):
+    return validate_sql(sql, dialect, TABLES, lambda tables: {table: COLUMNS[table] for table in tables})
+
+
+def test_valid_read_is_returned_unchanged():
+    sql = 'SELECT u.name FROM users AS u WHERE u.status = \'active\''
+    assert validate(sql) == (sql, [])
+
+
+def test_read_repairs_near_miss_names():
+    sql, repairs = validate('SELECT o.quantity, u.statu FROM order_item AS o JOIN users AS u ON u.id = o.order_id')
+    assert sql == 'SELECT o.quantity, u.status FROM order_items AS o JOIN users AS u ON u.id = o.order_id'
+    assert len(repairs) == 2
+
+
+def test_case_repair_requotes_for_postgres():
+    sql, repairs = validate('SELECT total FROM orders')
+    assert sql == 'SELECT total FROM "Orders"'
+    assert repairs
+
+
+def test_unknown_table_lists_available_tables():
+    with pytest.raises(SQLValidationError, match='Available tables'):
+        validate('SELECT * FROM invoices')
+
+
+@pytest.mark.parametrize('sql', [
+    'DELETE FROM order_item WHERE id = 1',
+    "UPDATE users SET statu = 'x' WHERE id = 1",
+    'INSERT INTO order_items (order_id, quantiy) VALUES (1, 2)',
+])
+def test_write_near_miss_is_suggested_not_rewritten(sql):
+    with pytest.raises(SQLValidationError, match='Did you mean'):
+        validate(sql)
+
+
+def test_write_keeps_case_repairs():
+    sql, repairs = validate('DELETE FROM orders WHERE ID = 1')
+    assert sql == 'DELETE FROM "Orders" WHERE id = 1'
+    assert repairs
+
+
+def test_insert_column_list_is_checked():
+    sql, _ = validate('INSERT INTO order_items (ORDER_ID, quantity) VALUES (1, 2)')
+    assert sql == 'INSERT INTO order_items (order_id, quantity) VALUES (1, 2)'
+    with pytest.raises(SQLValidationError, match='does not exist'):
+        validate('INSERT INTO order_items (order_id, colour) VALUES (1, 2)')
+
+
+def test_data_modifying_cte_counts_as_write():
+    with pytest.raises(SQLValidationError, match='Did you mean'):
+        validate('WITH d AS (DELETE FROM order_item RETURNING id) SELECT * FROM d')
+
+
+def test_foreign_dialect_read_is_transpiled():
+    sql, repairs = validate('SELECT TOP 5 name FROM users')
+    assert sql == 'SELECT name FROM users LIMIT 5'
+    assert repairs == ['rewrote tsql syntax for postgres']
+
+
+def test_foreign_dialect_write_returns_the_rewrite():
+    with pytest.raises(SQLValidationError, match='Written for postgres'):
+        validate("UPDATE users SET name = 'x' WHERE id = (SELECT TOP 1 id FROM users)")
+
+
+def test_multiple_statements_are_rejected():
+    with pytest.raises(SQLValidationError, match='one SQL statement'):
+        validate('SELECT 1; SELECT 2')
+
+
+def test_views_are_known_by_name_only():
+    # get_columns only knows base tables; a view's columns go unchecked
+    relations = TABLES + ['big_orders']
+    columns = lambda tables: {table: COLUMNS[table] for table in tables if table in COLUMNS}
+    sql = 'SELECT anything FROM big_orders AS b JOIN users AS u ON u.id = b.user_id WHERE b.total > 10'
+    assert validate_sql(sql, 'postgresql', relations, columns) == (sql, [])
+    with pytest.raises(SQLValidationError, match="Column 'colour'"):
+        validate_sql('SELECT u.colour FROM big_orders AS b JOIN users AS u ON u.id = b.user_id',
+                     'postgresql', relations, columns)
@@ -0,0 +1,163 @@
+import datetime
+import decimal
+import uuid
+
+import pytest
+from sqlalchemy import text
+
+from utils.history import history_store
+from utils.pool import database_identity, get_engine
+from utils.rate_limit import current_session
+from utils.undo import (RevertConflict, RevertError, _decode_row, _encode_row, _table_parts, current_changes,
+                        execute_write, plan_write, take_captured_changes, undo_change)
+
+
+# --- Statement parsing -----------------------------------------------------
+
+def test_update_with_alias_strips_qualified_set_columns():
+    plan = plan_write("UPDATE users AS u SET u.name = 'x', email = 'a=b' WHERE u.id = 1 RETURNING id", 'postgresql')
+    assert (plan.operation, plan.table, plan.alias) == ('update', 'users', 'u')
+    assert plan.columns == ['name', 'email']
+    assert plan.condition == 'WHERE u.id = 1'
+    assert plan.revertible
+
+
+def test_delete_with_alias():
+    plan = plan_write("DELETE FROM logs l WHERE l.level = 'debug';", 'postgresql')
+    assert (plan.table, plan.alias, plan.condition) == ('logs', 'l', "WHERE l.level = 'debug'")
+
+
+def test_mysql_order_by_limit_is_part_of_the_condition():
+    plan = plan_write('UPDATE users SET score = score + 1 ORDER BY score DESC LIMIT 5', 'mysql')
+    assert plan.alias is None and plan.columns == ['score']
+    assert plan.condition == 'ORDER BY score DESC LIMIT 5'
+    plan = plan_write('DELETE FROM logs ORDER BY created_at LIMIT 10', 'mysql')
+    assert (plan.alias, plan.condition) == (None, 'ORDER BY created_at LIMIT 10')
+
+
+def test_keywords_inside_strings_and_subqueries_are_ignored():
+    plan = plan_write("UPDATE shop.orders SET note = 'from; where' WHERE id IN (SELECT id FROM x)", 'postgresql')
+    assert plan.revertible and plan.columns == ['note']
+    assert plan.condition == 'WHERE id IN (SELECT id FROM x)'
+    assert _table_parts(plan.table, 'postgresql') == ('shop', 'orders')
+    assert _table_parts('"Shop"."Orders"', 'postgresql') == ('Shop', 'Orders')
+    assert _table_parts('Orders', 'mysql') == (None, 'Orders')
+
+
+@pytest.mark.parametrize('sql, dialect', [
+    ('INSERT INTO t (a, b) VALUES (1, 2) ON DUPLICATE KEY UPDATE b = 3', 'mysql'),
+    ('INSERT INTO t (a) VALUES (1) ON CONFLICT (a) DO UPDATE SET a = excluded.a', 'postgresql'),
+    ('INSERT INTO t (a) VALUES (1) ON CONFLICT(a) DO UPDATE SET a = 2', 'sqlite'),
+])
+def test_upserts_are_not_revertible(sql, dialect):
+    plan = plan_write(sql, dialect)
+    assert plan.operation == 'insert' and not plan.revertible
+
+
+def test_insert_columns_and_source():
+    plan = plan_write('INSERT INTO t ("A", b) SELECT x, y FROM u', 'postgresql')
+    assert plan.insert_columns == ['A', 'b'] and plan.insert_source == 'select'
+    assert plan_write('INSERT INTO t (a) VALUES (1) ON CONFLICT DO NOTHING', 'postgresql').revertible
+
+
+@pytest.mark.parametrize('sql', [
+    'UPDATE t SET a = 1; DELETE FROM t',
+    'DELETE FROM t USING u WHERE t.id = u.id',
+    'UPDATE t SET a = u.a FROM u WHERE t.id = u.id',
+    'REPLACE INTO t (a) VALUES (1)',
+    'DROP TABLE t',
+])
+def test_statements_that_cant_be_captured(sql):
+    plan = plan_write(sql, 'postgresql')
+    assert not plan.revertible and plan.note
+
+
+def test_reads_are_not_writes():
+    assert plan_write('SELECT 1', 'sqlite') is None
+    assert plan_write("UPDATE t SET a = 'x;y' WHERE id = 1;", 'sqlite').revertible
+
+
+# --- Value encoding --------------------------------------------------------
+
+def test_values_round_trip_with_their_types():
+    values = [
+        None, 1, 2.5, 'text', True,
+        datetime.datetime(2024, 1, 2, 3, 4, 5, 678901, tzinfo=datetime.timezone.utc),
+        datetime.date(2024, 1, 2), datetime.time(13, 14, 15), datetime.timedelta(days=2, microseconds=5),
+        decimal.Decimal('12345678901234567890.000000001'), b'\x00\xff', memoryview(b'ab'),
+        uuid.UUID('12345678-1234-5678-1234-567812345678'), [datetime.date(2024, 1, 1), 2],
+    ]
+    decoded = _decode_row(_encode_row(values))
+    assert decoded[:-3] == values[:-3]
+    assert decoded[-3:] == [b'ab', values[-2], values[-1]]
+    assert type(decoded[9]) is decimal.Decimal
+
+
+def test_json_values_come_back_as_json_text():
+    assert _decode_row(_encode_row([{'a': [1, 2]}])) == ['{"a": [1, 2]}']
+
+
+# --- SQLite capture and revert ---------------------------------------------
+
+@pytest.fixture
+def database(tmp_path):
+    db_uri = f'sqlite:///{tmp_path}/shop.db'
+    engine = get_engine(db_uri, 'read-write')
+    with engine.begin() as connection:
+        connection.execute(text('CREATE TABLE items (id INTEGER PRIMARY KEY, name TEXT, price NUMERIC, data BLOB)'))
+        connection.execute(text('INSERT INTO items VALUES (:id, :name, :price, :data)'),
+                           [{'id': i, 'name': f'item {i}', 'price': i * 1.5, 'data': bytes([i])} for i in range(10)])
+    session_token = current_session.set('undo-test')
+    changes_token = current_changes.set([])
+    yield db_uri, engine
+    current_changes.reset(changes_token)
+    current_session.reset(session_token)
+
+
+def _rows(engine):
+    with engine.connect() as connection:
+        return connection.execute(text('SELECT * FROM items ORDER BY id')).fetchall()
+
+
+def _change(db_uri, engine, *statements):
+    for sql in statements:
+        execute_write(engine, database_identity(db_uri), sql)
+    return history_store.record('undo-test', 'question', 'change', take_captured_changes())['id']
+
+
+def test_capture_and_revert_round_trip(database):
+    db_uri, engine = database
+    before = _rows(engine)
+    change_id = _change(
+        db_uri, engine,
+        'UPDATE items AS i SET name = upper(i.name), price = 0 WHERE i.id < 5',
+        'DELETE FROM items WHERE id >= 8',
+        "INSERT INTO items (name) VALUES ('new'), ('newer')",  # Reuses ids 8 and 9
+    )
+    assert _rows(engine) != before
+
+    entry = undo_change(db_uri, 'sqlite', 'read-write', 'undo-test', change_id)
+    assert entry['reverted'] and entry['rows_restored'] == 9
+    assert _rows(engine) == before
+    with pytest.raises(RevertError, match='already been reverted'):
+        undo_change(db_uri, 'sqlite', 'read-write', 'undo-test', change_id)
+
+
+def test_revert_refuses_rows_changed_since(database):
+    db_uri, engine = database
+    change_id = _change(db_uri, engine, "UPDATE items SET name = 'renamed' WHERE id = 1")
+    with engine.begin() as connection:
+        connection.execute(text('DELETE FROM items WHERE id = 1'))
+
+    with pytest.raises(RevertConflict):
+        undo_change(db_uri, 'sqlite', 'read-write', 'undo-test', change_id)
+    assert not history_store.get('undo-test', change_id)['reverted']
+
+
+def test_uncapturable_change_is_not_reverted(database):
+    db_uri, engine = database
+    upsert = "INSERT INTO items (id, name) VALUES (1, 'x') ON CONFLICT(id) DO UPDATE SET name = 'x'"
+    change_id = _change(db_uri, engine, upsert)
+    assert _rows(engine)[1].name == 'x'
+    with pytest.raises(RevertError, match='Upserts'):
+        undo_change(db_uri, 'sqlite', 'read-write', 'undo-test', change_id)
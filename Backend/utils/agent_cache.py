@@ -0,0 +1,76 @@
+# Backend/utils/agent_cache.py
+#
+# Cache of fully built agent executors. Every /query used to rebuild the
+# toolkit, its tools, the prompt template, the tool-calling agent and the
+# AgentExecutor before the first LLM call, which is tens of milliseconds of
+# pure Python per request. Executors hold no per-run state, so one per
+# (database, db type, mode, streaming) is shared by all requests until the
+# schema changes or the database is disconnected. An executor's tools hold the
+# pooled engine / MongoClient it was built with, so an entry is also dropped
+# when utils/pool.py closes that resource (idle sweep, LRU eviction).
+
+import os
+import threading
+from collections import OrderedDict
+
+AGENT_CACHE_MAX_ENTRIES = int(os.getenv('AGENT_CACHE_MAX_ENTRIES', 64))
+
+
+class _CachedAgent:
+    def __init__(self, executor, fingerprint, resource):
+        self.executor = executor
+        self.fingerprint = fingerprint
+        self.resource = resource
+
+
+class AgentCache:
+    """
+    LRU of agent executors; an entry is rebuilt when its schema fingerprint
+    changes or it was built on a different pooled engine / client.
+    """
+
+    def __init__(self, max_entries=AGENT_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, identity, db_type, mode, streaming, fingerprint, build, resource=None):
+        """
+        Returns the cached executor, or calls build() and caches its result.
+        `resource` is the pooled engine / client the executor is built on.
+        """
+        key = (identity, db_type, mode, streaming)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.fingerprint == fingerprint and entry.resource is resource:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry.executor
+            self.misses += 1
+
+        # Built outside the lock; if two requests race, both executors are valid
+        executor = build()
+        with self._lock:
+            self._entries[key] = _CachedAgent(executor, fingerprint, resource)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return executor
+
+    def invalidate(self, identity, mode=None):
+        """Drops the executors for a database (optionally only one mode)."""
+        with self._lock:
+            stale = [key for key in self._entries if key[0] == identity and (mode is None or key[2] == mode)]
+            for key in stale:
+                del self._entries[key]
+        return len(stale)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+# Process-wide singleton
+agent_cache = AgentCache()
@@ -0,0 +1,320 @@
+# Backend/utils/cost_guard.py
+#
+# Pre-execution cost check for statements the agent generates. Read-only mode
+# keeps data safe, but not the database: an unbounded `SELECT * FROM events`
+# or an accidental cartesian join could saturate the shared server for every
+# user. Before a statement runs, the planner's estimate is fetched (EXPLAIN
+# for SQL, explain() for MongoDB pipelines) and compared with configurable
+# budgets:
+#   - a read that would return too many rows is rewritten with a LIMIT
+#     (a $limit stage for MongoDB) and the agent is told the result was capped
+#   - a statement that is too expensive to run at all is refused with the
+#     estimate, so the agent can add filters or aggregate instead
+# Only the estimate is fetched; EXPLAIN without ANALYZE never executes anything.
+
+import json
+import os
+import re
+import time
+
+from bson.json_util import dumps
+from langchain_mongodb.agent_toolkit import MongoDBDatabase
+from pymongo.errors import PyMongoError
+from sqlalchemy.exc import SQLAlchemyError
+
+from utils.metrics import db_query_seconds, db_rows
+from utils.result_handles import RESULT_HANDLES_ENABLED, describe_handle, result_store
+from utils.sql_validator import SQLGLOT_DIALECTS, sqlglot
+from utils.undo import UNDO_MAX_ROWS, is_write_pipeline, run_write_pipeline
+
+if sqlglot is not None:
+    from sqlglot import exp
+    from sqlglot.errors import SqlglotError
+
+QUERY_COST_GUARD_ENABLED = os.getenv('QUERY_COST_GUARD', 'true').lower() in ('1', 'true', 'yes')
+# Rows a read may return before it is capped with QUERY_AUTO_LIMIT
+QUERY_MAX_ESTIMATED_ROWS = int(os.getenv('QUERY_MAX_ESTIMATED_ROWS', 100000))
+# Planner cost units (Postgres/MySQL) above which a statement is refused
+QUERY_MAX_ESTIMATED_COST = float(os.getenv('QUERY_MAX_ESTIMATED_COST', 1000000))
+# Rows an UPDATE/DELETE may touch; writes are never rewritten, only refused.
+# Defaults to undo's capture limit (UNDO_MAX_ROWS), so a write small enough to be
+# captured for /revert is never refused; a lower value refuses revertible writes too.
+QUERY_MAX_WRITE_ROWS = int(os.getenv('QUERY_MAX_WRITE_ROWS', UNDO_MAX_ROWS))
+# Documents a MongoDB pipeline may scan without using an index
+QUERY_MAX_SCANNED_DOCUMENTS = int(os.getenv('QUERY_MAX_SCANNED_DOCUMENTS', 1000000))
+QUERY_AUTO_LIMIT = int(os.getenv('QUERY_AUTO_LIMIT', 1000))
+
+EXPLAIN_PREFIXES = {'postgresql': 'EXPLAIN (FORMAT JSON) ', 'mysql': 'EXPLAIN FORMAT=JSON '}
+
+GUARDED_STATEMENT = re.compile(r'^\s*(select|with|update|delete)\b', re.IGNORECASE)
+WRITE_STATEMENT = re.compile(r'^\s*(update|delete)\b', re.IGNORECASE)
+# Fallback when sqlglot is missing; MySQL's `LIMIT offset, count` puts the row count second
+TRAILING_LIMIT = re.compile(r'\blimit\s+(\d+)(?:\s*,\s*(\d+)|\s+offset\s+\d+)?\s*$', re.IGNORECASE)
+
+# Pipeline stages that must see every input document, so a trailing $limit doesn't bound the scan
+BLOCKING_STAGES = ('$group', '$sort', '$count', '$bucket', '$bucketAuto', '$facet', '$sortByCount')
+
+
+class QueryTooExpensive(SQLAlchemyError):
+    """
+    The planner's estimate is over budget. Subclasses SQLAlchemyError so the
+    query tool's run_no_throw hands the reason back to the agent.
+    """
+
+
+class PipelineTooExpensive(PyMongoError):
+    """MongoDB counterpart of QueryTooExpensive (run_no_throw catches PyMongoError)."""
+
+
+class PlanEstimate:
+    def __init__(self, rows, cost):
+        self.rows = rows
+        self.cost = cost
+
+    def __repr__(self):
+        return f'PlanEstimate(rows={self.rows}, cost={self.cost})'
+
+
+def _walk(node):
+    """Yields every dict nested anywhere in a JSON plan."""
+    if isinstance(node, dict):
+        yield node
+        for value in node.values():
+            yield from _walk(value)
+    elif isinstance(node, list):
+        for item in node:
+            yield from _walk(item)
+
+
+def _load_plan(rows):
+    if not rows:
+        return None
+    plan = next(iter(rows[0].values()))
+    # psycopg2 decodes the json column itself; other drivers return text
+    return json.loads(plan) if isinstance(plan, (str, bytes)) else plan
+
+
+def _postgres_estimate(plan):
+    top = plan[0]['Plan']
+    node = top
+    if top.get('Node Type') == 'ModifyTable' and top.get('Plans'):
+        # UPDATE/DELETE report 0 output rows; the rows touched are the child's
+        node = top['Plans'][0]
+    return PlanEstimate(float(node.get('Plan Rows', 0)), float(top.get('Total Cost', 0)))
+
+
+def _mysql_estimate(plan):
+    block = plan.get('query_block', {})
+    cost = float(block.get('cost_info', {}).get('query_cost', 0))
+    # The last table of a nested-loop join produces the product of the joins, so the
+    # largest rows_produced_per_join is the size of the result before any LIMIT
+    rows = 0.0
+    for node in _walk(plan):
+        for key in ('rows_produced_per_join', 'rows_examined_per_scan'):
+            if key in node:
+                rows = max(rows, float(node[key]))
+    return PlanEstimate(rows, cost)
+
+
+def estimate_sql(execute, dialect, sql):
+    """
+    Returns the planner's PlanEstimate for a statement, or None when the dialect
+    has no usable estimates or EXPLAIN itself fails (the real run reports the error).
+    `execute` is SQLDatabase._execute, so the session's schema settings apply.
+    """
+    prefix = EXPLAIN_PREFIXES.get(dialect)
+    if prefix is None:
+        return None
+    try:
+        plan = _load_plan(execute(prefix + sql))
+    except SQLAlchemyError:
+        return None
+    if not plan:
+        return None
+    try:
+        return _postgres_estimate(plan) if dialect == 'postgresql' else _mysql_estimate(plan)
+    except (KeyError, IndexError, TypeError, ValueError):
+        return None
+
+
+def _describe(estimate):
+    return f'~{estimate.rows:,.0f} rows, cost {estimate.cost:,.0f}'
+
+
+def _parse_read(dialect, sql):
+    """The sqlglot tree of a single SELECT (or UNION etc.), or None when it can't be parsed."""
+    if sqlglot is None or dialect not in SQLGLOT_DIALECTS:
+        return None
+    try:
+        trees = [tree for tree in sqlglot.parse(sql, read=SQLGLOT_DIALECTS[dialect]) if tree is not None]
+    except SqlglotError:
+        return None
+    if len(trees) != 1 or not isinstance(trees[0], exp.Query):
+        return None
+    return trees[0]
+
+
+def _row_limit(dialect, sql):
+    """Rows the statement's own LIMIT (or FETCH FIRST) allows, or None."""
+    tree = _parse_read(dialect, sql)
+    if tree is None:
+        if sqlglot is not None and dialect in SQLGLOT_DIALECTS:
+            return None
+        match = TRAILING_LIMIT.search(sql)
+        return int(match.group(2) or match.group(1)) if match else None
+    clause = tree.args.get('limit')
+    if isinstance(clause, exp.Fetch):
+        options = clause.args.get('limit_options') or clause
+        if options.args.get('percent'):
+            return None
+        count = clause.args.get('count')
+    elif isinstance(clause, exp.Limit):
+        count = clause.expression
+    else:
+        return None
+    return int(count.name) if isinstance(count, exp.Literal) and count.is_int else None
+
+
+def _cap_rows(dialect, sql, rows):
+    """
+    The statement with its own LIMIT set to `rows` (keeping ORDER BY and any
+    OFFSET), or None if it can't be rewritten safely. Wrapping it in
+    `SELECT * FROM (...) LIMIT n` instead would let MySQL drop the inner ORDER BY.
+    """
+    tree = _parse_read(dialect, sql)
+    if tree is not None:
+        return tree.limit(rows).sql(dialect=SQLGLOT_DIALECTS[dialect])
+    if sqlglot is None and not TRAILING_LIMIT.search(sql):
+        # On its own line so a trailing -- comment can't swallow it
+        return f'{sql}\nLIMIT {rows}'
+    return None
+
+
+def guard_sql(execute, dialect, sql):
+    """
+    Checks one statement against the budgets before it runs. Returns
+    (statement_to_run, note); `note` explains a rewrite and is empty otherwise.
+    Raises QueryTooExpensive when the statement must not run as written.
+    """
+    if not QUERY_COST_GUARD_ENABLED or not GUARDED_STATEMENT.match(sql):
+        return sql, ''
+    sql = sql.strip().rstrip(';')
+    estimate = estimate_sql(execute, dialect, sql)
+    if estimate is None:
+        return sql, ''
+
+    if WRITE_STATEMENT.match(sql):
+        if estimate.rows > QUERY_MAX_WRITE_ROWS:
+            raise QueryTooExpensive(
+                f'Statement refused: it would modify {_describe(estimate)}, over the limit of '
+                f'{QUERY_MAX_WRITE_ROWS:,} rows. Narrow the WHERE clause or split the change into batches.'
+            )
+        return sql, ''
+
+    limit = _row_limit(dialect, sql)
+    # MySQL's row estimates ignore LIMIT, so an explicit one bounds the result
+    rows = min(estimate.rows, float(limit)) if limit is not None else estimate.rows
+    if rows <= QUERY_MAX_ESTIMATED_ROWS and estimate.cost <= QUERY_MAX_ESTIMATED_COST:
+        return sql, ''
+
+    if limit is None or limit > QUERY_AUTO_LIMIT:
+        # A LIMIT lets the planner stop early; keep it if that brings the cost into budget
+        limited = _cap_rows(dialect, sql, QUERY_AUTO_LIMIT)
+        capped = estimate_sql(execute, dialect, limited) if limited else None
+        if capped is not None and capped.cost <= QUERY_MAX_ESTIMATED_COST:
+            return limited, (
+                f'Result capped at {QUERY_AUTO_LIMIT:,} rows: the query was estimated at {_describe(estimate)}. '
+                'Use aggregates or a narrower WHERE clause if the full result matters.'
+            )
+
+    raise QueryTooExpensive(
+        f'Query refused: estimated {_describe(estimate)} (budget {QUERY_MAX_ESTIMATED_ROWS:,} rows, '
+        f'cost {QUERY_MAX_ESTIMATED_COST:,.0f}). Add selective WHERE conditions, join on keys '
+        '(avoid cartesian joins), aggregate, or add a LIMIT.'
+    )
+
+
+def _winning_stages(explain):
+    return {node['stage'] for node in _walk(explain) if isinstance(node.get('stage'), str)}
+
+
+def guard_pipeline(database, collection, pipeline):
+    """
+    MongoDB version of guard_sql for an aggregation pipeline. Returns
+    (pipeline_to_run, note); raises PipelineTooExpensive when over budget.
+    """
+    if not QUERY_COST_GUARD_ENABLED:
+        return pipeline, ''
+    try:
+        explain = database.command(
+            'explain', {'aggregate': collection, 'pipeline': pipeline, 'cursor': {}}, verbosity='queryPlanner'
+        )
+        documents = database[collection].estimated_document_count()
+    except PyMongoError:
+        return pipeline, ''  # Let the real run report the problem
+
+    stages = {key for stage in pipeline if isinstance(stage, dict) for key in stage}
+    has_limit = '$limit' in stages
+    # A $limit can't be appended after $out/$merge, and would silently truncate the write before it
+    streaming = not any(stage in stages for stage in BLOCKING_STAGES) and not is_write_pipeline(pipeline)
+
+    if 'COLLSCAN' in _winning_stages(explain) and documents > QUERY_MAX_SCANNED_DOCUMENTS:
+        if streaming and not has_limit:
+            # Without blocking stages a $limit stops the scan early
+            return pipeline + [{'$limit': QUERY_AUTO_LIMIT}], (
+                f'Result capped at {QUERY_AUTO_LIMIT:,} documents: the pipeline would scan all '
+                f'~{documents:,} documents of {collection}. Add a $match on an indexed field.'
+            )
+        raise PipelineTooExpensive(
+            f'Pipeline refused: it would scan all ~{documents:,} documents of {collection} without an index '
+            f'(budget {QUERY_MAX_SCANNED_DOCUMENTS:,}). Start with a $match on an indexed field.'
+        )
+
+    if streaming and not has_limit and documents > QUERY_MAX_ESTIMATED_ROWS:
+        return pipeline + [{'$limit': QUERY_AUTO_LIMIT}], (
+            f'Result capped at {QUERY_AUTO_LIMIT:,} documents: {collection} holds ~{documents:,} documents. '
+            'Use $group/$count or a narrower $match if the full result matters.'
+        )
+    return pipeline, ''
+
+
+class GuardedMongoDBDatabase(MongoDBDatabase):
+    """
+    MongoDBDatabase whose `run` (behind `mongodb_query`) checks pipelines with
+    guard_pipeline first and returns large results as a preview plus a result
+    handle (utils/result_handles.py) instead of every document. $out/$merge
+    pipelines capture the documents they replace first (utils/undo.py).
+    """
+
+    def __init__(self, client, database, identity=None, **kwargs):
+        super().__init__(client, database, **kwargs)
+        self.identity = identity
+
+    def count_documents(self, collection):
+        """Whole-collection count from the collection's metadata, without a scan."""
+        return self._db[collection].estimated_document_count()
+
+    def run(self, command):
+        if not isinstance(command, str) or not command.startswith('db.') or '.aggregate(' not in command:
+            return super().run(command)
+        collection = command.split('.')[1]
+        if collection not in self.get_usable_collection_names():
+            return super().run(command)  # Raises the usual error
+
+        started = time.perf_counter()
+        pipeline, note = guard_pipeline(self._db, collection, self._parse_command(command))
+        if is_write_pipeline(pipeline):
+            result = dumps(run_write_pipeline(self._db, self.identity, collection, pipeline), indent=2)
+        else:
+            if RESULT_HANDLES_ENABLED:
+                _, documents, handle = result_store.open_mongo(self._db, collection, pipeline, self.identity)
+                result = json.dumps(documents, indent=2)
+                if handle is not None:
+                    result = f'{result}\n{describe_handle(handle, len(documents))}'
+            else:
+                documents = list(self._db[collection].aggregate(pipeline))
+                result = dumps(documents, indent=2)
+            db_rows.observe(len(documents), db_type='mongodb')
+        db_query_seconds.observe(time.perf_counter() - started, db_type='mongodb',
+                                 kind='write' if is_write_pipeline(pipeline) else 'read')
+        return f'{result}\n-- {note}' if note else result
@@ -117,4 +117,61 @@
 #     except Exception as e:
 #         error_msg = f"Error in delete_student with filters {filters}: {e}"
 #         print(f"ERROR: {error_msg}")
-#         return error_msg
\ No newline at end of file
+#         return error_msg
+
+# Connection-URI helpers shared by the Flask app (routes/query.py) and the
+# ASGI app (routes/async_query.py).
+
+def build_db_uri(data: dict) -> tuple[str, str]:
+    """
+    Builds the SQLAlchemy/MongoDB URI from a /connect request body.
+    Returns (db_uri, db_type) with Supabase treated as PostgreSQL.
+    Raises ValueError with a user-facing message if details are missing.
+    """
+    db_type = data.get('db_type')
+
+    # Construct the database URI based on the selected type
+    if db_type in ['postgresql', 'mysql', 'supabase']:
+        # For Supabase and cloud databases, check if connection_string is provided
+        connection_string = data.get('connection_string')
+
+        if connection_string:
+            # Use the full connection string directly
+            if db_type == 'supabase':
+                # Supabase uses PostgreSQL protocol
+                if not connection_string.startswith('postgresql://'):
+                    connection_string = 'postgresql://' + connection_string
+                db_uri = connection_string.replace('postgresql://', 'postgresql+psycopg2://')
+            elif db_type == 'postgresql':
+                if connection_string.startswith('postgresql://') or connection_string.startswith('postgres://'):
+                    db_uri = connection_string.replace('postgresql://', 'postgresql+psycopg2://').replace('postgres://', 'postgresql+psycopg2://')
+                else:
+                    db_uri = 'postgresql+psycopg2://' + connection_string
+            else:  # mysql
+                if not connection_string.startswith('mysql://'):
+                    connection_string = 'mysql://' + connection_string
+                db_uri = connection_string.replace('mysql://', 'mysql+pymysql://')
+        else:
+            # Use individual credentials (legacy support)
+            user = data.get('user')
+            password = data.get('password')
+            host = data.get('host')
+            dbname = data.get('dbname')
+            port = data.get('port', 5432 if db_type in ['postgresql', 'supabase'] else 3306)
+
+            if not all([user, password, host, dbname]):
+                raise ValueError('Missing connection details. Provide either a connection string or individual credentials.')
+
+            if db_type in ['postgresql', 'supabase']:
+                db_uri = f"postgresql+psycopg2://{user}:{password}@{host}:{port}/{dbname}"
+            else:  # mysql
+                db_uri = f"mysql+pymysql://{user}:{password}@{host}:{port}/{dbname}"
+
+    elif db_type == 'mongodb':
+        db_uri = data.get('connection_string') or data.get('db_uri')
+        if not db_uri:
+            raise ValueError('Missing connection string for MongoDB')
+    else:
+        raise ValueError('Unsupported database type')
+
+    return db_uri, db_type if db_type != 'supabase' else 'postgresql'  # Treat Supabase as PostgreSQL
@@ -0,0 +1,186 @@
+# Backend/utils/examples.py
+#
+# Few-shot examples from past successful queries. The agent's system prompt
+# is static, so every question starts from zero and often spends several
+# iterations finding the right tables and joins, even when a similar question
+# on the same database was answered yesterday. Each (question, final
+# statement) pair that answered a read is stored per database in a small
+# SQLite file; before a new question goes to the LLM, the closest stored
+# questions are found with TF-IDF cosine similarity (word unigrams and
+# bigrams over query_cache.normalize_question, no network or model) and the
+# top few are put into the prompt as worked examples.
+#
+# The TF-IDF index for a database is built in memory on first use and rebuilt
+# after a local insert or every EXAMPLES_REFRESH_SECONDS (other workers add
+# examples to the same file).
+
+import math
+import os
+import sqlite3
+import time
+from collections import Counter
+from datetime import datetime
+
+from utils.query_cache import normalize_question
+from utils.sqlite_store import SQLiteStore, instance_path
+
+EXAMPLES_ENABLED = os.getenv('FEW_SHOT_EXAMPLES', 'true').lower() in ('1', 'true', 'yes')
+EXAMPLES_DB_PATH = os.getenv('EXAMPLES_DB_PATH', instance_path('examples.db'))
+EXAMPLES_TOP_K = int(os.getenv('EXAMPLES_TOP_K', 3))
+# Cosine similarity below which a stored question isn't considered related
+EXAMPLES_MIN_SIMILARITY = float(os.getenv('EXAMPLES_MIN_SIMILARITY', 0.3))
+EXAMPLES_MAX_PER_DATABASE = int(os.getenv('EXAMPLES_MAX_PER_DATABASE', 1000))
+EXAMPLES_REFRESH_SECONDS = float(os.getenv('EXAMPLES_REFRESH_SECONDS', 60))
+# Very long statements cost more prompt than they save
+EXAMPLES_MAX_STATEMENT_CHARS = int(os.getenv('EXAMPLES_MAX_STATEMENT_CHARS', 1500))
+
+_PRUNE_EVERY = 50
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS examples (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    identity TEXT NOT NULL,
+    db_type TEXT NOT NULL,
+    question TEXT NOT NULL,
+    normalized TEXT NOT NULL,
+    statement TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    UNIQUE (identity, normalized)
+);
+"""
+
+
+def _terms(normalized):
+    """Unigrams and bigrams of a normalized question."""
+    words = normalized.split()
+    return words + [f'{first} {second}' for first, second in zip(words, words[1:])]
+
+
+def _unit(vector):
+    norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+    return {term: weight / norm for term, weight in vector.items()} if norm else {}
+
+
+class _Example:
+    def __init__(self, question, statement, score=0.0):
+        self.question = question
+        self.statement = statement
+        self.score = score
+
+
+class _TfidfIndex:
+    """In-memory TF-IDF vectors for one database's stored questions."""
+
+    def __init__(self, rows):
+        self.built_at = time.time()
+        self.examples = [_Example(row['question'], row['statement']) for row in rows]
+        counts = [Counter(_terms(row['normalized'])) for row in rows]
+        document_frequency = Counter(term for count in counts for term in count)
+        total = len(counts)
+        # Smoothed idf, so a term present in every question still counts a little
+        self.idf = {term: math.log((1 + total) / (1 + frequency)) + 1 for term, frequency in document_frequency.items()}
+        self.vectors = [_unit({term: tf * self.idf[term] for term, tf in count.items()}) for count in counts]
+
+    def search(self, normalized, k, min_similarity):
+        query = _unit({term: tf * self.idf[term] for term, tf in Counter(_terms(normalized)).items() if term in self.idf})
+        if not query:
+            return []
+        scored = []
+        for example, vector in zip(self.examples, self.vectors):
+            score = sum(weight * vector.get(term, 0.0) for term, weight in query.items())
+            if score >= min_similarity:
+                scored.append(_Example(example.question, example.statement, score))
+        scored.sort(key=lambda example: example.score, reverse=True)
+        return scored[:k]
+
+
+class ExampleStore(SQLiteStore):
+    """SQLite-backed few-shot examples, keyed by database identity, with a per-database TF-IDF index."""
+
+    schema = SCHEMA
+
+    def __init__(self, path=EXAMPLES_DB_PATH, max_per_database=EXAMPLES_MAX_PER_DATABASE):
+        super().__init__(path)
+        self.max_per_database = max_per_database
+        self._indexes = {}
+        self._inserts = 0
+
+    def add(self, identity, db_type, question, statement):
+        """Stores the statement that answered a question; a repeated question keeps its latest statement."""
+        normalized = normalize_question(question)
+        if not normalized or not statement or len(statement) > EXAMPLES_MAX_STATEMENT_CHARS:
+            return
+        self._inserts += 1
+        try:
+            self._insert(identity, db_type, question, normalized, statement)
+            if self._inserts % _PRUNE_EVERY == 0:
+                self.prune(identity)
+        except sqlite3.Error as e:
+            # Examples only help; a locked or unreadable store must not fail the question
+            print(f"Could not store few-shot example: {e}")
+            return
+        with self._lock:
+            self._indexes.pop(identity, None)
+
+    def _insert(self, identity, db_type, question, normalized, statement):
+        with self._connect() as connection:
+            connection.execute(
+                'INSERT INTO examples (identity, db_type, question, normalized, statement, created_at) '
+                'VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (identity, normalized) DO UPDATE SET '
+                'question = excluded.question, statement = excluded.statement, created_at = excluded.created_at',
+                (identity, db_type, question.strip(), normalized, statement, datetime.now().isoformat()),
+            )
+
+    def _index(self, identity):
+        with self._lock:
+            index = self._indexes.get(identity)
+        if index is not None and time.time() - index.built_at < EXAMPLES_REFRESH_SECONDS:
+            return index
+        with self._connect() as connection:
+            rows = connection.execute(
+                'SELECT question, normalized, statement FROM examples WHERE identity = ?', (identity,)
+            ).fetchall()
+        index = _TfidfIndex(rows)
+        with self._lock:
+            self._indexes[identity] = index
+        return index
+
+    def search(self, identity, question, k=EXAMPLES_TOP_K, min_similarity=EXAMPLES_MIN_SIMILARITY):
+        """The k stored examples for this database most similar to a question, best first."""
+        normalized = normalize_question(question)
+        if not normalized:
+            return []
+        return self._index(identity).search(normalized, k, min_similarity)
+
+    def prompt_for(self, identity, db_type, question):
+        """Few-shot block for the system prompt, or '' when no stored question is close enough."""
+        if not EXAMPLES_ENABLED:
+            return ''
+        try:
+            examples = self.search(identity, question)
+        except sqlite3.Error as e:
+            print(f"Few-shot examples unavailable: {e}")
+            return ''
+        if not examples:
+            return ''
+        label = 'MongoDB command' if db_type == 'mongodb' else 'SQL'
+        blocks = [f'Question: {example.question}\n{label}: {example.statement}' for example in examples]
+        print(f"Few-shot examples: {len(examples)} (best similarity {examples[0].score:.2f})")
+        return (
+            'Similar questions previously answered on this database, with the query that answered them. '
+            'Use them as a starting point for table names, joins and filters; check the schema if unsure, '
+            'as it may have changed since.\n\n' + '\n\n'.join(blocks)
+        )
+
+    def prune(self, identity):
+        """Keeps a database's newest examples up to the per-database cap."""
+        with self._connect() as connection:
+            connection.execute(
+                'DELETE FROM examples WHERE identity = ? AND id NOT IN ('
+                '  SELECT id FROM examples WHERE identity = ? ORDER BY created_at DESC LIMIT ?)',
+                (identity, identity, self.max_per_database),
+            )
+
+
+# Process-wide singleton
+example_store = ExampleStore()
@@ -0,0 +1,247 @@
+# Backend/utils/export.py
+#
+# Streaming export of a query's full result. /query only returns the agent's
+# natural-language answer, and pulling a whole result into memory to build a
+# file would grow the worker by the size of the result. Exports re-run the
+# final statement on a server-side cursor and encode it batch by batch
+# (CSV, NDJSON, Arrow IPC or Parquet), so memory stays at one batch however
+# many rows are exported.
+
+import csv
+import io
+import json
+import os
+import re
+
+from bson.json_util import dumps
+from pymongo.errors import PyMongoError
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+from utils.cost_guard import QUERY_COST_GUARD_ENABLED, QUERY_MAX_ESTIMATED_COST, estimate_sql
+from utils.pool import get_engine, get_mongo_client
+from utils.result_handles import jsonable
+from utils.single_shot import READ_STATEMENT
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Optional: CSV and NDJSON exports don't need it
+    pa = None
+
+EXPORT_BATCH_ROWS = int(os.getenv('EXPORT_BATCH_ROWS', 5000))
+
+# format -> (mimetype, file extension, needs pyarrow)
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv', False),
+    'ndjson': ('application/x-ndjson', 'ndjson', False),
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrow', True),
+    'parquet': ('application/vnd.apache.parquet', 'parquet', True),
+}
+
+MONGO_COMMAND = re.compile(r'^db\.([\w-]+)\.aggregate\(', re.DOTALL)
+
+
+class ExportError(ValueError):
+    """The export can't be started (bad format/statement); reported as a 400."""
+
+
+def _csv_chunk(rows):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue()
+
+
+class _ChunkSink:
+    """Write-only file object for pyarrow writers; `drain()` hands back what was written so far."""
+
+    def __init__(self):
+        self._chunks = []
+        self._size = 0
+        self.closed = False
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._size += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._size
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _arrow_chunks(columns, batches, fmt):
+    """Encodes row batches as an Arrow IPC stream or a Parquet file, one record batch/row group at a time."""
+    sink = _ChunkSink()
+    writer = schema = None
+    try:
+        for rows in batches:
+            # Types come from the first batch; later batches are cast to the same schema
+            batch = pa.RecordBatch.from_pylist([dict(zip(columns, row)) for row in rows], schema=schema)
+            if writer is None:
+                schema = batch.schema
+                stream = pa.PythonFile(sink, mode='w')
+                writer = pa.ipc.new_stream(stream, schema) if fmt == 'arrow' else pq.ParquetWriter(stream, schema)
+            if fmt == 'arrow':
+                writer.write_batch(batch)
+            else:
+                writer.write_table(pa.Table.from_batches([batch]))
+            yield sink.drain()
+        if writer is None:
+            # Empty result: still a valid file with the column names
+            schema = pa.schema([(column, pa.null()) for column in columns])
+            stream = pa.PythonFile(sink, mode='w')
+            writer = pa.ipc.new_stream(stream, schema) if fmt == 'arrow' else pq.ParquetWriter(stream, schema)
+    finally:
+        if writer is not None:
+            writer.close()
+    yield sink.drain()
+
+
+def _encode(columns, batches, fmt):
+    """Turns batches of row tuples into chunks of the requested format."""
+    if fmt == 'csv':
+        yield _csv_chunk([columns])
+        for rows in batches:
+            yield _csv_chunk(rows)
+    elif fmt == 'ndjson':
+        for rows in batches:
+            yield ''.join(json.dumps(dict(zip(columns, row)), default=str) + '\n' for row in rows)
+    else:
+        yield from _arrow_chunks(columns, batches, fmt)
+
+
+def _sql_export(db_uri, mode, statement, fmt):
+    statement = statement.strip().rstrip(';')
+    if not READ_STATEMENT.match(statement) or ';' in statement:
+        raise ExportError('Only a single read statement can be exported.')
+
+    engine = get_engine(db_uri, mode)
+    if QUERY_COST_GUARD_ENABLED:
+        # Exports are meant to be large, so only the cost budget applies, not the row budget
+        def execute(sql):
+            with engine.connect() as connection:
+                return [row._asdict() for row in connection.execute(text(sql))]
+        estimate = estimate_sql(execute, engine.dialect.name, statement)
+        if estimate is not None and estimate.cost > QUERY_MAX_ESTIMATED_COST:
+            raise ExportError(
+                f'Export refused: estimated cost {estimate.cost:,.0f} is over the budget of '
+                f'{QUERY_MAX_ESTIMATED_COST:,.0f}. Narrow the query first.'
+            )
+
+    connection = engine.connect()
+    try:
+        if engine.dialect.name in ('postgresql', 'mysql'):
+            # Read-write sessions too: an export must never modify data
+            connection.exec_driver_sql('SET TRANSACTION READ ONLY')
+        result = connection.execution_options(stream_results=True, yield_per=EXPORT_BATCH_ROWS).execute(
+            text(statement)
+        )
+    except SQLAlchemyError as e:
+        connection.close()
+        raise ExportError(f'Query failed: {e}')
+    except Exception:
+        connection.close()
+        raise
+    columns = list(result.keys())
+
+    def batches():
+        for partition in result.partitions():
+            yield [tuple(jsonable(value) for value in row) for row in partition]
+
+    def chunks():
+        try:
+            yield from _encode(columns, batches(), fmt)
+        finally:
+            result.close()
+            connection.close()
+
+    return chunks()
+
+
+def _mongo_export(db_uri, mode, statement, fmt):
+    statement = re.sub(r'\s+', ' ', statement.strip())
+    match = MONGO_COMMAND.match(statement)
+    if not match:
+        raise ExportError('Only db.<collection>.aggregate([...]) commands can be exported.')
+    if EXPORT_FORMATS[fmt][2]:
+        raise ExportError('MongoDB results can be exported as csv or ndjson.')
+
+    try:
+        pipeline = json.loads(statement[statement.index('['):statement.rindex(']') + 1])
+    except ValueError:
+        raise ExportError('Could not parse the aggregation pipeline.')
+    if any(isinstance(stage, dict) and ({'$out', '$merge'} & set(stage)) for stage in pipeline):
+        raise ExportError('Pipelines that write ($out/$merge) cannot be exported.')
+
+    db_name = db_uri.split('/')[-1].split('?')[0] or 'test'
+    try:
+        cursor = get_mongo_client(db_uri, mode)[db_name][match.group(1)].aggregate(
+            pipeline, batchSize=EXPORT_BATCH_ROWS
+        )
+    except PyMongoError as e:
+        raise ExportError(f'Query failed: {e}')
+
+    def documents():
+        batch = []
+        for document in cursor:
+            batch.append(json.loads(dumps(document)))
+            if len(batch) >= EXPORT_BATCH_ROWS:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def chunks():
+        try:
+            if fmt == 'ndjson':
+                for batch in documents():
+                    yield ''.join(json.dumps(document) + '\n' for document in batch)
+                return
+            # CSV columns are the keys of the first batch; nested values are written as JSON
+            columns = None
+            for batch in documents():
+                if columns is None:
+                    columns = list(dict.fromkeys(key for document in batch for key in document))
+                    yield _csv_chunk([columns])
+                yield _csv_chunk([
+                    [json.dumps(value) if isinstance(value, (dict, list)) else value
+                     for value in (document.get(column) for column in columns)]
+                    for document in batch
+                ])
+        finally:
+            cursor.close()
+
+    return chunks()
+
+
+def start_export(db_uri, db_type, mode, statement, fmt='csv'):
+    """
+    Validates and starts an export of `statement`. Returns (chunks, mimetype,
+    filename); `chunks` is a generator of str/bytes to stream as the response.
+    Raises ExportError for anything that should be a 400.
+    """
+    fmt = (fmt or 'csv').lower()
+    if fmt not in EXPORT_FORMATS:
+        raise ExportError(f"Unknown export format '{fmt}'. Use one of: {', '.join(EXPORT_FORMATS)}.")
+    mimetype, extension, needs_arrow = EXPORT_FORMATS[fmt]
+    if needs_arrow and pa is None:
+        raise ExportError(f'{fmt} export requires pyarrow, which is not installed on the server.')
+    if not statement or not isinstance(statement, str):
+        raise ExportError('Missing statement to export.')
+
+    if db_type == 'mongodb':
+        chunks = _mongo_export(db_uri, mode, statement, fmt)
+    else:
+        chunks = _sql_export(db_uri, mode, statement, fmt)
+    return chunks, mimetype, f'export.{extension}'
@@ -0,0 +1,305 @@
+# Backend/utils/history.py
+#
+# Change history for read-write sessions. The log used to be a list inside
+# the signed session cookie, so every write made the cookie (and every
+# request carrying it) bigger until it hit the browser's 4 KB limit. Entries
+# now live in a small SQLite database keyed by session id and indexed by
+# (session, id), so listing a page, filtering and looking up one change stay
+# fast for sessions with thousands of changes. Old entries are pruned by age
+# and per-session count.
+#
+# The same database holds the before-images captured for each change
+# (utils/undo.py): one `snapshots` row per captured statement and its rows in
+# `snapshot_rows`, written and read in batches so a 100k-row change never has
+# to fit in memory.
+
+import json
+import os
+from datetime import datetime, timedelta
+
+from utils.sqlite_store import SQLiteStore, instance_path
+
+HISTORY_DB_PATH = os.getenv('HISTORY_DB_PATH', instance_path('history.db'))
+HISTORY_MAX_PER_SESSION = int(os.getenv('HISTORY_MAX_PER_SESSION', 10000))
+HISTORY_RETENTION_DAYS = float(os.getenv('HISTORY_RETENTION_DAYS', 30))
+HISTORY_PAGE_SIZE = int(os.getenv('HISTORY_PAGE_SIZE', 50))
+HISTORY_MAX_PAGE_SIZE = 500
+
+# Pruning runs on every Nth insert rather than on each one
+_PRUNE_EVERY = 100
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS changes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    sid TEXT NOT NULL,
+    query TEXT NOT NULL,
+    description TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    reverted INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS changes_sid_id ON changes (sid, id);
+CREATE INDEX IF NOT EXISTS changes_created_at ON changes (created_at);
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    sid TEXT NOT NULL,
+    change_id INTEGER,
+    identity TEXT NOT NULL,
+    operation TEXT NOT NULL,
+    target TEXT,
+    meta TEXT NOT NULL,
+    row_count INTEGER NOT NULL DEFAULT 0,
+    revertible INTEGER NOT NULL,
+    note TEXT,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS snapshots_change_id ON snapshots (change_id, id);
+CREATE TABLE IF NOT EXISTS snapshot_rows (
+    snapshot_id INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (snapshot_id, seq)
+) WITHOUT ROWID;
+"""
+
+
+def page_args(args):
+    """
+    Reads /history's query parameters (limit, cursor, reverted, q, since, until)
+    into HistoryStore.page() keyword arguments. Raises ValueError on bad values.
+    """
+    reverted = args.get('reverted')
+    if reverted is not None:
+        if reverted.lower() not in ('true', 'false', '1', '0'):
+            raise ValueError("'reverted' must be true or false.")
+        reverted = reverted.lower() in ('true', '1')
+    for key in ('since', 'until'):
+        if args.get(key):
+            datetime.fromisoformat(args[key])  # Rejects anything that wouldn't compare as an ISO time
+    return {
+        'limit': int(args['limit']) if args.get('limit') else None,
+        'before': int(args['cursor']) if args.get('cursor') else None,
+        'reverted': reverted,
+        'search': args.get('q') or None,
+        'since': args.get('since') or None,
+        'until': args.get('until') or None,
+    }
+
+
+# A change can be reverted when it has before-images and all of them are usable
+SELECT_CHANGES = """
+    SELECT changes.*,
+           (SELECT MIN(revertible) FROM snapshots WHERE change_id = changes.id) AS revertible,
+           (SELECT GROUP_CONCAT(note, '; ') FROM snapshots WHERE change_id = changes.id) AS revert_note
+    FROM changes
+"""
+
+
+def _entry(row):
+    return {
+        'id': row['id'],
+        'query': row['query'],
+        'description': row['description'],
+        'timestamp': row['created_at'],
+        'reverted': bool(row['reverted']),
+        'revertible': bool(row['revertible']),
+        'revert_note': row['revert_note'],
+    }
+
+
+def _snapshot(row):
+    return {
+        'id': row['id'],
+        'identity': row['identity'],
+        'operation': row['operation'],
+        'target': row['target'],
+        'meta': json.loads(row['meta']),
+        'row_count': row['row_count'],
+        'revertible': bool(row['revertible']),
+        'note': row['note'],
+    }
+
+
+class HistoryStore(SQLiteStore):
+    """SQLite-backed change log; one connection per call, so it is safe across threads and workers."""
+
+    schema = SCHEMA
+
+    def __init__(self, path=HISTORY_DB_PATH, max_per_session=HISTORY_MAX_PER_SESSION,
+                 retention_days=HISTORY_RETENTION_DAYS):
+        super().__init__(path)
+        self.max_per_session = max_per_session
+        self.retention_days = retention_days
+        self._inserts = 0
+
+    def record(self, sid, query, description, snapshot_ids=()):
+        """Appends a change for a session, linking the before-images captured for it, and returns the entry."""
+        created_at = datetime.now().isoformat()
+        with self._connect() as connection:
+            cursor = connection.execute(
+                'INSERT INTO changes (sid, query, description, created_at) VALUES (?, ?, ?, ?)',
+                (sid, query, description, created_at),
+            )
+            change_id = cursor.lastrowid
+            connection.executemany(
+                'UPDATE snapshots SET change_id = ? WHERE id = ? AND sid = ? AND change_id IS NULL',
+                [(change_id, snapshot_id, sid) for snapshot_id in snapshot_ids],
+            )
+        self._inserts += 1
+        if self._inserts % _PRUNE_EVERY == 0:
+            self.prune(sid)
+        return self.get(sid, change_id)
+
+    def page(self, sid, limit=None, before=None, reverted=None, search=None, since=None, until=None):
+        """
+        Newest-first page of a session's changes. `before` is the previous page's
+        `next_cursor` (an id); filters: reverted flag, text search, ISO time range.
+        Returns (entries, next_cursor or None).
+        """
+        limit = max(1, min(int(limit or HISTORY_PAGE_SIZE), HISTORY_MAX_PAGE_SIZE))
+        clauses, params = ['sid = ?'], [sid]
+        if before is not None:
+            clauses.append('id < ?')
+            params.append(int(before))
+        if reverted is not None:
+            clauses.append('reverted = ?')
+            params.append(1 if reverted else 0)
+        if search:
+            clauses.append("(query LIKE ? ESCAPE '\\' OR description LIKE ? ESCAPE '\\')")
+            pattern = '%' + search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            params += [pattern, pattern]
+        if since:
+            clauses.append('created_at >= ?')
+            params.append(since)
+        if until:
+            clauses.append('created_at < ?')
+            params.append(until)
+
+        with self._connect() as connection:
+            rows = connection.execute(
+                f"{SELECT_CHANGES} WHERE {' AND '.join(clauses)} ORDER BY id DESC LIMIT ?",
+                params + [limit + 1],
+            ).fetchall()
+        entries = [_entry(row) for row in rows[:limit]]
+        next_cursor = str(entries[-1]['id']) if len(rows) > limit else None
+        return entries, next_cursor
+
+    def get(self, sid, change_id):
+        """One change by id, or None if it doesn't exist or belongs to another session."""
+        with self._connect() as connection:
+            row = connection.execute(
+                f'{SELECT_CHANGES} WHERE sid = ? AND id = ?', (sid, int(change_id))
+            ).fetchone()
+        return _entry(row) if row else None
+
+    def mark_reverted(self, sid, change_id):
+        """Flags a change as reverted. Returns False if it was missing or already reverted."""
+        with self._connect() as connection:
+            cursor = connection.execute(
+                'UPDATE changes SET reverted = 1 WHERE sid = ? AND id = ? AND reverted = 0', (sid, int(change_id))
+            )
+            return cursor.rowcount == 1
+
+    def clear_reverted(self, sid, change_id):
+        """Undoes mark_reverted, for a revert that failed after claiming the change."""
+        with self._connect() as connection:
+            connection.execute('UPDATE changes SET reverted = 0 WHERE sid = ? AND id = ?', (sid, int(change_id)))
+
+    def create_snapshot(self, sid, identity, operation, target, meta, revertible=True, note=None):
+        """Registers a before-image for a statement about to run; rows follow via append_snapshot_rows."""
+        with self._connect() as connection:
+            cursor = connection.execute(
+                'INSERT INTO snapshots (sid, identity, operation, target, meta, revertible, note, created_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (sid, identity, operation, target, json.dumps(meta), 1 if revertible else 0, note,
+                 datetime.now().isoformat()),
+            )
+            return cursor.lastrowid
+
+    def append_snapshot_rows(self, snapshot_id, batches):
+        """
+        Stores batches of already-encoded rows (strings) for a snapshot. Each batch
+        is committed on its own so a long capture doesn't hold the write lock; a
+        failed capture is cleaned up with disable_snapshot/delete_snapshot. Returns the row count.
+        """
+        with self._connect() as connection:
+            seq = connection.execute(
+                'SELECT row_count FROM snapshots WHERE id = ?', (snapshot_id,)
+            ).fetchone()['row_count']
+            for batch in batches:
+                connection.executemany(
+                    'INSERT INTO snapshot_rows (snapshot_id, seq, data) VALUES (?, ?, ?)',
+                    [(snapshot_id, seq + offset, data) for offset, data in enumerate(batch)],
+                )
+                seq += len(batch)
+                connection.execute('UPDATE snapshots SET row_count = ? WHERE id = ?', (seq, snapshot_id))
+                connection.commit()
+        return seq
+
+    def update_snapshot_meta(self, snapshot_id, meta):
+        """Replaces a snapshot's metadata once the captured columns and keys are known."""
+        with self._connect() as connection:
+            connection.execute('UPDATE snapshots SET meta = ? WHERE id = ?', (json.dumps(meta), snapshot_id))
+
+    def disable_snapshot(self, snapshot_id, note):
+        """Keeps the snapshot as a record of the change but drops its rows and marks it unrevertible."""
+        with self._connect() as connection:
+            connection.execute('DELETE FROM snapshot_rows WHERE snapshot_id = ?', (snapshot_id,))
+            connection.execute(
+                'UPDATE snapshots SET revertible = 0, row_count = 0, note = ? WHERE id = ?', (note, snapshot_id)
+            )
+
+    def delete_snapshot(self, snapshot_id):
+        """Drops a snapshot whose statement didn't run."""
+        with self._connect() as connection:
+            connection.execute('DELETE FROM snapshot_rows WHERE snapshot_id = ?', (snapshot_id,))
+            connection.execute('DELETE FROM snapshots WHERE id = ?', (snapshot_id,))
+
+    def snapshots(self, sid, change_id):
+        """The before-images of a change, newest first (the order they must be undone in)."""
+        with self._connect() as connection:
+            rows = connection.execute(
+                'SELECT * FROM snapshots WHERE sid = ? AND change_id = ? ORDER BY id DESC', (sid, int(change_id))
+            ).fetchall()
+        return [_snapshot(row) for row in rows]
+
+    def snapshot_rows(self, snapshot_id, batch_size):
+        """Yields a snapshot's encoded rows in batches, reading one batch at a time."""
+        last = -1
+        while True:
+            with self._connect() as connection:
+                rows = connection.execute(
+                    'SELECT seq, data FROM snapshot_rows WHERE snapshot_id = ? AND seq > ? ORDER BY seq LIMIT ?',
+                    (snapshot_id, last, batch_size),
+                ).fetchall()
+            if not rows:
+                return
+            last = rows[-1]['seq']
+            yield [row['data'] for row in rows]
+
+    def count(self, sid):
+        with self._connect() as connection:
+            return connection.execute('SELECT COUNT(*) FROM changes WHERE sid = ?', (sid,)).fetchone()[0]
+
+    def prune(self, sid=None):
+        """Drops entries past the retention period, and a session's entries beyond its cap."""
+        cutoff = (datetime.now() - timedelta(days=self.retention_days)).isoformat()
+        cutoff_orphans = (datetime.now() - timedelta(hours=1)).isoformat()
+        with self._connect() as connection:
+            connection.execute('DELETE FROM changes WHERE created_at < ?', (cutoff,))
+            if sid is not None:
+                connection.execute(
+                    'DELETE FROM changes WHERE sid = ? AND id <= ('
+                    '  SELECT id FROM changes WHERE sid = ? ORDER BY id DESC LIMIT 1 OFFSET ?)',
+                    (sid, sid, self.max_per_session),
+                )
+            # Before-images of pruned changes, and ones never linked to a change (the query failed)
+            connection.execute(
+                'DELETE FROM snapshots WHERE (change_id IS NULL AND created_at < ?) '
+                'OR (change_id IS NOT NULL AND change_id NOT IN (SELECT id FROM changes))',
+                (cutoff_orphans,),
+            )
+            connection.execute('DELETE FROM snapshot_rows WHERE snapshot_id NOT IN (SELECT id FROM snapshots)')
+
+
+# Process-wide singleton
+history_store = HistoryStore()
@@ -0,0 +1,240 @@
+# Backend/utils/intent_router.py
+#
+# Local router in front of the LLM. A good share of questions are small talk
+# or metadata ("list tables", "describe orders", "how many rows in users",
+# "show 5 rows from products"); sending those through the agent costs several
+# LLM calls and seconds of latency for an answer the schema cache or a single
+# templated statement already has. classify_question() matches the question
+# against a handful of anchored patterns and names the table it refers to;
+# anything it isn't sure about returns None and goes to the agent as before.
+#   - greeting / thanks / help   answered without touching the database
+#   - list_tables                from the cached table/collection listing
+#   - describe                   from the cached column details
+#   - count                      SELECT COUNT(*) (collection metadata for MongoDB)
+#   - preview                    SELECT * ... LIMIT n ($limit for MongoDB)
+# Table names are only ever taken from the database's own listing and quoted,
+# so the question never reaches the SQL text.
+
+import ast
+import os
+import re
+
+INTENT_ROUTER_ENABLED = os.getenv('INTENT_ROUTER', 'true').lower() in ('1', 'true', 'yes')
+PREVIEW_DEFAULT_ROWS = int(os.getenv('INTENT_PREVIEW_ROWS', 10))
+PREVIEW_MAX_ROWS = int(os.getenv('INTENT_PREVIEW_MAX_ROWS', 100))
+# Cells wider than this are cut in the plain-text tables
+MAX_CELL_CHARS = 40
+
+CONVERSATIONAL_INTENTS = ('greeting', 'thanks', 'help')
+
+# Table names: words, dots, dashes and spaces ("order items" -> order_items)
+_T = r'(?:the\s+)?(?P<table>[\w.\- ]+?)(?:\s+(?:table|collection))?'
+_N = r'(?P<limit>\d+)'
+_ROWS = r'(?:rows|records|entries|documents|items|lines)'
+
+PATTERNS = [
+    ('greeting', r'(?:hi|hello|hey|hiya|howdy|yo|greetings|good\s+(?:morning|afternoon|evening|day))(?:\s+there)?'),
+    ('thanks', r'(?:thanks|thank\s+you|thx|ty|cheers)(?:\s+(?:a\s+lot|so\s+much|very\s+much))?'),
+    ('help', r'(?:help|what\s+can\s+you\s+do|what\s+can\s+i\s+ask(?:\s+you)?|how\s+does\s+this\s+work)'),
+    ('list_tables', r'(?:list|show|display|get|what\s+are|which\s+are)(?:\s+me)?(?:\s+all)?(?:\s+the)?(?:\s+available)?'
+                    r'\s+(?:tables|collections)(?:\s+(?:are\s+there|exist|in\s+(?:the|this)\s+database))?'),
+    ('list_tables', r'(?:what|which)\s+(?:tables|collections)\s+(?:are\s+there|exist|are\s+available|do\s+(?:we|i|you)\s+have)'
+                    r'(?:\s+in\s+(?:the|this)\s+database)?'),
+    # Before the count patterns, which would look for a table named "tables"
+    ('list_tables', r'(?:how\s+many|count(?:\s+the)?|number\s+of)\s+(?:tables|collections)'
+                    r'(?:\s+(?:are\s+there|exist|do\s+(?:we|i|you)\s+have))?(?:\s+in\s+(?:the|this)\s+database)?'),
+    ('describe', rf'(?:describe|desc|explain)\s+{_T}'),
+    ('describe', rf'(?:show|display|get|what\s+is|what\'s)(?:\s+me)?\s+(?:the\s+)?(?:schema|structure|columns|fields|definition)'
+                 rf'\s+(?:of|for|in)\s+{_T}'),
+    ('describe', rf'what\s+(?:columns|fields)\s+(?:are\s+(?:there\s+)?in|does)\s+{_T}(?:\s+(?:have|contain))?'),
+    ('describe', rf'what\s+does\s+{_T}\s+look\s+like'),
+    ('count', rf'(?:how\s+many|count(?:\s+the)?|number\s+of|total\s+number\s+of)\s+{_ROWS}(?:\s+are(?:\s+there)?)?'
+              rf'\s+(?:in|of|does)\s+{_T}(?:\s+(?:have|contain))?'),
+    ('count', rf'how\s+many\s+{_T}\s+(?:are\s+there|exist|do\s+(?:we|i)\s+have)'),
+    ('count', rf'(?:how\s+many|count(?:\s+all)?(?:\s+the)?|number\s+of|total\s+number\s+of)\s+{_T}'),
+    ('preview', rf'(?:show|display|get|list|give)(?:\s+me)?(?:\s+the)?(?:\s+(?:first|top))?(?:\s+{_N})?(?:\s+sample)?'
+                rf'(?:\s+{_ROWS})?\s+(?:from|of|in)\s+{_T}'),
+    ('preview', rf'(?:preview|sample|peek\s+(?:at|into))\s+{_T}'),
+    ('preview', rf'(?:show|display)(?:\s+me)?\s+(?:the\s+)?(?:first\s+{_N}\s+)?{_T}'),
+]
+COMPILED_PATTERNS = [(name, re.compile(rf'^{pattern}$')) for name, pattern in PATTERNS]
+
+# Politeness that doesn't change what is asked
+_PREFIX = re.compile(r'^(?:(?:please|pls|kindly|can\s+you|could\s+you|would\s+you|will\s+you|just)\s+)+')
+_SUFFIX = re.compile(r'(?:\s+(?:please|pls|for\s+me|thanks|thank\s+you))+$')
+
+
+class Intent:
+    def __init__(self, name, table=None, limit=None):
+        self.name = name
+        self.table = table
+        self.limit = limit
+
+    def __repr__(self):
+        return f'Intent({self.name!r}, table={self.table!r}, limit={self.limit!r})'
+
+
+def _normalize(question):
+    text = question.strip().lower()
+    text = re.sub(r'[`"\[\]]', '', text)
+    text = re.sub(r'[?!.;,:]+$', '', text).strip()
+    text = re.sub(r'\s+', ' ', text)
+    return _SUFFIX.sub('', _PREFIX.sub('', text))
+
+
+def classify_question(question):
+    """Returns the Intent a question matches (table still unresolved), or None for the agent."""
+    text = _normalize(question)
+    if not text or len(text) > 120:
+        return None
+    for name, pattern in COMPILED_PATTERNS:
+        match = pattern.match(text)
+        if not match:
+            continue
+        groups = match.groupdict()
+        table = (groups.get('table') or '').strip() or None
+        if name in ('describe', 'count', 'preview') and not table:
+            continue
+        limit = int(groups['limit']) if groups.get('limit') else None
+        return Intent(name, table, limit)
+    return None
+
+
+def _variants(name):
+    """Spellings a table may go by: as typed, with underscores, and singular/plural."""
+    forms = {name, name.replace(' ', '_'), name.replace(' ', ''), name.replace('-', '_')}
+    for form in list(forms):
+        forms.add(form + 's')
+        forms.add(form + 'es')
+        if form.endswith('ies'):
+            forms.add(form[:-3] + 'y')
+        if form.endswith('y'):
+            forms.add(form[:-1] + 'ies')
+        if form.endswith('es'):
+            forms.add(form[:-2])
+        if form.endswith('s'):
+            forms.add(form[:-1])
+    return forms
+
+
+def resolve_table(name, tables):
+    """Matches a table named in a question to one of `tables` (case-insensitive), or None."""
+    by_lower = {table.lower(): table for table in tables}
+    if name in by_lower:
+        return by_lower[name]
+    matches = {by_lower[form] for form in _variants(name) if form in by_lower}
+    if len(matches) == 1:
+        return matches.pop()
+    return None
+
+
+def _cell(value):
+    text = '' if value is None else str(value)
+    text = text.replace('\n', ' ')
+    return text if len(text) <= MAX_CELL_CHARS else text[:MAX_CELL_CHARS - 1] + '…'
+
+
+def format_table(columns, rows):
+    """Plain-text aligned table (the client shows answers in a monospace block)."""
+    cells = [[_cell(value) for value in row] for row in rows]
+    widths = [max([len(str(column))] + [len(row[index]) for row in cells]) for index, column in enumerate(columns)]
+    lines = ['  '.join(str(column).ljust(width) for column, width in zip(columns, widths)).rstrip(),
+             '  '.join('-' * width for width in widths)]
+    lines += ['  '.join(value.ljust(width) for value, width in zip(row, widths)).rstrip() for row in cells]
+    return '\n'.join(lines)
+
+
+def answer_conversational(intent, db_type=None, mode='read-only'):
+    """Replies to greetings, thanks and help without the database or the LLM."""
+    kind = {'postgresql': 'PostgreSQL', 'mysql': 'MySQL', 'mongodb': 'MongoDB'}.get(db_type)
+    database = f'your {kind} database' if kind else 'your database'
+    examples = ('Try "list tables", "describe <table>", "how many rows in <table>", '
+                '"show 5 rows from <table>", or any question in plain English.')
+    if intent.name == 'thanks':
+        return {'response': "You're welcome! Ask me anything else about your database.", 'routed': intent.name}
+    if intent.name == 'greeting':
+        return {'response': f'Hello! I can answer questions about {database}. {examples}', 'routed': intent.name}
+    access = ('You are connected in read-write mode, so I can also insert, update and delete data '
+              '(changes can be reverted from the history).' if mode == 'read-write'
+              else 'You are connected in read-only mode, so I will only read data.')
+    return {'response': f'I translate questions about {database} into queries and run them for you. '
+                        f'{examples}\n{access}',
+            'routed': intent.name}
+
+
+def _answer_sql(intent, db):
+    tables = db.get_usable_table_names()
+    if intent.name == 'list_tables':
+        listing = '\n'.join(f'- {table}' for table in tables)
+        return {'response': f'The database has {len(tables)} tables:\n{listing}' if tables
+                else 'The database has no tables.'}
+
+    table = resolve_table(intent.table, tables)
+    if table is None:
+        return None
+    quoted = db.quote_identifier(table)
+
+    if intent.name == 'describe':
+        details = db.get_column_details(table)
+        rows = [(name, column_type, 'yes' if nullable else 'no', 'yes' if primary_key else '')
+                for name, column_type, nullable, primary_key in details]
+        return {'response': f'{table} has {len(rows)} columns:\n\n'
+                            f'{format_table(["column", "type", "nullable", "primary key"], rows)}'}
+
+    if intent.name == 'count':
+        statement = f'SELECT COUNT(*) FROM {quoted}'
+        # Through run(): the cost guard and the read cache apply as for any agent query
+        count = ast.literal_eval(db.run(statement).partition('\n--')[0])[0][0]
+        return {'response': f'{table} has {count:,} rows.', 'sql': statement}
+
+    limit = min(intent.limit or PREVIEW_DEFAULT_ROWS, PREVIEW_MAX_ROWS)
+    statement = f'SELECT * FROM {quoted} LIMIT {limit}'
+    columns, rows = db.fetch_rows(statement, limit)
+    if not rows:
+        return {'response': f'{table} is empty.', 'sql': statement}
+    return {'response': f'First {len(rows)} rows of {table}:\n\n{format_table(columns, rows)}', 'sql': statement}
+
+
+def _answer_mongo(intent, db):
+    collections = sorted(db.get_usable_collection_names())
+    if intent.name == 'list_tables':
+        listing = '\n'.join(f'- {collection}' for collection in collections)
+        return {'response': f'The database has {len(collections)} collections:\n{listing}' if collections
+                else 'The database has no collections.'}
+
+    collection = resolve_table(intent.table, collections)
+    if collection is None:
+        return None
+
+    if intent.name == 'describe':
+        return {'response': db.get_collection_info([collection])}
+
+    if intent.name == 'count':
+        count = db.count_documents(collection)
+        return {'response': f'{collection} has {count:,} documents.'}
+
+    limit = min(intent.limit or PREVIEW_DEFAULT_ROWS, PREVIEW_MAX_ROWS)
+    statement = f'db.{collection}.aggregate([{{"$limit": {limit}}}])'
+    return {'response': f'First documents of {collection}:\n\n{db.run(statement)}', 'sql': statement}
+
+
+def answer_intent(intent, ctx):
+    """
+    Answers a metadata/count/preview intent against the connected database (a
+    utils/llm.py QueryContext). Blocking. Returns the reply dict, or None when the
+    table can't be resolved or the statement fails, so the agent takes over.
+    """
+    try:
+        if ctx.db_type == 'mongodb':
+            result = _answer_mongo(intent, ctx.db)
+        else:
+            result = _answer_sql(intent, ctx.db)
+    except Exception as e:
+        print(f"Intent router: {intent} failed ({e}), falling back to the agent")
+        return None
+    if result is None:
+        print(f"Intent router: no table matches {intent.table!r}, falling back to the agent")
+        return None
+    print(f"Intent router: answered {intent} locally")
+    result['routed'] = intent.name
+    return result
@@ -0,0 +1,148 @@
+# Backend/utils/jobs.py
+#
+# In-process job queue for asynchronous /query submissions. Slow agent runs
+# used to occupy a request thread for their whole duration; now the request
+# returns a job id immediately and a bounded pool of worker threads does the
+# work. When the backlog is full, new jobs are rejected (backpressure) rather
+# than piling up. Finished jobs are kept for a while so clients can poll.
+
+import os
+import queue
+import threading
+import time
+import traceback
+import uuid
+
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', 4))
+JOB_MAX_PENDING = int(os.getenv('JOB_MAX_PENDING', 32))
+JOB_RESULT_TTL = float(os.getenv('JOB_RESULT_TTL_SECONDS', 600))
+
+
+class QueueFull(Exception):
+    """Raised when the job backlog is at capacity."""
+
+
+class Job:
+    def __init__(self, fn, args, kwargs, owner):
+        self.id = uuid.uuid4().hex
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.owner = owner
+        self.status = 'queued'
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def done(self):
+        return self.status in ('succeeded', 'failed')
+
+    def to_dict(self, include_result=True):
+        data = {
+            'job_id': self.id,
+            'status': self.status,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+        if include_result and self.done:
+            data['result'] = self.result
+            data['error'] = self.error
+        return data
+
+
+class JobQueue:
+    """Bounded worker pool with a bounded backlog and time-limited result retention."""
+
+    def __init__(self, workers=JOB_WORKERS, max_pending=JOB_MAX_PENDING, retention=JOB_RESULT_TTL):
+        self.workers = workers
+        self.retention = retention
+        self._pending = queue.Queue(maxsize=max_pending)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._threads = []
+        self._running = 0
+
+    def _ensure_workers(self):
+        # Started lazily so importing the module (e.g. under gunicorn's preload) spawns nothing
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f'query-job-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            job = self._pending.get()
+            with self._lock:
+                self._running += 1
+            job.started_at = time.time()
+            job.status = 'running'
+            status = 'failed'
+            try:
+                job.result = job.fn(*job.args, **job.kwargs)
+                if isinstance(job.result, dict) and 'error' in job.result:
+                    job.error = job.result['error']
+                else:
+                    status = 'succeeded'
+            except Exception as e:
+                print(f"Job {job.id} failed: {traceback.format_exc()}")
+                job.error = f'An unexpected error occurred: {str(e)}'
+            finally:
+                job.finished_at = time.time()
+                job.fn = job.args = job.kwargs = None  # Release session snapshots etc.
+                # Last: pollers and _sweep read the other fields once a job is done
+                job.status = status
+                with self._lock:
+                    self._running -= 1
+                self._pending.task_done()
+
+    def submit(self, fn, *args, owner=None, **kwargs):
+        """Queues fn(*args, **kwargs). Raises QueueFull when the backlog is at capacity."""
+        self._ensure_workers()
+        self._sweep()
+        job = Job(fn, args, kwargs, owner)
+        with self._lock:
+            self._jobs[job.id] = job
+        try:
+            self._pending.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                self._jobs.pop(job.id, None)
+            raise QueueFull('Too many queries are queued. Please retry shortly.')
+        return job
+
+    def get(self, job_id, owner=None):
+        """Returns the job if it exists and belongs to `owner`, else None."""
+        self._sweep()
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None or job.owner != owner:
+            return None
+        return job
+
+    def _sweep(self):
+        cutoff = time.time() - self.retention
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items() if job.done and job.finished_at < cutoff]
+            for job_id in expired:
+                del self._jobs[job_id]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'running': self._running,
+                'queued': self._pending.qsize(),
+                'max_pending': self._pending.maxsize,
+                'retained': len(self._jobs),
+            }
+
+
+# Process-wide singleton
+job_queue = JobQueue()
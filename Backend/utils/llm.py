@@ -298,25 +298,49 @@
 #         print(f"Error in run_llm_query: {str(e)}")
 #         return json.dumps({"error": f"Error processing your request: {str(e)}. Please try again or rephrase your query."})
 
+import asyncio
+import hashlib
 import os
+import time
 import traceback
-from datetime import datetime
 from dotenv import load_dotenv
 
 from langchain_community.agent_toolkits import SQLDatabaseToolkit
-from langchain_community.utilities import SQLDatabase
-from langchain_openai import ChatOpenAI
-from pymongo import MongoClient
 
-from langchain_mongodb.agent_toolkit import MongoDBDatabaseToolkit
+from langchain_mongodb.agent_toolkit import MongoDBDatabase, MongoDBDatabaseToolkit
 from langchain.agents import create_tool_calling_agent, AgentExecutor
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from utils.agent_cache import agent_cache
+from utils.cost_guard import GuardedMongoDBDatabase
+from utils.examples import example_store
+from utils.history import history_store
+from utils.intent_router import (CONVERSATIONAL_INTENTS, INTENT_ROUTER_ENABLED, answer_conversational,
+                                 answer_intent, classify_question)
+from utils.undo import current_changes, take_captured_changes
+from utils.metrics import agent_iterations, observe_query
+from utils.llm_client import LLM_TIMEOUT, RateLimitedChatOpenAI, llm_clients
+from utils.model_router import LLM_MODEL
+from utils.pool import database_identity, get_mongo_client
+from utils.profiler import profile_store
+from utils.rate_limit import current_session
+from utils.result_handles import current_results, latest_result_id
+from utils.scratchpad import compact_scratchpad
+from utils.query_cache import (executed_statements, extract_final_statement, format_result_answer,
+                               query_cache, result_digest)
+from utils.schema_cache import current_table_scope, get_sql_database
+from utils.sql_validator import LocalQueryCheckerTool, validation_available
+from utils.table_ranker import select_tables
+from utils.single_shot import READ_STATEMENT, SINGLE_SHOT_DEFAULT, arun_single_shot_query, run_single_shot_query
 
 # Load environment variables from .env file
 load_dotenv()
 
-def get_llm(use_vertex=False):
-    """Returns a configured LLM instance using GROQ (FREE with tool calling support)."""
+def get_llm(use_vertex=False, streaming=False):
+    """
+    Returns a configured LLM instance using GROQ (FREE with tool calling support).
+    With `streaming`, tokens are delivered to callbacks as they are generated.
+    Instances are shared process-wide and reuse one keep-alive connection pool.
+    """
     api_key = os.getenv("GROQ_API_KEY")
     if not api_key:
         raise ValueError(
@@ -329,216 +353,453 @@ def get_llm(use_vertex=False):
     # 1. "llama-3.3-70b-versatile" - RECOMMENDED: Latest, best performance
     # 2. "llama-3.1-70b-versatile" - Alternative, very reliable
     # 3. "mixtral-8x7b-32768" - Good for complex queries
-    
-    return ChatOpenAI(
-        model="llama-3.3-70b-versatile",  # FREE model with excellent tool calling
-        api_key=api_key,
-        base_url="https://api.groq.com/openai/v1",  # Groq endpoint
-        temperature=0,
-        model_kwargs={
-            "extra_headers": {
-                "HTTP-Referer": "http://localhost:3000",
-                "X-Title": "AI Database Editor"
+    # LLM_MODEL (default "llama-3.3-70b-versatile") is the primary; LLM_FALLBACK_MODELS
+    # take over when it is saturated or slow (see utils/model_router.py)
+    model = LLM_MODEL
+
+    def build(http_client, http_async_client):
+        return RateLimitedChatOpenAI(
+            model=model,
+            api_key=api_key,
+            base_url="https://api.groq.com/openai/v1",  # Groq endpoint
+            temperature=0,
+            streaming=streaming,
+            stream_usage=streaming,  # Real token counts for the rate limiter
+            timeout=LLM_TIMEOUT,
+            max_retries=0,  # Retries and fallback are handled by RateLimitedChatOpenAI
+            http_client=http_client,
+            http_async_client=http_async_client,
+            model_kwargs={
+                "extra_headers": {
+                    "HTTP-Referer": "http://localhost:3000",
+                    "X-Title": "AI Database Editor"
+                }
             }
-        }
-    )
+        )
+
+    # Keyed by the API key too, so rotating GROQ_API_KEY takes effect
+    return llm_clients.get_model((model, streaming, api_key), build)
+
+WRITE_KEYWORDS = ['insert', 'update', 'delete', 'drop', 'alter', 'create', 'truncate']
 
 def validate_query_mode(query: str, mode: str) -> tuple[bool, str]:
     """Validates if the query is allowed in the current mode."""
-    write_keywords = ['insert', 'update', 'delete', 'drop', 'alter', 'create', 'truncate']
     query_lower = query.lower()
     
     if mode == 'read-only':
-        for keyword in write_keywords:
+        for keyword in WRITE_KEYWORDS:
             if keyword in query_lower:
                 return False, f"Cannot execute {keyword.upper()} operation in read-only mode."
     
     return True, ""
 
-def run_llm_query(user_query: str, db_uri: str, db_type: str, mode: str, session) -> dict:
-    """Processes a user's query by routing it to the appropriate agent."""
+def is_cacheable_statement(statement: str, db_type: str) -> bool:
+    """Only statements that don't modify data may be replayed from the SQL cache."""
+    if db_type == 'mongodb':
+        return '.aggregate(' in statement and '$out' not in statement and '$merge' not in statement
+    return bool(READ_STATEMENT.match(statement)) and ';' not in statement.strip().rstrip(';')
+
+def run_cached_query(user_query: str, db, identity: str, fingerprint: str):
+    """
+    Re-runs the cached statement for a repeated question without calling the LLM.
+    Returns the response dict, or None on a miss or if the cached statement fails.
+    """
+    if any(keyword in user_query.lower() for keyword in WRITE_KEYWORDS):
+        # Never answer a data-modifying request by replaying a read
+        return None
+    cached = query_cache.get(identity, fingerprint, user_query)
+    if cached is None:
+        return None
+    try:
+        if isinstance(db, MongoDBDatabase):
+            result = db.run(cached.statement)
+        else:
+            result = db.run(cached.statement, include_columns=cached.include_columns)
+    except Exception as e:
+        print(f"Cached statement failed, falling back to the LLM: {e}")
+        return None
+
+    # Same data as when the answer was generated -> the answer is still exact
+    if result_digest(result) == cached.result_hash:
+        answer = cached.answer
+    else:
+        answer = format_result_answer(result)
+    return {'response': answer, 'sql': cached.statement, 'cached': True}
+
+def build_agent_executor(db, db_type: str, mode: str, llm) -> AgentExecutor:
+    """Builds the tool-calling agent for a SQL or MongoDB database in the given mode."""
+    if db_type == 'mongodb':
+        toolkit = MongoDBDatabaseToolkit(db=db, llm=llm)
+        if mode == 'read-only':
+            system_prompt = (
+                "You are a helpful AI assistant for querying a MongoDB database.\n"
+                "You have access to tools to interact with the database.\n\n"
+                "IMPORTANT: You are in READ-ONLY MODE.\n"
+                "- You can only perform read operations (find, aggregate, count).\n"
+                "- You MUST NOT perform any write operations (insert, update, delete).\n"
+                "- If the user asks to modify data, politely inform them that you're in read-only mode.\n"
+                "- First, list available collections to understand the database structure.\n"
+                "- Then query the data to answer the user's question.\n"
+                "- Provide clear, natural language answers based on the query results."
+            )
+        else:
+            system_prompt = (
+                "You are a helpful AI assistant for querying and managing a MongoDB database.\n"
+                "You have access to tools to interact with the database.\n\n"
+                "You are in READ-WRITE MODE and can perform both read and write operations.\n"
+                "- For write operations, first show what data will be affected.\n"
+                "- Be cautious with write operations and provide clear explanations.\n"
+                "- After write operations, verify the changes.\n"
+                "- First, list available collections to understand the database structure.\n"
+                "- Provide clear explanations of what you're doing and the results."
+            )
+    else:
+        toolkit = SQLDatabaseToolkit(db=db, llm=llm)
+        if mode == 'read-only':
+            system_prompt = (
+                "You are a helpful AI assistant for querying a SQL database.\n"
+                "You have access to tools to interact with the database.\n\n"
+                "IMPORTANT CONSTRAINTS:\n"
+                "- You are in READ-ONLY MODE.\n"
+                "- You MUST NOT execute any INSERT, UPDATE, DELETE, DROP, ALTER, CREATE, or TRUNCATE statements.\n"
+                "- Only SELECT queries are permitted.\n"
+                "- If the user asks to modify data, politely inform them that you're in read-only mode.\n"
+                "- First, explore the database schema to understand available tables.\n"
+                "- Then write a SQL query to answer the user's question.\n"
+                "- Always provide a clear, natural language answer based on the query results.\n"
+                "- If you encounter an error, explain it clearly and suggest corrections."
+            )
+        else:  # read-write mode
+            system_prompt = (
+                "You are a helpful AI assistant for querying and managing a SQL database.\n"
+                "You have access to tools to interact with the database.\n\n"
+                "IMPORTANT:\n"
+                "- You are in READ-WRITE MODE.\n"
+                "- You can execute INSERT, UPDATE, DELETE queries when requested.\n"
+                "- For destructive operations (UPDATE, DELETE), first query the data to show what will be affected.\n"
+                "- Always use WHERE clauses appropriately to avoid unintended modifications.\n"
+                "- After write operations, verify the changes by querying the affected data.\n"
+                "- First, explore the database schema to understand available tables.\n"
+                "- Provide clear explanations of what you're doing and the results."
+            )
+
+    tools = toolkit.get_tools()
+    if db_type != 'mongodb' and validation_available(db.dialect):
+        # Check/repair SQL locally instead of spending an LLM round trip per check
+        tools = [LocalQueryCheckerTool(db=db) if tool.name == 'sql_db_query_checker' else tool for tool in tools]
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", system_prompt),
+        # Similar past questions and their statements (utils/examples.py), per request
+        MessagesPlaceholder(variable_name="examples", optional=True),
+        MessagesPlaceholder(variable_name="chat_history", optional=True),
+        ("human", "{input}"),
+        MessagesPlaceholder(variable_name="agent_scratchpad"),
+    ])
+
+    # Tool outputs are compacted to a token budget each time the scratchpad is rebuilt
+    agent = create_tool_calling_agent(llm, tools, prompt, message_formatter=compact_scratchpad)
+    return AgentExecutor(
+        agent=agent, 
+        tools=tools, 
+        verbose=True,
+        max_iterations=15,  # Increased for complex queries
+        max_execution_time=60,  # 60 second timeout
+        early_stopping_method="generate",
+        handle_parsing_errors=True,  # Better error handling
+        return_intermediate_steps=True  # Needed to cache the final SQL
+    )
+
+class QueryContext:
+    """Everything a query needs once the database is connected."""
+
+    def __init__(self, db, db_type: str, identity: str, fingerprint: str, resource=None):
+        self.db = db
+        self.db_type = db_type
+        self.identity = identity
+        self.fingerprint = fingerprint
+        # Pooled engine / MongoClient behind db; cached agents are only reused on the same one
+        self.resource = resource
+
+def open_database(db_uri: str, db_type: str, mode: str) -> QueryContext:
+    """
+    Connects (through the shared pools/caches) and returns the query context.
+    Blocking: does database I/O. Raises ConnectionError if the database is unreachable.
+    """
+    identity = database_identity(db_uri)
+
+    if db_type in ['postgresql', 'mysql']:
+        try:
+            # Pooled engine + shared schema cache, so table listings and
+            # definitions are not reflected from scratch on every request
+            db = get_sql_database(db_uri, mode)
+            fingerprint = db.schema_fingerprint
+        except Exception as e:
+            raise ConnectionError(f"Failed to connect to database: {str(e)}")
+        # Column profiles for the agent's schema context are gathered in the background
+        profile_store.schedule(db)
+        return QueryContext(db, db_type, identity, fingerprint, db._engine)
+
+    try:
+        client = get_mongo_client(db_uri, mode)
+        # Test connection
+        client.admin.command('ping')
+    except Exception as e:
+        raise ConnectionError(f"Failed to connect to MongoDB: {str(e)}")
+
+    # Extract database name from URI
+    db_name = db_uri.split('/')[-1].split('?')[0]
+    if not db_name or db_name == '':
+        db_name = 'test'
+
+    # The toolkit expects the LangChain wrapper, not a raw pymongo Database;
+    # the guarded one checks each pipeline's explain() against the cost budgets
+    db = GuardedMongoDBDatabase(client, db_name, identity=identity)
+    collections = ','.join(sorted(db.get_usable_collection_names()))
+    fingerprint = hashlib.sha1(collections.encode('utf-8')).hexdigest()[:16]
+    return QueryContext(db, db_type, identity, fingerprint, client)
+
+def finish_query(ctx: QueryContext, user_query: str, mode: str, session, response: dict) -> dict:
+    """Caches the statement that answered the question, records history, and builds the reply."""
+    final_answer = response.get('output', 'No answer found.')
+
+    # Remember the statement that answered the question so repeats skip the LLM
+    steps = response.get('intermediate_steps')
+    agent_iterations.observe(len(steps or []))
+    statement, observation = extract_final_statement(steps)
+    only_reads = all(is_cacheable_statement(stmt, ctx.db_type) for stmt, _ in executed_statements(steps))
+    if statement and only_reads:
+        query_cache.put(ctx.identity, ctx.fingerprint, user_query, statement, final_answer, observation)
+        example_store.add(ctx.identity, ctx.db_type, user_query, statement)
+
+    if mode == 'read-write':
+        record_change_history(session, user_query)
+
+    if statement:
+        return {'response': final_answer, 'sql': statement}
+    return {'response': final_answer}
+
+def record_change_history(session, user_query: str, captured_only: bool = False):
+    """
+    Logs a write question in the session's change history (utils/history.py), linked
+    to the before-images captured while answering it so /revert can undo it.
+    With `captured_only`, only logs it if something was actually written.
+    """
+    snapshot_ids = take_captured_changes()
+    write_keywords = ['insert', 'update', 'delete', 'create', 'drop', 'alter']
+    if not snapshot_ids and (captured_only or not any(keyword in user_query.lower() for keyword in write_keywords)):
+        return
+    history_store.record(
+        session.get('sid') or 'anonymous',
+        user_query,
+        f"Executed: {user_query[:100]}{'...' if len(user_query) > 100 else ''}",
+        snapshot_ids,
+    )
+
+def cache_single_shot_result(ctx: QueryContext, user_query: str, result: dict) -> dict:
+    """Stores a single-shot answer in the SQL cache and strips the raw rows from the reply."""
+    rows = result.pop('rows')
+    query_cache.put(ctx.identity, ctx.fingerprint, user_query, result['sql'],
+                    result['response'], rows, include_columns=True)
+    example_store.add(ctx.identity, ctx.db_type, user_query, result['sql'])
+    return result
+
+def attach_result_handle(result: dict) -> dict:
+    """Adds the handle of a large final result so the client can page it via /results/<id>."""
+    result_id = latest_result_id()
+    if result_id:
+        result['result_id'] = result_id
+    return result
+
+def format_query_error(e: Exception) -> dict:
+    """Turns an exception from the query pipeline into a user-facing error message."""
+    error_trace = traceback.format_exc()
+    print(f"Error in run_llm_query: {error_trace}")
+    
+    # Provide more specific error messages
+    error_str = str(e)
+    if "404" in error_str and "tool" in error_str.lower():
+        return {
+            'error': "The model doesn't support tool calling. Please ensure you're using 'llama-3.3-70b-versatile' or another compatible model."
+        }
+    elif "authentication" in error_str.lower() or "api key" in error_str.lower() or "401" in error_str:
+        return {
+            'error': "Authentication failed. Please check your GROQ_API_KEY in the .env file. Get your free key at: https://console.groq.com/keys"
+        }
+    elif "connection" in error_str.lower() or "timeout" in error_str.lower():
+        return {
+            'error': f"Database connection failed: {error_str}. Please check your database URI and network connection."
+        }
+    elif "rate limit" in error_str.lower() or "429" in error_str:
+        return {
+            'error': (
+                "Rate limit exceeded. Groq free tier limits:\n"
+                "- 30 requests per minute\n"
+                "- 14,400 requests per day\n"
+                "- ~20,000-30,000 tokens per minute\n"
+                "Please wait a moment and try again."
+            )
+        }
+    else:
+        return {
+            'error': f"An error occurred: {error_str}. Please check the console for details."
+        }
+
+def run_llm_query(user_query: str, db_uri: str, db_type: str, mode: str, session, fast: bool = None,
+                  callbacks: list = None) -> dict:
+    """
+    Processes a user's query by routing it to the appropriate agent.
+    Greetings and metadata/count/preview questions are answered locally first.
+    Repeated questions are answered from the generated-SQL cache without the LLM.
+    With `fast` (default: SINGLE_SHOT_MODE env), SQL databases first try the
+    single-shot path and only fall back to the agent if that fails.
+    `callbacks` receive agent progress and LLM tokens (used by /query/stream).
+    """
+    started = time.perf_counter()
+    # LLM calls below queue fairly per session in the shared rate limiter
+    session_token = current_session.set(session.get('sid') or 'anonymous')
+    results_token = current_results.set([])
+    changes_token = current_changes.set([])
+    scope_token = current_table_scope.set(None)
     try:
         # Validate query mode
         is_valid, error_msg = validate_query_mode(user_query, mode)
         if not is_valid:
-            return {'error': error_msg}
-        
-        llm = get_llm()
-        agent_executor = None
-
-        if db_type in ['postgresql', 'mysql']:
-            # Initialize SQL Database
-            try:
-                db = SQLDatabase.from_uri(db_uri)
-            except Exception as e:
-                return {'error': f"Failed to connect to database: {str(e)}"}
-            
-            toolkit = SQLDatabaseToolkit(db=db, llm=llm)
-            tools = toolkit.get_tools()
-
-            if mode == 'read-only':
-                system_prompt = (
-                    "You are a helpful AI assistant for querying a SQL database.\n"
-                    "You have access to tools to interact with the database.\n\n"
-                    "IMPORTANT CONSTRAINTS:\n"
-                    "- You are in READ-ONLY MODE.\n"
-                    "- You MUST NOT execute any INSERT, UPDATE, DELETE, DROP, ALTER, CREATE, or TRUNCATE statements.\n"
-                    "- Only SELECT queries are permitted.\n"
-                    "- If the user asks to modify data, politely inform them that you're in read-only mode.\n"
-                    "- First, explore the database schema to understand available tables.\n"
-                    "- Then write a SQL query to answer the user's question.\n"
-                    "- Always provide a clear, natural language answer based on the query results.\n"
-                    "- If you encounter an error, explain it clearly and suggest corrections."
-                )
-            else:  # read-write mode
-                system_prompt = (
-                    "You are a helpful AI assistant for querying and managing a SQL database.\n"
-                    "You have access to tools to interact with the database.\n\n"
-                    "IMPORTANT:\n"
-                    "- You are in READ-WRITE MODE.\n"
-                    "- You can execute INSERT, UPDATE, DELETE queries when requested.\n"
-                    "- For destructive operations (UPDATE, DELETE), first query the data to show what will be affected.\n"
-                    "- Always use WHERE clauses appropriately to avoid unintended modifications.\n"
-                    "- After write operations, verify the changes by querying the affected data.\n"
-                    "- First, explore the database schema to understand available tables.\n"
-                    "- Provide clear explanations of what you're doing and the results."
-                )
-            
-            prompt = ChatPromptTemplate.from_messages([
-                ("system", system_prompt),
-                MessagesPlaceholder(variable_name="chat_history", optional=True),
-                ("human", "{input}"),
-                MessagesPlaceholder(variable_name="agent_scratchpad"),
-            ])
-
-            agent = create_tool_calling_agent(llm, tools, prompt)
-            agent_executor = AgentExecutor(
-                agent=agent, 
-                tools=tools, 
-                verbose=True,
-                max_iterations=15,  # Increased for complex queries
-                max_execution_time=60,  # 60 second timeout
-                early_stopping_method="generate",
-                handle_parsing_errors=True  # Better error handling
-            )
+            return observe_query('rejected', started, {'error': error_msg})
+        if db_type not in ['postgresql', 'mysql', 'mongodb']:
+            return observe_query('rejected', started,
+                                 {'error': f"Agent for database type '{db_type}' is not implemented."})
 
-        elif db_type == 'mongodb':
-            try:
-                client = MongoClient(db_uri, serverSelectionTimeoutMS=5000)
-                # Test connection
-                client.admin.command('ping')
-            except Exception as e:
-                return {'error': f"Failed to connect to MongoDB: {str(e)}"}
-            
-            # Extract database name from URI
-            db_name = db_uri.split('/')[-1].split('?')[0]
-            if not db_name or db_name == '':
-                db_name = 'test'
-            
-            db = client[db_name]
-
-            toolkit = MongoDBDatabaseToolkit(db=db, llm=llm)
-            tools = toolkit.get_tools()
-
-            if mode == 'read-only':
-                system_prompt = (
-                    "You are a helpful AI assistant for querying a MongoDB database.\n"
-                    "You have access to tools to interact with the database.\n\n"
-                    "IMPORTANT: You are in READ-ONLY MODE.\n"
-                    "- You can only perform read operations (find, aggregate, count).\n"
-                    "- You MUST NOT perform any write operations (insert, update, delete).\n"
-                    "- If the user asks to modify data, politely inform them that you're in read-only mode.\n"
-                    "- First, list available collections to understand the database structure.\n"
-                    "- Then query the data to answer the user's question.\n"
-                    "- Provide clear, natural language answers based on the query results."
-                )
-            else:
-                system_prompt = (
-                    "You are a helpful AI assistant for querying and managing a MongoDB database.\n"
-                    "You have access to tools to interact with the database.\n\n"
-                    "You are in READ-WRITE MODE and can perform both read and write operations.\n"
-                    "- For write operations, first show what data will be affected.\n"
-                    "- Be cautious with write operations and provide clear explanations.\n"
-                    "- After write operations, verify the changes.\n"
-                    "- First, list available collections to understand the database structure.\n"
-                    "- Provide clear explanations of what you're doing and the results."
-                )
-            
-            prompt = ChatPromptTemplate.from_messages([
-                ("system", system_prompt),
-                MessagesPlaceholder(variable_name="chat_history", optional=True),
-                ("human", "{input}"),
-                MessagesPlaceholder(variable_name="agent_scratchpad"),
-            ])
-
-            agent = create_tool_calling_agent(llm, tools, prompt)
-            agent_executor = AgentExecutor(
-                agent=agent, 
-                tools=tools, 
-                verbose=True,
-                max_iterations=15,
-                max_execution_time=60,
-                early_stopping_method="generate",
-                handle_parsing_errors=True
-            )
+        # Small talk and metadata questions are answered locally (utils/intent_router.py)
+        intent = classify_question(user_query) if INTENT_ROUTER_ENABLED else None
+        if intent is not None and intent.name in CONVERSATIONAL_INTENTS:
+            return observe_query('intent', started, answer_conversational(intent, db_type, mode))
+
+        try:
+            ctx = open_database(db_uri, db_type, mode)
+        except ConnectionError as e:
+            return observe_query('error', started, {'error': str(e)})
+
+        if intent is not None:
+            routed = answer_intent(intent, ctx)
+            if routed is not None:
+                return observe_query('intent', started, attach_result_handle(routed))
 
-        if not agent_executor:
-            return {'error': f"Agent for database type '{db_type}' is not implemented."}
+        cached_result = run_cached_query(user_query, ctx.db, ctx.identity, ctx.fingerprint)
+        if cached_result is not None:
+            return observe_query('cache', started, attach_result_handle(cached_result))
+
+        llm = get_llm(streaming=bool(callbacks))
+        examples = example_store.prompt_for(ctx.identity, db_type, user_query)
+        if db_type != 'mongodb':
+            # Large schemas: show the LLM only the tables relevant to the question (utils/table_ranker.py)
+            current_table_scope.set(select_tables(ctx.db, user_query))
+
+        use_single_shot = SINGLE_SHOT_DEFAULT if fast is None else fast
+        if use_single_shot and db_type != 'mongodb':
+            result = run_single_shot_query(user_query, ctx.db, llm, callbacks=callbacks, examples=examples)
+            if result is not None:
+                return observe_query('single_shot', started,
+                                     attach_result_handle(cache_single_shot_result(ctx, user_query, result)))
+
+        # Built once per (database, mode, streaming) and reused until the schema changes
+        agent_executor = agent_cache.get(
+            ctx.identity, db_type, mode, bool(callbacks), ctx.fingerprint,
+            lambda: build_agent_executor(ctx.db, db_type, mode, llm), resource=ctx.resource,
+        )
 
         # Execute the query
         response = agent_executor.invoke({
             "input": user_query,
+            "examples": [("system", examples)] if examples else [],
             "chat_history": []
-        })
-        
-        final_answer = response.get('output', 'No answer found.')
-        
-        # Track write operations in session history
+        }, config={'callbacks': callbacks})
+
+        result = attach_result_handle(finish_query(ctx, user_query, mode, session, response))
+        return observe_query('agent', started, result)
+
+    except Exception as e:
         if mode == 'read-write':
-            write_keywords = ['insert', 'update', 'delete', 'create', 'drop', 'alter']
-            if any(keyword in user_query.lower() for keyword in write_keywords):
-                if 'history' not in session:
-                    session['history'] = []
-                
-                session['history'].append({
-                    'query': user_query,
-                    'description': f"Executed: {user_query[:100]}{'...' if len(user_query) > 100 else ''}",
-                    'timestamp': datetime.now().isoformat(),  # Fixed timestamp
-                    'reverted': False
-                })
-                session.modified = True
-        
-        return {'response': final_answer}
+            # Writes that ran before the failure can still be reverted
+            record_change_history(session, user_query, captured_only=True)
+        return observe_query('error', started, format_query_error(e))
+    finally:
+        current_table_scope.reset(scope_token)
+        current_changes.reset(changes_token)
+        current_results.reset(results_token)
+        current_session.reset(session_token)
+
+async def arun_llm_query(user_query: str, db_uri: str, db_type: str, mode: str, session, fast: bool = None,
+                         callbacks: list = None) -> dict:
+    """
+    Async twin of run_llm_query for the ASGI app: LLM calls use `ainvoke`, so
+    waiting on Groq doesn't hold a thread. Blocking database setup runs in a
+    worker thread; the agent's sync database tools run in LangChain's executor.
+    """
+    started = time.perf_counter()
+    # LLM calls below queue fairly per session in the shared rate limiter
+    session_token = current_session.set(session.get('sid') or 'anonymous')
+    results_token = current_results.set([])
+    changes_token = current_changes.set([])
+    scope_token = current_table_scope.set(None)
+    try:
+        is_valid, error_msg = validate_query_mode(user_query, mode)
+        if not is_valid:
+            return observe_query('rejected', started, {'error': error_msg})
+        if db_type not in ['postgresql', 'mysql', 'mongodb']:
+            return observe_query('rejected', started,
+                                 {'error': f"Agent for database type '{db_type}' is not implemented."})
+
+        intent = classify_question(user_query) if INTENT_ROUTER_ENABLED else None
+        if intent is not None and intent.name in CONVERSATIONAL_INTENTS:
+            return observe_query('intent', started, answer_conversational(intent, db_type, mode))
+
+        try:
+            ctx = await asyncio.to_thread(open_database, db_uri, db_type, mode)
+        except ConnectionError as e:
+            return observe_query('error', started, {'error': str(e)})
+
+        if intent is not None:
+            routed = await asyncio.to_thread(answer_intent, intent, ctx)
+            if routed is not None:
+                return observe_query('intent', started, attach_result_handle(routed))
+
+        cached_result = await asyncio.to_thread(run_cached_query, user_query, ctx.db, ctx.identity, ctx.fingerprint)
+        if cached_result is not None:
+            return observe_query('cache', started, attach_result_handle(cached_result))
+
+        llm = get_llm(streaming=bool(callbacks))
+        examples = await asyncio.to_thread(example_store.prompt_for, ctx.identity, db_type, user_query)
+        if db_type != 'mongodb':
+            current_table_scope.set(await asyncio.to_thread(select_tables, ctx.db, user_query))
+
+        use_single_shot = SINGLE_SHOT_DEFAULT if fast is None else fast
+        if use_single_shot and db_type != 'mongodb':
+            result = await arun_single_shot_query(user_query, ctx.db, llm, callbacks=callbacks, examples=examples)
+            if result is not None:
+                return observe_query('single_shot', started,
+                                     attach_result_handle(cache_single_shot_result(ctx, user_query, result)))
+
+        # Built once per (database, mode, streaming) and reused until the schema changes
+        agent_executor = agent_cache.get(
+            ctx.identity, db_type, mode, bool(callbacks), ctx.fingerprint,
+            lambda: build_agent_executor(ctx.db, db_type, mode, llm), resource=ctx.resource,
+        )
+        response = await agent_executor.ainvoke({
+            "input": user_query,
+            "examples": [("system", examples)] if examples else [],
+            "chat_history": []
+        }, config={'callbacks': callbacks})
+
+        result = attach_result_handle(finish_query(ctx, user_query, mode, session, response))
+        return observe_query('agent', started, result)
 
     except Exception as e:
-        error_trace = traceback.format_exc()
-        print(f"Error in run_llm_query: {error_trace}")
-        
-        # Provide more specific error messages
-        error_str = str(e)
-        if "404" in error_str and "tool" in error_str.lower():
-            return {
-                'error': "The model doesn't support tool calling. Please ensure you're using 'llama-3.3-70b-versatile' or another compatible model."
-            }
-        elif "authentication" in error_str.lower() or "api key" in error_str.lower() or "401" in error_str:
-            return {
-                'error': "Authentication failed. Please check your GROQ_API_KEY in the .env file. Get your free key at: https://console.groq.com/keys"
-            }
-        elif "connection" in error_str.lower() or "timeout" in error_str.lower():
-            return {
-                'error': f"Database connection failed: {error_str}. Please check your database URI and network connection."
-            }
-        elif "rate limit" in error_str.lower() or "429" in error_str:
-            return {
-                'error': (
-                    "Rate limit exceeded. Groq free tier limits:\n"
-                    "- 30 requests per minute\n"
-                    "- 14,400 requests per day\n"
-                    "- ~20,000-30,000 tokens per minute\n"
-                    "Please wait a moment and try again."
-                )
-            }
-        else:
-            return {
-                'error': f"An error occurred: {error_str}. Please check the console for details."
-            }
\ No newline at end of file
+        if mode == 'read-write':
+            # Writes that ran before the failure can still be reverted
+            record_change_history(session, user_query, captured_only=True)
+        return observe_query('error', started, format_query_error(e))
+    finally:
+        current_table_scope.reset(scope_token)
+        current_changes.reset(changes_token)
+        current_results.reset(results_token)
+        current_session.reset(session_token)
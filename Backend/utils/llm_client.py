@@ -0,0 +1,279 @@
+# Backend/utils/llm_client.py
+#
+# Process-wide HTTP clients for the LLM API. get_llm() used to build a new
+# ChatOpenAI, and with it a new HTTP client, on every query, so agent
+# iterations kept paying for fresh TCP + TLS handshakes to api.groq.com.
+# The clients here keep connections alive across requests and threads, use
+# HTTP/2 when the `h2` package is installed, and apply explicit timeouts.
+
+import asyncio
+import json
+import os
+import threading
+import time
+
+import httpx
+from langchain_openai import ChatOpenAI
+
+from utils.metrics import llm_request_seconds, llm_retries, llm_tokens
+from utils.model_router import model_router
+from utils.rate_limit import LLM_RATE_COMPLETION_TOKENS, rate_limiter
+
+LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT_SECONDS', 60))
+LLM_CONNECT_TIMEOUT = float(os.getenv('LLM_CONNECT_TIMEOUT_SECONDS', 5))
+LLM_MAX_CONNECTIONS = int(os.getenv('LLM_MAX_CONNECTIONS', 50))
+LLM_MAX_KEEPALIVE = int(os.getenv('LLM_MAX_KEEPALIVE_CONNECTIONS', 20))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv('LLM_KEEPALIVE_EXPIRY_SECONDS', 120))
+LLM_HTTP2 = os.getenv('LLM_HTTP2', 'true').lower() in ('1', 'true', 'yes')
+
+
+def _http2_available():
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _client_args():
+    return {
+        'http2': LLM_HTTP2 and _http2_available(),
+        'timeout': httpx.Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+        'limits': httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_KEEPALIVE,
+            keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+        ),
+    }
+
+
+class LLMClientPool:
+    """
+    Lazily created, shared sync and async httpx clients plus a cache of chat
+    models built on them. httpx clients are thread-safe; the async client is
+    meant for the single event loop of the ASGI app.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._client = None
+        self._async_client = None
+        self._models = {}
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                self._client = httpx.Client(**_client_args())
+            return self._client
+
+    @property
+    def async_client(self):
+        with self._lock:
+            if self._async_client is None:
+                self._async_client = httpx.AsyncClient(**_client_args())
+            return self._async_client
+
+    def get_model(self, key, factory):
+        """Returns the cached model for `key`, building it with factory(client, async_client) once."""
+        with self._lock:
+            model = self._models.get(key)
+        if model is not None:
+            return model
+        model = factory(self.client, self.async_client)
+        with self._lock:
+            # Another thread may have won the race; keep the first one
+            return self._models.setdefault(key, model)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'http2': LLM_HTTP2 and _http2_available(),
+                'cached_models': len(self._models),
+                'max_connections': LLM_MAX_CONNECTIONS,
+                'max_keepalive_connections': LLM_MAX_KEEPALIVE,
+                'timeout_seconds': LLM_TIMEOUT,
+            }
+
+
+# Process-wide singleton
+llm_clients = LLMClientPool()
+
+
+def estimate_tokens(messages, kwargs, max_tokens=None):
+    """Rough prompt + completion token count (~4 characters per token) for rate limiting."""
+    chars = sum(len(str(message.content)) for message in messages)
+    if kwargs.get('tools'):
+        chars += len(json.dumps(kwargs['tools'], default=str))
+    return chars // 4 + (max_tokens or LLM_RATE_COMPLETION_TOKENS)
+
+
+def _usage_tokens(message):
+    usage = getattr(message, 'usage_metadata', None)
+    return usage.get('total_tokens') if usage else None
+
+
+def _record_usage(message, model):
+    """Counts the tokens a completion reports, under the model that actually served it."""
+    usage = getattr(message, 'usage_metadata', None)
+    if not usage:
+        return
+    model = (getattr(message, 'response_metadata', None) or {}).get('model_name') or model
+    llm_tokens.inc(usage.get('input_tokens', 0), model=model, kind='prompt')
+    llm_tokens.inc(usage.get('output_tokens', 0), model=model, kind='completion')
+
+
+class RateLimitedChatOpenAI(ChatOpenAI):
+    """
+    ChatOpenAI whose every completion (agent steps included) first takes from
+    the shared rate limiter, and is retried / moved down the model fallback
+    chain on transient failures (utils/model_router.py). Waits and retries are
+    reported to callbacks as `on_text` notices with a `rate_limit` or
+    `llm_retry` payload (used by the SSE stream).
+    """
+
+    def _wait_notice(self, tokens):
+        expected = rate_limiter.expected_wait(tokens)
+        if expected <= 0:
+            return None
+        return {'expected_wait_seconds': round(expected, 1), 'queue_depth': rate_limiter.stats()['queue_depth']}
+
+    def _retry_notice(self, model, action, delay, error):
+        print(f"LLM call to {model} failed ({type(error).__name__}: {error}); {action}")
+        return {'model': model, 'action': action, 'delay_seconds': round(delay or 0, 1), 'error': type(error).__name__}
+
+    def _call(self, call, tokens, run_manager):
+        """Runs call(model) under the rate limiter with retries and model fallback."""
+        notice = self._wait_notice(tokens)
+        if notice and run_manager:
+            run_manager.on_text(f"Waiting ~{notice['expected_wait_seconds']}s for LLM capacity\n", rate_limit=notice)
+        error = None
+        for model in model_router.candidates(self.model_name):
+            attempt = 0
+            while True:
+                rate_limiter.acquire(tokens)
+                started = time.monotonic()
+                try:
+                    result = call(model)
+                except Exception as e:
+                    llm_request_seconds.observe(time.monotonic() - started, model=model, outcome='error')
+                    action, delay = model_router.plan(model, attempt, e)
+                    if action == 'raise':
+                        raise
+                    llm_retries.inc(model=model, action=action)
+                    error = e
+                    if run_manager:
+                        run_manager.on_text(f"LLM {action} after {type(e).__name__}\n",
+                                            llm_retry=self._retry_notice(model, action, delay, e))
+                    if action == 'fallback':
+                        break
+                    time.sleep(delay)
+                    attempt += 1
+                    continue
+                elapsed = time.monotonic() - started
+                llm_request_seconds.observe(elapsed, model=model, outcome='ok')
+                model_router.record_success(model, elapsed)
+                return result
+        raise error
+
+    async def _acall(self, call, tokens, run_manager):
+        """Async twin of _call; call(model) returns an awaitable."""
+        notice = self._wait_notice(tokens)
+        if notice and run_manager:
+            await run_manager.on_text(f"Waiting ~{notice['expected_wait_seconds']}s for LLM capacity\n", rate_limit=notice)
+        error = None
+        for model in model_router.candidates(self.model_name):
+            attempt = 0
+            while True:
+                await rate_limiter.aacquire(tokens)
+                started = time.monotonic()
+                try:
+                    result = await call(model)
+                except Exception as e:
+                    llm_request_seconds.observe(time.monotonic() - started, model=model, outcome='error')
+                    action, delay = model_router.plan(model, attempt, e)
+                    if action == 'raise':
+                        raise
+                    llm_retries.inc(model=model, action=action)
+                    error = e
+                    if run_manager:
+                        await run_manager.on_text(f"LLM {action} after {type(e).__name__}\n",
+                                                  llm_retry=self._retry_notice(model, action, delay, e))
+                    if action == 'fallback':
+                        break
+                    await asyncio.sleep(delay)
+                    attempt += 1
+                    continue
+                elapsed = time.monotonic() - started
+                llm_request_seconds.observe(elapsed, model=model, outcome='ok')
+                model_router.record_success(model, elapsed)
+                return result
+        raise error
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        tokens = estimate_tokens(messages, kwargs, self.max_tokens)
+        parent = super(RateLimitedChatOpenAI, self)
+        result = self._call(
+            lambda model: parent._generate(messages, stop=stop, run_manager=run_manager, **{**kwargs, 'model': model}),
+            tokens, run_manager,
+        )
+        message = result.generations[0].message if result.generations else None
+        rate_limiter.settle(tokens, _usage_tokens(message))
+        _record_usage(message, self.model_name)
+        return result
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        tokens = estimate_tokens(messages, kwargs, self.max_tokens)
+        parent = super(RateLimitedChatOpenAI, self)
+        result = await self._acall(
+            lambda model: parent._agenerate(messages, stop=stop, run_manager=run_manager, **{**kwargs, 'model': model}),
+            tokens, run_manager,
+        )
+        message = result.generations[0].message if result.generations else None
+        rate_limiter.settle(tokens, _usage_tokens(message))
+        _record_usage(message, self.model_name)
+        return result
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        tokens = estimate_tokens(messages, kwargs, self.max_tokens)
+        parent = super(RateLimitedChatOpenAI, self)
+
+        def start(model):
+            # Retries only cover opening the stream and its first chunk; once
+            # tokens have reached the client, a failure is surfaced as-is
+            chunks = parent._stream(messages, stop=stop, run_manager=run_manager, **{**kwargs, 'model': model})
+            return chunks, next(chunks, None)
+
+        chunks, first = self._call(start, tokens, run_manager)
+        used, usage_message = None, None
+        if first is not None:
+            used = _usage_tokens(first.message)
+            usage_message = first.message if used else None
+            yield first
+        for chunk in chunks:
+            if _usage_tokens(chunk.message):
+                used, usage_message = _usage_tokens(chunk.message), chunk.message
+            yield chunk
+        rate_limiter.settle(tokens, used)
+        _record_usage(usage_message, self.model_name)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        tokens = estimate_tokens(messages, kwargs, self.max_tokens)
+        parent = super(RateLimitedChatOpenAI, self)
+
+        async def start(model):
+            chunks = parent._astream(messages, stop=stop, run_manager=run_manager, **{**kwargs, 'model': model})
+            return chunks, await anext(chunks, None)
+
+        chunks, first = await self._acall(start, tokens, run_manager)
+        used, usage_message = None, None
+        if first is not None:
+            used = _usage_tokens(first.message)
+            usage_message = first.message if used else None
+            yield first
+        async for chunk in chunks:
+            if _usage_tokens(chunk.message):
+                used, usage_message = _usage_tokens(chunk.message), chunk.message
+            yield chunk
+        rate_limiter.settle(tokens, used)
+        _record_usage(usage_message, self.model_name)
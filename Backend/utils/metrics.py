@@ -0,0 +1,200 @@
+# Backend/utils/metrics.py
+#
+# In-process metrics in the Prometheus text format, served on /metrics. The
+# only observability used to be the agent's verbose log and printed
+# tracebacks, which can't say whether slow questions are LLM-bound,
+# database-bound or stuck in the rate limiter's queue. The pipeline records:
+#   - end-to-end query latency per answer path (intent, cache, single_shot, agent)
+#   - LLM call latency, retries and tokens per model
+#   - rate limiter wait time and timeouts
+#   - database statement time and rows returned
+#   - agent iterations per question
+# Cache hit/miss counts, connection pool usage and queue depths are read from
+# the existing stats() of each component when /metrics is scraped.
+#
+# Counters and histograms are plain dicts behind one lock per metric (no
+# dependency on prometheus_client); recording is a dict update and a bisect.
+
+import bisect
+import os
+import threading
+import time
+
+METRICS_ENABLED = os.getenv('METRICS', 'true').lower() in ('1', 'true', 'yes')
+METRICS_PREFIX = 'dbassistant_'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000)
+ITERATION_BUCKETS = (0, 1, 2, 3, 4, 5, 6, 8, 10, 15)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"'))
+        for name, value in labels
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = METRICS_PREFIX + name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            lines.append(f'{self.name}{_format_labels(zip(self.labelnames, key))} {_format_value(value)}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = METRICS_PREFIX + name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [per-bucket counts (+Inf last), sum, count]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            values = sorted((key, ([*counts], total, count)) for key, (counts, total, count) in self._values.items())
+        for key, (counts, total, count) in values:
+            labels = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = _format_value(bound) if bound != float('inf') else '+Inf'
+                lines.append(f'{self.name}_bucket{_format_labels(labels + [("le", le)])} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(labels)} {_format_value(total)}')
+            lines.append(f'{self.name}_count{_format_labels(labels)} {count}')
+        return lines
+
+
+# Recorded by the pipeline
+query_seconds = Histogram('query_seconds', 'End-to-end time to answer a question, by answer path.', ['path'])
+llm_request_seconds = Histogram(
+    'llm_request_seconds', 'LLM completion latency per model (time to first chunk when streaming).',
+    ['model', 'outcome'],
+)
+llm_tokens = Counter('llm_tokens_total', 'Tokens reported by the LLM API, per model and kind.', ['model', 'kind'])
+llm_retries = Counter('llm_retries_total', 'Failed LLM calls that were retried or moved to a fallback model.',
+                      ['model', 'action'])
+rate_limit_wait_seconds = Histogram('rate_limit_wait_seconds', 'Time LLM calls waited for rate limiter capacity.')
+rate_limit_timeouts = Counter('rate_limit_timeouts_total', 'LLM calls that gave up waiting for capacity.')
+db_query_seconds = Histogram('db_query_seconds', 'Statement execution time, including the cost check.',
+                             ['db_type', 'kind'])
+db_rows = Histogram('db_rows', 'Rows (documents) a statement returned to the caller.', ['db_type'],
+                    buckets=ROW_BUCKETS)
+agent_iterations = Histogram('agent_iterations', 'Tool calls the agent made to answer a question.',
+                             buckets=ITERATION_BUCKETS)
+
+RECORDED = [query_seconds, llm_request_seconds, llm_tokens, llm_retries, rate_limit_wait_seconds,
+            rate_limit_timeouts, db_query_seconds, db_rows, agent_iterations]
+
+
+def _samples(lines, name, documentation, samples, kind='gauge'):
+    """Renders (labels, value) samples read from elsewhere as one metric family."""
+    name = METRICS_PREFIX + name
+    lines += [f'# HELP {name} {documentation}', f'# TYPE {name} {kind}']
+    lines += [f'{name}{_format_labels(sorted(labels.items()))} {_format_value(value)}'
+              for labels, value in samples if value is not None]
+
+
+def _component_metrics():
+    """Samples read from the components' own stats() at scrape time."""
+    # Imported here: several of these modules import this one
+    from utils.agent_cache import agent_cache
+    from utils.jobs import job_queue
+    from utils.pool import pool_stats
+    from utils.query_cache import query_cache
+    from utils.rate_limit import rate_limiter
+    from utils.result_cache import result_cache
+
+    lines = []
+    caches = {'query': (query_cache.hits, query_cache.misses)}
+    for name, stats in (('result', result_cache.stats()), ('agent', agent_cache.stats())):
+        caches[name] = (stats['hits'], stats['misses'])
+    _samples(lines, 'cache_hits_total', 'Cache hits, per cache.',
+             [({'cache': name}, hits) for name, (hits, _) in caches.items()], kind='counter')
+    _samples(lines, 'cache_misses_total', 'Cache misses, per cache.',
+             [({'cache': name}, misses) for name, (_, misses) in caches.items()], kind='counter')
+
+    pools = pool_stats()
+    engines = [({'database_id': entry['database_id'], 'mode': entry['mode']}, entry) for entry in pools['sql']]
+    for name, field, documentation in (
+            ('pool_size', 'pool_size', 'Configured connections per engine pool.'),
+            ('pool_checked_out', 'checked_out', 'Connections currently in use, per engine pool.'),
+            ('pool_overflow', 'overflow', 'Connections open beyond pool_size, per engine pool.')):
+        _samples(lines, name, documentation, [(labels, entry.get(field)) for labels, entry in engines])
+    _samples(lines, 'pool_engines', 'Pooled engines / clients currently open.',
+             [({'driver': driver}, len(pools[driver])) for driver in ('sql', 'mongodb')])
+
+    limiter = rate_limiter.stats()
+    _samples(lines, 'rate_limit_queue_depth', 'LLM calls waiting for rate limiter capacity.',
+             [({}, limiter['queue_depth'])])
+    _samples(lines, 'rate_limit_available_tokens', 'Tokens currently available in the rate limiter.',
+             [({}, limiter['available_tokens'])])
+    jobs = job_queue.stats()
+    _samples(lines, 'jobs_running', 'Async query jobs being processed.', [({}, jobs['running'])])
+    _samples(lines, 'jobs_queued', 'Async query jobs waiting for a worker.', [({}, jobs['queued'])])
+    return lines
+
+
+def render_metrics():
+    """The /metrics body (Prometheus text exposition format 0.0.4)."""
+    lines = []
+    for metric in RECORDED:
+        lines += metric.render()
+    lines += _component_metrics()
+    return '\n'.join(lines) + '\n'
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def observe_query(path, started, result):
+    """
+    Records a finished question under its answer path and returns the result
+    unchanged. Failed answers count as 'error', except requests rejected up front.
+    """
+    if path != 'rejected' and isinstance(result, dict) and 'error' in result:
+        path = 'error'
+    query_seconds.observe(time.perf_counter() - started, path=path)
+    return result
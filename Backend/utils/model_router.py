@@ -0,0 +1,143 @@
+# Backend/utils/model_router.py
+#
+# Retry and fallback policy for LLM calls. A transient 429 or 5xx from Groq
+# used to go straight back to the user as an error string. Calls are now
+# retried with jittered exponential backoff (honouring Retry-After), and when
+# the primary model stays saturated or slow they move down a configurable
+# chain of fallback models. Per-model latency is tracked so a degraded model
+# is skipped for a cooldown window instead of being retried on every call.
+
+import os
+import random
+import threading
+import time
+
+import httpx
+import openai
+
+LLM_MODEL = os.getenv('LLM_MODEL', 'llama-3.3-70b-versatile')
+# Comma-separated, tried in order once the primary is saturated or slow
+LLM_FALLBACK_MODELS = [
+    model.strip() for model in os.getenv('LLM_FALLBACK_MODELS', 'llama-3.1-8b-instant').split(',') if model.strip()
+]
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', 2))
+LLM_RETRY_BASE = float(os.getenv('LLM_RETRY_BASE_SECONDS', 0.5))
+# A Retry-After longer than this means "saturated": fall back instead of waiting
+LLM_RETRY_MAX_DELAY = float(os.getenv('LLM_RETRY_MAX_SECONDS', 10))
+LLM_SLOW_SECONDS = float(os.getenv('LLM_SLOW_SECONDS', 20))
+LLM_MODEL_COOLDOWN = float(os.getenv('LLM_MODEL_COOLDOWN_SECONDS', 60))
+
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.InternalServerError,
+    openai.APIConnectionError,  # Includes APITimeoutError
+    httpx.TransportError,
+)
+
+# Smoothing factor for the per-model latency average
+_LATENCY_ALPHA = 0.3
+
+
+def retry_after(error):
+    """Seconds the server asked us to wait (Retry-After / retry-after-ms), or None."""
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get('retry-after-ms'):
+            return float(headers['retry-after-ms']) / 1000
+        if headers.get('retry-after'):
+            return float(headers['retry-after'])
+    except ValueError:
+        return None  # HTTP-date form; fall back to our own backoff
+    return None
+
+
+def backoff_delay(attempt):
+    """Full-jitter exponential backoff: uniform(0, base * 2^attempt), capped."""
+    return random.uniform(0, min(LLM_RETRY_MAX_DELAY, LLM_RETRY_BASE * (2 ** attempt)))
+
+
+class _ModelStats:
+    def __init__(self):
+        self.calls = 0
+        self.failures = 0
+        self.latency = None
+        self.cooldown_until = 0.0
+
+
+class ModelRouter:
+    """Orders the model chain, skipping models that are cooling down after failures or slowness."""
+
+    def __init__(self, primary=LLM_MODEL, fallbacks=None):
+        self.primary = primary
+        self.fallbacks = LLM_FALLBACK_MODELS if fallbacks is None else fallbacks
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _stats_for(self, model):
+        return self._stats.setdefault(model, _ModelStats())
+
+    def candidates(self, requested=None):
+        """The chain to try for a call, healthy models first."""
+        chain = [requested or self.primary] + [model for model in self.fallbacks if model != requested]
+        now = time.time()
+        with self._lock:
+            healthy = [model for model in chain if self._stats_for(model).cooldown_until <= now]
+        # If everything is cooling down, still try the whole chain in order
+        return healthy or chain
+
+    def record_success(self, model, seconds):
+        with self._lock:
+            stats = self._stats_for(model)
+            stats.calls += 1
+            stats.latency = seconds if stats.latency is None else (
+                _LATENCY_ALPHA * seconds + (1 - _LATENCY_ALPHA) * stats.latency
+            )
+            if stats.latency > LLM_SLOW_SECONDS:
+                # Degraded: route around it for a while, then give it another chance
+                stats.cooldown_until = time.time() + LLM_MODEL_COOLDOWN
+                stats.latency = None
+
+    def record_failure(self, model, cooldown=None):
+        with self._lock:
+            stats = self._stats_for(model)
+            stats.calls += 1
+            stats.failures += 1
+            if cooldown:
+                stats.cooldown_until = max(stats.cooldown_until, time.time() + cooldown)
+
+    def plan(self, model, attempt, error):
+        """
+        Decides what to do after a failed call: ('retry', delay) on the same
+        model, ('fallback', None) to move to the next model, or ('raise', None).
+        """
+        if not isinstance(error, RETRYABLE_ERRORS):
+            return 'raise', None
+        wait = retry_after(error)
+        if wait is not None and wait > LLM_RETRY_MAX_DELAY:
+            self.record_failure(model, cooldown=max(wait, LLM_MODEL_COOLDOWN))
+            return 'fallback', None
+        if attempt >= LLM_MAX_RETRIES:
+            self.record_failure(model, cooldown=LLM_MODEL_COOLDOWN)
+            return 'fallback', None
+        self.record_failure(model)
+        return 'retry', wait if wait is not None else backoff_delay(attempt)
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            return {
+                model: {
+                    'calls': stats.calls,
+                    'failures': stats.failures,
+                    'latency_seconds': round(stats.latency, 2) if stats.latency is not None else None,
+                    'cooldown_seconds': round(max(0.0, stats.cooldown_until - now), 1),
+                }
+                for model, stats in self._stats.items()
+            }
+
+
+# Process-wide singleton
+model_router = ModelRouter()
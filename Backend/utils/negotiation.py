@@ -0,0 +1,212 @@
+# Backend/utils/negotiation.py
+#
+# Content negotiation for JSON API responses. Tabular payloads (a `columns`
+# list plus `rows`) repeat every column name per row when sent as JSON
+# objects, and wide analytics results are slow to encode and parse. Clients
+# can ask, via the Accept header, for:
+#   - application/json                         the default layout, unchanged
+#   - application/vnd.dbassistant.columnar+json  column names once, one typed array per column
+#   - application/msgpack                      the columnar layout as MessagePack
+#   - application/vnd.apache.arrow.stream      the rows as an Arrow IPC stream (needs pyarrow)
+# and the body is compressed with zstd, brotli or gzip per Accept-Encoding.
+# Browsers decompress transparently, so the web client only decodes the layout.
+#
+# encode_response() is framework-neutral; routes wrap it for Flask or Quart.
+
+import gzip
+import json
+import os
+
+try:
+    import ormsgpack
+except ImportError:  # Optional: MessagePack is offered only when it is installed
+    ormsgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+JSON = 'application/json'
+COLUMNAR_JSON = 'application/vnd.dbassistant.columnar+json'
+MSGPACK = 'application/msgpack'
+ARROW = 'application/vnd.apache.arrow.stream'
+
+# Bodies smaller than this aren't worth compressing
+COMPRESS_MIN_BYTES = int(os.getenv('RESPONSE_COMPRESS_MIN_BYTES', 1024))
+ZSTD_LEVEL = int(os.getenv('RESPONSE_ZSTD_LEVEL', 3))
+GZIP_LEVEL = int(os.getenv('RESPONSE_GZIP_LEVEL', 6))
+BROTLI_QUALITY = int(os.getenv('RESPONSE_BROTLI_QUALITY', 4))
+
+# Server preference order when the client accepts several equally
+FORMAT_PREFERENCE = [ARROW, MSGPACK, COLUMNAR_JSON, JSON]
+ENCODING_PREFERENCE = ['zstd', 'br', 'gzip']
+
+
+def _parse_header(header):
+    """Parses an Accept/Accept-Encoding header into {value: q}."""
+    values = {}
+    for item in (header or '').split(','):
+        parts = [part.strip() for part in item.split(';')]
+        if not parts[0]:
+            continue
+        q = 1.0
+        for param in parts[1:]:
+            if param.startswith('q='):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        values[parts[0].lower()] = q
+    return values
+
+
+def _available_formats(tabular):
+    formats = [JSON, COLUMNAR_JSON]
+    if ormsgpack is not None:
+        formats.append(MSGPACK)
+    if pa is not None and tabular:
+        formats.append(ARROW)
+    return formats
+
+
+def choose_format(accept, tabular):
+    """Best supported media type for an Accept header; JSON when nothing more specific is asked for."""
+    accepted = _parse_header(accept)
+    best, best_q = JSON, 0.0
+    for media_type in FORMAT_PREFERENCE:
+        if media_type not in _available_formats(tabular):
+            continue
+        q = accepted.get(media_type)
+        if q is None and media_type == JSON:
+            # Wildcards only ever select plain JSON; the others must be asked for by name
+            q = accepted.get('*/*', accepted.get('application/*'))
+        if q is not None and q > best_q:
+            best, best_q = media_type, q
+    return best
+
+
+def choose_encoding(accept_encoding):
+    accepted = _parse_header(accept_encoding)
+    available = {'gzip': True, 'zstd': zstandard is not None, 'br': brotli is not None}
+    best, best_q = None, 0.0
+    for encoding in ENCODING_PREFERENCE:
+        q = accepted.get(encoding, accepted.get('*'))
+        if available[encoding] and q is not None and q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def _column_type(values):
+    """Names the JSON type shared by a column's non-null values ('mixed' if they differ)."""
+    kinds = set()
+    for value in values:
+        if value is None:
+            continue
+        if isinstance(value, bool):
+            kinds.add('boolean')
+        elif isinstance(value, int):
+            kinds.add('integer')
+        elif isinstance(value, float):
+            kinds.add('number')
+        elif isinstance(value, str):
+            kinds.add('string')
+        else:
+            kinds.add('object')
+    if kinds == {'integer', 'number'}:
+        return 'number'
+    if len(kinds) == 1:
+        return kinds.pop()
+    return 'null' if not kinds else 'mixed'
+
+
+def is_tabular(payload):
+    return isinstance(payload, dict) and isinstance(payload.get('columns'), list) and isinstance(payload.get('rows'), list)
+
+
+def to_columnar(payload):
+    """Replaces `rows` with `data` (one array per column) and adds `types`. Rows may be lists or documents."""
+    columns = payload['columns']
+    rows = payload['rows']
+    if rows and isinstance(rows[0], dict):
+        data = [[row.get(column) for row in rows] for column in columns]
+    else:
+        data = [list(values) for values in zip(*rows)] if rows else [[] for _ in columns]
+    result = {key: value for key, value in payload.items() if key != 'rows'}
+    result['layout'] = 'columnar'
+    result['length'] = len(rows)
+    result['types'] = [_column_type(values) for values in data]
+    result['data'] = data
+    return result
+
+
+def arrow_values(values, kind):
+    """
+    A column's values ready for pa.array. Arrow columns have one type, so
+    'object' and 'mixed' columns become strings (JSON text for non-strings).
+    """
+    if kind not in ('object', 'mixed'):
+        return values
+    return [value if value is None or isinstance(value, str) else json.dumps(value, default=str)
+            for value in values]
+
+
+def _to_arrow(payload):
+    columnar = to_columnar(payload)
+    columns = [pa.array(arrow_values(values, kind)) for values, kind in zip(columnar['data'], columnar['types'])]
+    # Everything besides the rows (result_id, cursors, ...) travels as schema metadata
+    metadata = {'payload': json.dumps({key: value for key, value in payload.items() if key != 'rows'}, default=str)}
+    table = pa.Table.from_arrays(columns, names=[str(column) for column in payload['columns']], metadata=metadata)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def _compress(body, encoding):
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body)
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+def encode_response(payload, accept=None, accept_encoding=None):
+    """
+    Serializes a JSON-able payload for the client's Accept/Accept-Encoding.
+    Returns (body bytes, headers dict) including Content-Type and, when
+    compressed, Content-Encoding.
+    """
+    tabular = is_tabular(payload)
+    media_type = choose_format(accept, tabular)
+
+    if media_type == ARROW:
+        try:
+            body = _to_arrow(payload)
+        except (ValueError, TypeError, OverflowError, NotImplementedError) as e:
+            # e.g. integers beyond int64; the answer is already computed, so send it as columnar JSON
+            print(f"Arrow encoding failed ({e}), sending columnar JSON")
+            media_type = COLUMNAR_JSON
+    if media_type != ARROW:
+        data = to_columnar(payload) if tabular and media_type != JSON else payload
+        if media_type == MSGPACK:
+            body = ormsgpack.packb(data, default=str, option=ormsgpack.OPT_NON_STR_KEYS)
+        else:
+            body = json.dumps(data, separators=(',', ':'), default=str).encode('utf-8')
+
+    headers = {'Content-Type': media_type, 'Vary': 'Accept, Accept-Encoding'}
+    encoding = choose_encoding(accept_encoding) if len(body) >= COMPRESS_MIN_BYTES else None
+    if encoding:
+        body = _compress(body, encoding)
+        headers['Content-Encoding'] = encoding
+    return body, headers
@@ -0,0 +1,207 @@
+# Backend/utils/pool.py
+#
+# Process-wide registry of SQLAlchemy engines (and MongoDB clients).
+# Every /connect and /query used to build a brand-new engine, which meant a
+# fresh TCP + TLS handshake and authentication for every request. Engines are
+# now shared per (connection URI, mode) and reused until they sit idle.
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+
+from utils.agent_cache import agent_cache
+
+# --- Pool configuration (per engine, i.e. per tenant database) ---
+POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+POOL_MAX_OVERFLOW = int(os.getenv('DB_POOL_MAX_OVERFLOW', 5))
+POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', 30))
+POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))
+MAX_ENGINES = int(os.getenv('DB_POOL_MAX_ENGINES', 50))
+IDLE_SECONDS = int(os.getenv('DB_POOL_IDLE_SECONDS', 900))
+
+def database_identity(db_uri):
+    """Returns a short, stable identifier for a database that never exposes credentials."""
+    return hashlib.sha1(db_uri.encode('utf-8')).hexdigest()[:16]
+
+
+def redact_uri(db_uri):
+    """Returns the URI with its password masked, safe for logs and stats."""
+    try:
+        return make_url(db_uri).render_as_string(hide_password=True)
+    except Exception:
+        return database_identity(db_uri)
+
+
+class _Entry:
+    def __init__(self, resource, db_uri, mode):
+        self.resource = resource
+        self.db_uri = db_uri
+        self.mode = mode
+        self.created_at = time.time()
+        self.last_used = self.created_at
+        self.hits = 0
+
+
+class EngineRegistry:
+    """
+    Thread-safe LRU registry of SQLAlchemy engines keyed by (URI, mode).
+    Engines idle for longer than `idle_seconds` are disposed, and the least
+    recently used engine is evicted once `max_engines` is reached.
+    """
+
+    def __init__(self, max_engines=MAX_ENGINES, idle_seconds=IDLE_SECONDS):
+        self.max_engines = max_engines
+        self.idle_seconds = idle_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _create(self, db_uri, mode):
+        engine_args = {
+            'pool_size': POOL_SIZE,
+            'max_overflow': POOL_MAX_OVERFLOW,
+            'pool_timeout': POOL_TIMEOUT,
+            'pool_recycle': POOL_RECYCLE,
+            'pool_pre_ping': True,  # Drop connections the server closed while idle
+        }
+        if db_uri.startswith('sqlite'):
+            # SQLite uses a singleton/null pool that takes no sizing arguments
+            engine_args = {}
+        elif mode == 'read-only' and make_url(db_uri).get_backend_name() == 'postgresql':
+            # Enforce read-only mode at the database level as well
+            engine_args['connect_args'] = {'options': '-c default_transaction_read_only=on'}
+        return create_engine(db_uri, **engine_args)
+
+    def _close(self, resource):
+        resource.dispose()
+
+    def _release(self, entry):
+        """Closes an entry's resource and drops the cached agents built on it."""
+        agent_cache.invalidate(database_identity(entry.db_uri), entry.mode)
+        self._close(entry.resource)
+
+    def _describe(self, resource):
+        pool = resource.pool
+        return {
+            'pool_size': pool.size() if hasattr(pool, 'size') else None,
+            'checked_out': pool.checkedout() if hasattr(pool, 'checkedout') else None,
+            'checked_in': pool.checkedin() if hasattr(pool, 'checkedin') else None,
+            'overflow': pool.overflow() if hasattr(pool, 'overflow') else None,
+        }
+
+    def get(self, db_uri, mode='read-only'):
+        """Returns a warm resource for the URI/mode, creating it on first use."""
+        key = (db_uri, mode)
+        with self._lock:
+            evicted = self._sweep_locked()
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = _Entry(self._create(db_uri, mode), db_uri, mode)
+                self._entries[key] = entry
+                while len(self._entries) > self.max_engines:
+                    _, oldest = self._entries.popitem(last=False)
+                    evicted.append(oldest)
+            else:
+                self._entries.move_to_end(key)
+            entry.last_used = time.time()
+            entry.hits += 1
+            resource = entry.resource
+
+        # Close outside the lock so a slow dispose never blocks other requests
+        for old in evicted:
+            self._release(old)
+        return resource
+
+    def _sweep_locked(self):
+        """Pops entries that have been idle too long. Caller holds the lock."""
+        cutoff = time.time() - self.idle_seconds
+        stale = [key for key, entry in self._entries.items() if entry.last_used < cutoff]
+        return [self._entries.pop(key) for key in stale]
+
+    def dispose(self, db_uri, mode=None):
+        """Closes the resource(s) for a URI. With no mode, every mode is dropped."""
+        with self._lock:
+            keys = [key for key in self._entries if key[0] == db_uri and (mode is None or key[1] == mode)]
+            removed = [self._entries.pop(key) for key in keys]
+        for entry in removed:
+            self._release(entry)
+        return len(removed)
+
+    def evict_idle(self):
+        """Closes resources that exceeded the idle timeout. Returns how many were dropped."""
+        with self._lock:
+            evicted = self._sweep_locked()
+        for entry in evicted:
+            self._release(entry)
+        return len(evicted)
+
+    def stats(self):
+        """Returns per-entry pool statistics (credentials redacted)."""
+        now = time.time()
+        with self._lock:
+            entries = list(self._entries.values())
+        stats = []
+        for entry in entries:
+            item = {
+                'database': redact_uri(entry.db_uri),
+                'database_id': database_identity(entry.db_uri),
+                'mode': entry.mode,
+                'hits': entry.hits,
+                'idle_seconds': round(now - entry.last_used, 1),
+                'age_seconds': round(now - entry.created_at, 1),
+            }
+            item.update(self._describe(entry.resource))
+            stats.append(item)
+        return stats
+
+
+class MongoClientRegistry(EngineRegistry):
+    """Same LRU/idle policy for MongoClient instances (each client is its own pool)."""
+
+    def _create(self, db_uri, mode):
+        from pymongo import MongoClient
+        return MongoClient(
+            db_uri,
+            maxPoolSize=POOL_SIZE + POOL_MAX_OVERFLOW,
+            maxIdleTimeMS=IDLE_SECONDS * 1000,
+            serverSelectionTimeoutMS=5000,
+        )
+
+    def _close(self, resource):
+        resource.close()
+
+    def _describe(self, resource):
+        return {'max_pool_size': POOL_SIZE + POOL_MAX_OVERFLOW}
+
+
+# Process-wide singletons
+engine_registry = EngineRegistry()
+mongo_registry = MongoClientRegistry()
+
+
+def get_engine(db_uri, mode='read-only'):
+    """Returns a shared, pooled SQLAlchemy engine for the given URI and mode."""
+    return engine_registry.get(db_uri, mode)
+
+
+def get_mongo_client(db_uri, mode='read-only'):
+    """Returns a shared MongoClient for the given URI and mode."""
+    return mongo_registry.get(db_uri, mode)
+
+
+def pool_stats():
+    """Returns pool statistics for every registered SQL engine and MongoDB client."""
+    return {
+        'sql': engine_registry.stats(),
+        'mongodb': mongo_registry.stats(),
+        'limits': {
+            'pool_size': POOL_SIZE,
+            'max_overflow': POOL_MAX_OVERFLOW,
+            'max_engines': MAX_ENGINES,
+            'idle_seconds': IDLE_SECONDS,
+        },
+    }
@@ -0,0 +1,324 @@
+# Backend/utils/profiler.py
+#
+# Background column profiles that ground the agent in what the data looks
+# like. Without them the agent spends round trips on exploratory
+# `SELECT DISTINCT department ...` / `LIMIT 3` queries just to learn whether a
+# department is stored as "CS" or "Computer Science". For each table a
+# profile per column is kept: null ratio, distinct count, min/max and the most
+# common values with their share. Sources:
+#   - PostgreSQL: pg_stats / pg_class (the planner's statistics, no table scan)
+#   - other databases, or Postgres tables never analyzed: a PROFILE_SAMPLE_ROWS sample
+# Profiles are stored compactly (one JSON row per table) in a small SQLite
+# file and refreshed incrementally by a background thread: only tables whose
+# definition changed or whose profile is older than PROFILE_REFRESH_SECONDS
+# are profiled again, at most PROFILE_TABLES_PER_PASS at a time.
+#
+# CachedSQLDatabase appends the profiles to table definitions (sql_db_schema)
+# and the most common values of categorical columns to the schema digest.
+# SQL databases only; MongoDB's schema tool already samples documents.
+
+import datetime
+import decimal
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import traceback
+from collections import Counter
+
+from utils.sqlite_store import SQLiteStore, instance_path
+
+COLUMN_PROFILES_ENABLED = os.getenv('COLUMN_PROFILES', 'true').lower() in ('1', 'true', 'yes')
+PROFILES_DB_PATH = os.getenv('PROFILES_DB_PATH', instance_path('profiles.db'))
+PROFILE_REFRESH_SECONDS = float(os.getenv('PROFILE_REFRESH_SECONDS', 6 * 3600))
+# How often a database is checked for stale profiles (on its next query)
+PROFILE_CHECK_SECONDS = float(os.getenv('PROFILE_CHECK_SECONDS', 300))
+PROFILE_SAMPLE_ROWS = int(os.getenv('PROFILE_SAMPLE_ROWS', 2000))
+PROFILE_TABLES_PER_PASS = int(os.getenv('PROFILE_TABLES_PER_PASS', 25))
+PROFILE_TOP_VALUES = int(os.getenv('PROFILE_TOP_VALUES', 5))
+# Columns with more distinct values than this are not treated as categorical
+PROFILE_MAX_CATEGORIES = int(os.getenv('PROFILE_MAX_CATEGORIES', 50))
+PROFILE_MAX_VALUE_CHARS = 40
+# Profile lines per table in the agent's schema output
+PROFILE_MAX_COLUMNS = 40
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS profiles (
+    identity TEXT NOT NULL,
+    table_name TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    profiled_at REAL NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (identity, table_name)
+);
+"""
+
+PG_STATS = """
+SELECT s.attname, s.null_frac, s.n_distinct, s.most_common_vals::text, s.most_common_freqs::text,
+       s.histogram_bounds::text, c.reltuples
+FROM pg_stats s
+JOIN pg_namespace n ON n.nspname = s.schemaname
+JOIN pg_class c ON c.relnamespace = n.oid AND c.relname = s.tablename
+WHERE s.schemaname = current_schema() AND s.tablename = :table
+"""
+
+
+def _display(value):
+    if isinstance(value, (datetime.date, datetime.time, decimal.Decimal)):
+        value = str(value)
+    if isinstance(value, str) and len(value) > PROFILE_MAX_VALUE_CHARS:
+        return value[:PROFILE_MAX_VALUE_CHARS - 1] + '…'
+    return value
+
+
+def _parse_pg_array(text):
+    """Elements of a one-dimensional Postgres array literal, as strings (None for NULL)."""
+    if not text or not text.startswith('{') or text.startswith('{{'):
+        return []
+    items, i = [], 1
+    while i < len(text) and text[i] != '}':
+        if text[i] == '"':
+            i += 1
+            chars = []
+            while text[i] != '"':
+                if text[i] == '\\':
+                    i += 1
+                chars.append(text[i])
+                i += 1
+            i += 1
+            items.append(''.join(chars))
+        else:
+            end = i
+            while text[end] not in ',}':
+                end += 1
+            value = text[i:end]
+            items.append(None if value == 'NULL' else value)
+            i = end
+        if i < len(text) and text[i] == ',':
+            i += 1
+    return items
+
+
+def _postgres_profile(db, table):
+    """Column profiles from the planner statistics, or None if the table was never analyzed."""
+    _, rows = db.fetch_rows(PG_STATS, 10000, {'table': table})
+    if not rows:
+        return None
+    estimated_rows = max(0, int(rows[0][6] or 0))
+    columns = {}
+    for name, null_frac, n_distinct, common_values, common_freqs, histogram, _ in rows:
+        # Negative n_distinct is a fraction of the row count
+        distinct = n_distinct if n_distinct >= 0 else -n_distinct * estimated_rows
+        values = _parse_pg_array(common_values)
+        freqs = [float(freq) for freq in _parse_pg_array(common_freqs)]
+        bounds = _parse_pg_array(histogram)
+        profile = {'nulls': round(null_frac or 0.0, 4), 'distinct': int(round(distinct))}
+        if bounds:
+            profile['min'], profile['max'] = _display(bounds[0]), _display(bounds[-1])
+        if values and freqs:
+            profile['top'] = [[_display(value), round(freq, 4)] for value, freq in
+                              list(zip(values, freqs))[:PROFILE_TOP_VALUES]]
+        columns[name] = profile
+    return {'source': 'pg_stats', 'rows': estimated_rows, 'exact': False, 'columns': columns}
+
+
+def _sample_profile(db, table):
+    """Column profiles computed from the first PROFILE_SAMPLE_ROWS rows."""
+    names, rows = db.fetch_rows(f'SELECT * FROM {db.quote_identifier(table)} LIMIT {PROFILE_SAMPLE_ROWS}',
+                                PROFILE_SAMPLE_ROWS)
+    complete = len(rows) < PROFILE_SAMPLE_ROWS
+    columns = {}
+    for index, name in enumerate(names):
+        values = [row[index] for row in rows]
+        present = [value for value in values if value is not None]
+        profile = {'nulls': round(1 - len(present) / len(values), 4) if values else 0.0}
+        hashable = [value for value in present if isinstance(value, (str, int, float, bool, decimal.Decimal,
+                                                                     datetime.date, datetime.time))]
+        if hashable and len(hashable) == len(present):
+            counts = Counter(hashable)
+            profile['distinct'] = len(counts)
+            try:
+                profile['min'], profile['max'] = _display(min(hashable)), _display(max(hashable))
+            except TypeError:
+                pass  # Mixed types
+            if len(counts) <= PROFILE_MAX_CATEGORIES:
+                profile['top'] = [[_display(value), round(count / len(values), 4)]
+                                  for value, count in counts.most_common(PROFILE_TOP_VALUES)]
+        columns[name] = profile
+    return {'source': 'sample', 'rows': len(rows), 'exact': complete, 'columns': columns}
+
+
+def profile_table(db, table):
+    if db.dialect == 'postgresql':
+        profile = _postgres_profile(db, table)
+        if profile is not None:
+            return profile
+    return _sample_profile(db, table)
+
+
+def _percent(fraction):
+    return f'{fraction * 100:.0f}%' if fraction >= 0.01 else f'{fraction * 100:.1g}%'
+
+
+def describe_profile(profile):
+    """Comment block for a table definition (the same /* */ style SQLDatabase uses for sample rows)."""
+    if profile['source'] == 'pg_stats':
+        header = f"Column profile (planner statistics, ~{profile['rows']:,} rows):"
+    elif profile['exact']:
+        header = f"Column profile (all {profile['rows']:,} rows):"
+    else:
+        header = f"Column profile (sample of {profile['rows']:,} rows):"
+    lines = [header]
+    for name, column in list(profile['columns'].items())[:PROFILE_MAX_COLUMNS]:
+        parts = []
+        if column.get('nulls'):
+            parts.append(f"{_percent(column['nulls'])} null")
+        if column.get('distinct') is not None:
+            parts.append(f"{column['distinct']:,} distinct")
+        if 'min' in column and column['min'] != column.get('max'):
+            parts.append(f"range {column['min']!r} .. {column['max']!r}")
+        if column.get('top') and column.get('distinct', 0) <= PROFILE_MAX_CATEGORIES:
+            parts.append('top ' + ', '.join(f'{value!r} {_percent(share)}' for value, share in column['top']))
+        if parts:
+            lines.append(f"{name}: {'; '.join(parts)}")
+    return '/*\n' + '\n'.join(lines) + '\n*/'
+
+
+def categorical_hints(profile):
+    """`column in (values)` for low-cardinality text columns, for the one-line-per-table digest."""
+    hints = []
+    for name, column in profile['columns'].items():
+        top = column.get('top') or []
+        if top and column.get('distinct', 0) <= PROFILE_MAX_CATEGORIES and all(isinstance(v, str) for v, _ in top):
+            more = ', ...' if column['distinct'] > len(top) else ''
+            hints.append(f"{name} in ({', '.join(repr(value) for value, _ in top)}{more})")
+    return hints
+
+
+class ProfileStore(SQLiteStore):
+    """SQLite-backed column profiles per database, refreshed by one background thread."""
+
+    schema = SCHEMA
+
+    def __init__(self, path=PROFILES_DB_PATH):
+        super().__init__(path)
+        self._profiles = {}
+        self._checked = {}
+        self._pending = queue.Queue()
+        self._queued = set()
+        # Tables whose profiling failed, skipped until the database's next check
+        self._failed = {}
+        self._thread = None
+
+    def _load(self, identity):
+        """{table: (fingerprint, profiled_at, profile)} for a database, loaded from disk once."""
+        with self._lock:
+            profiles = self._profiles.get(identity)
+        if profiles is not None:
+            return profiles
+        with self._connect() as connection:
+            rows = connection.execute(
+                'SELECT table_name, fingerprint, profiled_at, data FROM profiles WHERE identity = ?', (identity,)
+            ).fetchall()
+        profiles = {row['table_name']: (row['fingerprint'], row['profiled_at'], json.loads(row['data'])) for row in rows}
+        with self._lock:
+            return self._profiles.setdefault(identity, profiles)
+
+    def get(self, identity, table):
+        """The stored profile of a table, or None. Never touches the profiled database."""
+        if not COLUMN_PROFILES_ENABLED:
+            return None
+        try:
+            entry = self._load(identity).get(table)
+        except sqlite3.Error as e:
+            print(f"Column profiles unavailable: {e}")
+            return None
+        return entry[2] if entry else None
+
+    def schedule(self, db):
+        """Queues a background refresh of a database's stale profiles (at most every PROFILE_CHECK_SECONDS)."""
+        if not COLUMN_PROFILES_ENABLED:
+            return
+        now = time.time()
+        with self._lock:
+            if now - self._checked.get(db.identity, 0.0) < PROFILE_CHECK_SECONDS or db.identity in self._queued:
+                return
+            self._checked[db.identity] = now
+            self._failed.pop(db.identity, None)
+            self._queued.add(db.identity)
+            if self._thread is None:
+                # Started lazily so importing the module spawns nothing
+                self._thread = threading.Thread(target=self._work, name='column-profiler', daemon=True)
+                self._thread.start()
+        self._pending.put(db)
+
+    def _stale_tables(self, db):
+        profiles = self._load(db.identity)
+        fingerprints = db.table_fingerprints()
+        with self._lock:
+            failed = set(self._failed.get(db.identity, ()))
+        cutoff = time.time() - PROFILE_REFRESH_SECONDS
+        missing = [table for table in fingerprints
+                   if table not in failed and (table not in profiles or profiles[table][0] != fingerprints[table])]
+        old = sorted((table for table in fingerprints
+                      if table not in failed and table not in missing and profiles[table][1] < cutoff),
+                     key=lambda table: profiles[table][1])
+        return missing + old, fingerprints
+
+    def _save(self, identity, table, fingerprint, profile):
+        profiled_at = time.time()
+        with self._connect() as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO profiles (identity, table_name, fingerprint, profiled_at, data) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (identity, table, fingerprint, profiled_at, json.dumps(profile, separators=(',', ':'), default=str)),
+            )
+        with self._lock:
+            self._profiles.setdefault(identity, {})[table] = (fingerprint, profiled_at, profile)
+
+    def refresh(self, db, limit=PROFILE_TABLES_PER_PASS):
+        """Profiles up to `limit` stale tables of a database. Returns how many stale tables remain."""
+        stale, fingerprints = self._stale_tables(db)
+        for table in stale[:limit]:
+            started = time.perf_counter()
+            try:
+                profile = profile_table(db, table)
+            except Exception as e:
+                print(f"Column profile of {table} failed: {e}")
+                with self._lock:
+                    self._failed.setdefault(db.identity, set()).add(table)
+                continue
+            self._save(db.identity, table, fingerprints[table], profile)
+            print(f"Column profile of {table} ({profile['source']}) in {(time.perf_counter() - started) * 1000:.0f} ms")
+        dropped = set(self._load(db.identity)) - set(fingerprints)
+        if dropped:
+            with self._connect() as connection:
+                connection.executemany('DELETE FROM profiles WHERE identity = ? AND table_name = ?',
+                                       [(db.identity, table) for table in dropped])
+            with self._lock:
+                for table in dropped:
+                    self._profiles[db.identity].pop(table, None)
+        return max(0, len(stale) - limit)
+
+    def _work(self):
+        while True:
+            db = self._pending.get()
+            remaining = 0
+            try:
+                remaining = self.refresh(db)
+            except Exception:
+                print(f"Column profiling failed: {traceback.format_exc()}")
+            finally:
+                with self._lock:
+                    self._queued.discard(db.identity)
+                    if remaining:
+                        # Continue with the rest after other queued databases
+                        self._queued.add(db.identity)
+                if remaining:
+                    self._pending.put(db)
+
+
+# Process-wide singleton
+profile_store = ProfileStore()
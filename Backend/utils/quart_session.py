@@ -0,0 +1,82 @@
+# Backend/utils/quart_session.py
+#
+# Server-side sessions for the ASGI app. Flask-Session only supports Flask,
+# and Quart's default session is a signed (not encrypted) cookie, which put
+# the database URI, password included, in every request the browser sent.
+# This interface keeps the session data in the same cachelib store app.py
+# hands to Flask-Session (files under instance/sessions, or Redis), and the
+# cookie carries only a signed, random session key.
+
+import asyncio
+import secrets
+
+from itsdangerous import BadSignature
+from quart.sessions import SecureCookieSession, SecureCookieSessionInterface
+
+
+class ServerSideSession(SecureCookieSession):
+    def __init__(self, data=None, key=None):
+        super().__init__(data or {})
+        self.key = key or secrets.token_urlsafe(32)
+
+
+class ServerSideSessionInterface(SecureCookieSessionInterface):
+    """Stores session dicts in a cachelib cache under `key_prefix` + session key."""
+
+    session_class = ServerSideSession
+    salt = 'server-side-session'
+
+    def __init__(self, cache, key_prefix='dbassistant:asgi:', permanent=True):
+        self.cache = cache
+        self.key_prefix = key_prefix
+        self.permanent = permanent
+
+    async def open_session(self, app, request):
+        signer = self.get_signing_serializer(app)
+        if signer is None:
+            return None
+        session = self.session_class()
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if cookie is not None:
+            try:
+                key = signer.loads(cookie, max_age=int(app.permanent_session_lifetime.total_seconds()))
+            except BadSignature:
+                key = None
+            # Blocking file / Redis read; keep it off the event loop
+            data = await asyncio.to_thread(self.cache.get, self.key_prefix + key) if key else None
+            if data is not None:
+                session = self.session_class(data, key)
+        session.permanent = self.permanent
+        return session
+
+    async def save_session(self, app, session, response):
+        if response is None:
+            return
+        name = self.get_cookie_name(app)
+        cookie_args = {
+            'domain': self.get_cookie_domain(app),
+            'path': self.get_cookie_path(app),
+            'secure': self.get_cookie_secure(app),
+            'samesite': self.get_cookie_samesite(app),
+            'httponly': self.get_cookie_httponly(app),
+        }
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        if not session:
+            if session.modified:
+                # Cleared (e.g. /disconnect): forget the server-side copy too
+                await asyncio.to_thread(self.cache.delete, self.key_prefix + session.key)
+                response.delete_cookie(name, **cookie_args)
+                response.vary.add('Cookie')
+            return
+
+        if not self.should_set_cookie(app, session):
+            return
+        timeout = int(app.permanent_session_lifetime.total_seconds())
+        await asyncio.to_thread(self.cache.set, self.key_prefix + session.key, dict(session), timeout)
+        response.set_cookie(
+            name, self.get_signing_serializer(app).dumps(session.key),
+            expires=self.get_expiration_time(app, session), **cookie_args,
+        )
+        response.vary.add('Cookie')
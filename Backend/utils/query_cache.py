@@ -0,0 +1,185 @@
+# Backend/utils/query_cache.py
+#
+# Cache of the final SQL (or MongoDB aggregation command) the agent produced
+# for a question. Users repeat the same questions constantly, and each repeat
+# used to cost a full agent loop against the rate-limited Groq quota. On a hit
+# the cached statement is re-run directly and the LLM is skipped.
+
+import difflib
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+TTL_SECONDS = float(os.getenv('QUERY_CACHE_TTL_SECONDS', 3600))
+MAX_ENTRIES = int(os.getenv('QUERY_CACHE_MAX_ENTRIES', 500))
+# Word-sequence similarity needed for a near-duplicate hit. Off by default
+# (above 1.0): only questions that normalize identically share an entry
+SIMILARITY_THRESHOLD = float(os.getenv('QUERY_CACHE_SIMILARITY', 1.1))
+
+# Words that don't change what is being asked
+FILLER_WORDS = {
+    'a', 'an', 'the', 'please', 'me', 'can', 'could', 'would', 'you', 'tell',
+    'show', 'give', 'list', 'find', 'get', 'display', 'what', 'whats', 'is', 'are', 'of',
+}
+NUMBER = re.compile(r'\d+(?:\.\d+)?')
+# Phrasings that ask for the same thing
+SYNONYMS = [
+    (re.compile(r'\bhow many\b'), 'count'),
+    (re.compile(r'\bnumber of\b'), 'count'),
+    (re.compile(r'\btotal count\b'), 'count'),
+]
+
+# Words that flip what a question asks for (order, negation, comparison). Near
+# duplicates must have the same ones, in the same order, as well as the same numbers
+MUST_MATCH_WORDS = {
+    'asc', 'ascending', 'desc', 'descending', 'increasing', 'decreasing', 'reverse',
+    'highest', 'lowest', 'most', 'least', 'top', 'bottom', 'first', 'last', 'max', 'maximum',
+    'min', 'minimum', 'largest', 'smallest', 'biggest', 'oldest', 'newest', 'latest', 'earliest',
+    'before', 'after', 'above', 'below', 'over', 'under', 'more', 'less', 'fewer', 'greater',
+    'not', 'no', 'without', 'except', 'excluding', 'never', 'none', 'only', 'between', 'than',
+}
+
+# Tool names whose input is the final statement that answered the question
+QUERY_TOOL_NAMES = {'sql_db_query', 'mongodb_query'}
+
+
+def _stem(word):
+    # Plural-insensitive without pulling in a stemmer ("customers" == "customer")
+    if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+        return word[:-1]
+    return word
+
+
+def normalize_question(question: str) -> str:
+    """Lowercases, strips punctuation and filler words, folds synonyms and plurals."""
+    text = question.lower().replace("'", '')
+    for pattern, replacement in SYNONYMS:
+        text = pattern.sub(replacement, text)
+    words = re.findall(r"[a-z0-9_.]+", text)
+    return ' '.join(_stem(word) for word in words if word not in FILLER_WORDS)
+
+
+def similarity(first: str, second: str) -> float:
+    """Similarity of the word sequences of two normalized questions (order matters)."""
+    a, b = first.split(), second.split()
+    if not a or not b:
+        return 0.0
+    return difflib.SequenceMatcher(None, a, b, autojunk=False).ratio()
+
+
+def signature(normalized: str):
+    """Numbers and MUST_MATCH_WORDS of a normalized question, in order."""
+    return tuple(word for word in normalized.split() if word in MUST_MATCH_WORDS or NUMBER.search(word))
+
+
+def result_digest(result) -> str:
+    """Short hash of a query result, used to tell whether a cached answer is still accurate."""
+    return hashlib.sha1(str(result).encode('utf-8')).hexdigest()
+
+
+def executed_statements(intermediate_steps):
+    """Yields (statement, observation) for every statement the agent ran through its query tool."""
+    for action, observation in intermediate_steps or []:
+        if getattr(action, 'tool', None) not in QUERY_TOOL_NAMES:
+            continue
+        tool_input = action.tool_input
+        if isinstance(tool_input, dict):
+            tool_input = tool_input.get('query') or next(iter(tool_input.values()), None)
+        if tool_input:
+            yield str(tool_input).strip(), observation
+
+
+def extract_final_statement(intermediate_steps):
+    """
+    Returns (statement, observation) for the last statement the agent ran
+    successfully through its query tool, or (None, None) if it never ran one.
+    """
+    successful = [
+        (statement, observation)
+        for statement, observation in executed_statements(intermediate_steps)
+        if not (isinstance(observation, str) and observation.startswith('Error'))
+    ]
+    return successful[-1] if successful else (None, None)
+
+
+class _CachedQuery:
+    def __init__(self, normalized, statement, answer, result_hash, include_columns):
+        self.normalized = normalized
+        self.signature = signature(normalized)
+        self.statement = statement
+        self.answer = answer
+        self.result_hash = result_hash
+        # Re-run the statement in the same output format so result hashes compare
+        self.include_columns = include_columns
+        self.expires_at = time.time() + TTL_SECONDS
+
+
+class QueryCache:
+    """
+    Bounded LRU + TTL cache of generated statements, keyed by
+    (database identity, schema fingerprint, normalized question).
+    """
+
+    def __init__(self, max_entries=MAX_ENTRIES, similarity=SIMILARITY_THRESHOLD):
+        self.max_entries = max_entries
+        self.similarity = similarity
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, identity, fingerprint, question):
+        """Returns the cached entry for a question (exact or near-duplicate), or None."""
+        normalized = normalize_question(question)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get((identity, fingerprint, normalized))
+            if entry is None and self.similarity <= 1.0:
+                entry = self._find_similar_locked(identity, fingerprint, normalized)
+            if entry is not None and entry.expires_at < now:
+                self._entries.pop((identity, fingerprint, entry.normalized), None)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end((identity, fingerprint, entry.normalized))
+            self.hits += 1
+            return entry
+
+    def _find_similar_locked(self, identity, fingerprint, normalized):
+        required = signature(normalized)
+        best, best_ratio = None, self.similarity
+        for (entry_identity, entry_fingerprint, _), entry in self._entries.items():
+            # "top 5" vs "top 10" or "ascending" vs "descending" are never the same question
+            if entry_identity != identity or entry_fingerprint != fingerprint or entry.signature != required:
+                continue
+            ratio = similarity(normalized, entry.normalized)
+            if ratio >= best_ratio:
+                best, best_ratio = entry, ratio
+        return best
+
+    def put(self, identity, fingerprint, question, statement, answer, result, include_columns=False):
+        """Stores the statement that answered a question, along with its answer and result hash."""
+        normalized = normalize_question(question)
+        if not normalized or not statement:
+            return
+        entry = _CachedQuery(normalized, statement, answer, result_digest(result), include_columns)
+        with self._lock:
+            self._entries[(identity, fingerprint, normalized)] = entry
+            self._entries.move_to_end((identity, fingerprint, normalized))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+# Process-wide singleton
+query_cache = QueryCache()
+
+
+def format_result_answer(result) -> str:
+    """Plain-text answer for a cache hit whose data changed since the answer was generated."""
+    if not result:
+        return "The query returned no results."
+    return f"Here are the latest results:\n{result}"
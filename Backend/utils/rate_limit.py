@@ -0,0 +1,210 @@
+# Backend/utils/rate_limit.py
+#
+# Client-side limiter for the shared Groq quota (requests and tokens per
+# minute). Every LLM call takes from two token buckets before it is sent;
+# when the buckets are empty, calls wait in per-session queues that are
+# served round-robin, so one user's 15-step agent run can't starve everyone
+# else. Previously calls were fired blindly and a 429 only surfaced as an
+# error string after the fact.
+#
+# The buckets are per process: with several gunicorn workers, divide the
+# limits between them.
+
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+from utils.metrics import rate_limit_timeouts, rate_limit_wait_seconds
+
+LLM_RATE_RPM = float(os.getenv('LLM_RATE_RPM', 30))
+LLM_RATE_TPM = float(os.getenv('LLM_RATE_TPM', 20000))
+LLM_RATE_MAX_WAIT = float(os.getenv('LLM_RATE_MAX_WAIT_SECONDS', 120))
+# Completion tokens budgeted per call before the real usage is known
+LLM_RATE_COMPLETION_TOKENS = int(os.getenv('LLM_RATE_COMPLETION_TOKENS', 512))
+
+# Session the current LLM calls are made for; set by run_llm_query
+current_session = contextvars.ContextVar('llm_session', default='anonymous')
+
+# How often async waiters re-check their turn
+_ASYNC_POLL_SECONDS = 0.05
+
+
+class RateLimitTimeout(Exception):
+    """Raised when a call waited longer than LLM_RATE_MAX_WAIT_SECONDS for capacity."""
+
+
+class _TokenBucket:
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_for(self, amount):
+        """Seconds until `amount` can be taken (capped at capacity, so huge calls still pass)."""
+        shortfall = min(amount, self.capacity) - self.level
+        return max(0.0, shortfall / self.rate)
+
+
+class _Ticket:
+    def __init__(self, session, tokens):
+        self.session = session
+        self.tokens = tokens
+        self.enqueued_at = time.monotonic()
+
+
+class RateLimiter:
+    """
+    Requests-per-minute and tokens-per-minute buckets with fair queueing.
+    Waiting calls are grouped by session and sessions take turns, one call
+    each, in round-robin order.
+    """
+
+    def __init__(self, rpm=LLM_RATE_RPM, tpm=LLM_RATE_TPM, max_wait=LLM_RATE_MAX_WAIT):
+        self.enabled = rpm > 0 and tpm > 0
+        self.max_wait = max_wait
+        self._requests = _TokenBucket(rpm or 1)
+        self._tokens = _TokenBucket(tpm or 1)
+        self._queues = OrderedDict()  # session -> deque of tickets, in round-robin order
+        self._cond = threading.Condition()
+        self.waited_calls = 0
+        self.total_wait = 0.0
+
+    def _enqueue_locked(self, session, tokens):
+        ticket = _Ticket(session, tokens)
+        self._queues.setdefault(session, deque()).append(ticket)
+        return ticket
+
+    def _remove_locked(self, ticket):
+        tickets = self._queues.get(ticket.session)
+        if tickets and ticket in tickets:
+            tickets.remove(ticket)
+            if not tickets:
+                del self._queues[ticket.session]
+        self._cond.notify_all()
+
+    def _try_grant_locked(self, ticket):
+        """Grants the ticket if it's its turn and capacity allows. Returns 0 if granted, else seconds to wait."""
+        head = next(iter(self._queues))
+        if self._queues[head][0] is not ticket:
+            return None  # Not our turn; wait to be notified
+        now = time.monotonic()
+        self._requests.refill(now)
+        self._tokens.refill(now)
+        wait = max(self._requests.wait_for(1), self._tokens.wait_for(ticket.tokens))
+        if wait > 0:
+            return wait
+        self._requests.level -= 1
+        self._tokens.level -= ticket.tokens
+        tickets = self._queues[head]
+        tickets.popleft()
+        if tickets:
+            self._queues.move_to_end(head)  # Next session's turn
+        else:
+            del self._queues[head]
+        waited = now - ticket.enqueued_at
+        rate_limit_wait_seconds.observe(waited)
+        if waited > 0.01:
+            self.waited_calls += 1
+            self.total_wait += waited
+        self._cond.notify_all()
+        return 0
+
+    def acquire(self, tokens, session=None):
+        """Blocks until the call may be sent. Returns the seconds waited."""
+        if not self.enabled:
+            return 0.0
+        with self._cond:
+            ticket = self._enqueue_locked(session or current_session.get(), tokens)
+            deadline = ticket.enqueued_at + self.max_wait
+            while True:
+                wait = self._try_grant_locked(ticket)
+                if wait == 0:
+                    return time.monotonic() - ticket.enqueued_at
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._remove_locked(ticket)
+                    rate_limit_timeouts.inc()
+                    raise RateLimitTimeout(
+                        f"LLM rate limit: no capacity within {self.max_wait:.0f}s. Please try again shortly."
+                    )
+                self._cond.wait(min(wait, remaining) if wait is not None else remaining)
+
+    async def aacquire(self, tokens, session=None):
+        """Async acquire: waits on the event loop instead of blocking a thread."""
+        if not self.enabled:
+            return 0.0
+        with self._cond:
+            ticket = self._enqueue_locked(session or current_session.get(), tokens)
+        deadline = ticket.enqueued_at + self.max_wait
+        try:
+            while True:
+                with self._cond:
+                    wait = self._try_grant_locked(ticket)
+                    if wait == 0:
+                        return time.monotonic() - ticket.enqueued_at
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        rate_limit_timeouts.inc()
+                        raise RateLimitTimeout(
+                            f"LLM rate limit: no capacity within {self.max_wait:.0f}s. Please try again shortly."
+                        )
+                await asyncio.sleep(min(wait or _ASYNC_POLL_SECONDS, remaining))
+        except BaseException:
+            # Timed out or cancelled (e.g. the client disconnected): a ticket left at the
+            # head of the queue would block every later call until it timed out
+            with self._cond:
+                self._remove_locked(ticket)
+            raise
+
+    def settle(self, estimated, actual):
+        """Corrects the token bucket once a call's real usage is known (may go into debt)."""
+        if not self.enabled or actual is None:
+            return
+        with self._cond:
+            self._tokens.level = min(self._tokens.capacity, self._tokens.level - (actual - estimated))
+            self._cond.notify_all()
+
+    def expected_wait(self, tokens=LLM_RATE_COMPLETION_TOKENS):
+        """Rough seconds a new call of `tokens` would wait behind the current queue."""
+        if not self.enabled:
+            return 0.0
+        with self._cond:
+            now = time.monotonic()
+            self._requests.refill(now)
+            self._tokens.refill(now)
+            queued = [ticket for tickets in self._queues.values() for ticket in tickets]
+            requests_needed = len(queued) + 1 - self._requests.level
+            tokens_needed = sum(ticket.tokens for ticket in queued) + tokens - self._tokens.level
+            return max(0.0, requests_needed / self._requests.rate, tokens_needed / self._tokens.rate)
+
+    def stats(self, session=None):
+        """Queue depth and expected wait, overall and (optionally) for one session."""
+        expected = self.expected_wait()
+        with self._cond:
+            data = {
+                'enabled': self.enabled,
+                'rpm': self._requests.capacity,
+                'tpm': self._tokens.capacity,
+                'available_requests': round(self._requests.level, 2),
+                'available_tokens': round(self._tokens.level),
+                'queue_depth': sum(len(tickets) for tickets in self._queues.values()),
+                'queued_sessions': len(self._queues),
+                'expected_wait_seconds': round(expected, 1),
+                'waited_calls': self.waited_calls,
+                'average_wait_seconds': round(self.total_wait / self.waited_calls, 2) if self.waited_calls else 0.0,
+            }
+            if session is not None:
+                data['session_queue_depth'] = len(self._queues.get(session, ()))
+        return data
+
+
+# Process-wide singleton
+rate_limiter = RateLimiter()
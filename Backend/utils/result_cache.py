@@ -0,0 +1,165 @@
+# Backend/utils/result_cache.py
+#
+# Bounded TTL cache of query results for read-only sessions. Identical SQL is
+# often run many times a minute by different sessions against the same
+# database; the first run's rows are served to the rest until the TTL of the
+# tables involved expires or a read-write session writes to one of them.
+
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+from utils.sql_validator import SQLGLOT_DIALECTS, sqlglot
+
+if sqlglot is not None:
+    from sqlglot import exp
+    from sqlglot.errors import SqlglotError
+
+DEFAULT_TTL = float(os.getenv('RESULT_CACHE_TTL_SECONDS', 60))
+MAX_BYTES = int(os.getenv('RESULT_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+
+
+def _parse_table_ttls(raw):
+    """Parses RESULT_CACHE_TABLE_TTLS, e.g. "orders=5,countries=3600"."""
+    ttls = {}
+    for item in (raw or '').split(','):
+        if '=' in item:
+            table, seconds = item.split('=', 1)
+            ttls[table.strip().lower()] = float(seconds)
+    return ttls
+
+
+# Per-table overrides: fast-changing tables get short TTLs, lookup tables long ones
+TABLE_TTLS = _parse_table_ttls(os.getenv('RESULT_CACHE_TABLE_TTLS'))
+
+
+@lru_cache(maxsize=256)
+def _parse(sql, dialect):
+    """sqlglot trees for a SQL string (read-only: shared between callers), or None."""
+    if sqlglot is None:
+        return None
+    try:
+        trees = tuple(tree for tree in sqlglot.parse(sql, read=SQLGLOT_DIALECTS.get(dialect)) if tree is not None)
+    except SqlglotError:
+        return None
+    return trees or None
+
+
+def normalize_sql(sql: str, dialect: str = None) -> str:
+    """
+    Cache-key form of a statement: keyword case and whitespace normalized,
+    identifiers and literals kept exactly as written (MySQL table names are
+    case-sensitive). Without a parse, only whitespace outside quotes is collapsed.
+    """
+    sql = sql.strip().rstrip(';')
+    trees = _parse(sql, dialect)
+    if trees is not None:
+        return ';\n'.join(tree.sql(dialect=SQLGLOT_DIALECTS.get(dialect)) for tree in trees)
+    parts = re.split(r"""('(?:[^']|'')*'|"(?:[^"]|"")*"|`(?:[^`]|``)*`)""", sql)
+    return ''.join(part if i % 2 else re.sub(r'\s+', ' ', part) for i, part in enumerate(parts)).strip()
+
+
+def referenced_tables(sql: str, dialect: str = None) -> set:
+    """
+    Set of (unqualified, lowercase) table names a statement reads or writes.
+    Empty when the statement doesn't parse: such reads are dropped by any
+    write to the database, and such writes drop every cached read.
+    """
+    trees = _parse(sql.strip().rstrip(';'), dialect)
+    if trees is None:
+        return set()
+    tables = set()
+    for tree in trees:
+        ctes = {cte.alias_or_name.lower() for cte in tree.find_all(exp.CTE)}
+        tables.update(table.name.lower() for table in tree.find_all(exp.Table)
+                      if table.name and table.name.lower() not in ctes)
+    return tables
+
+
+class _CachedResult:
+    def __init__(self, result, tables, ttl):
+        self.result = result
+        self.tables = tables
+        self.expires_at = time.time() + ttl
+        self.size = sys.getsizeof(result) if isinstance(result, str) else sys.getsizeof(str(result))
+
+
+class ResultCache:
+    """LRU cache of query results with per-table TTLs and a total memory budget."""
+
+    def __init__(self, max_bytes=MAX_BYTES, default_ttl=DEFAULT_TTL, table_ttls=None):
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.table_ttls = TABLE_TTLS if table_ttls is None else table_ttls
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def ttl_for(self, tables):
+        """The shortest TTL among the tables a query reads."""
+        ttls = [self.table_ttls.get(table, self.default_ttl) for table in tables]
+        return min(ttls) if ttls else self.default_ttl
+
+    def get(self, identity, key):
+        with self._lock:
+            entry = self._entries.get((identity, key))
+            if entry is not None and entry.expires_at < time.time():
+                self._remove_locked((identity, key))
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end((identity, key))
+            self.hits += 1
+            return entry.result
+
+    def put(self, identity, key, result, tables):
+        ttl = self.ttl_for(tables)
+        if ttl <= 0:
+            return
+        entry = _CachedResult(result, tables, ttl)
+        if entry.size > self.max_bytes:
+            return  # A single huge result would evict everything else
+        with self._lock:
+            self._remove_locked((identity, key))
+            self._entries[(identity, key)] = entry
+            self._bytes += entry.size
+            while self._bytes > self.max_bytes and self._entries:
+                oldest = next(iter(self._entries))
+                self._remove_locked(oldest)
+
+    def _remove_locked(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    def invalidate(self, identity, tables=None):
+        """Drops cached results for a database, or only those reading any of `tables`."""
+        with self._lock:
+            stale = [
+                key for key, entry in self._entries.items()
+                if key[0] == identity and (not tables or not entry.tables or entry.tables & tables)
+            ]
+            for key in stale:
+                self._remove_locked(key)
+        return len(stale)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+# Process-wide singleton
+result_cache = ResultCache()
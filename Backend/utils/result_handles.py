@@ -0,0 +1,455 @@
+# Backend/utils/result_handles.py
+#
+# Server-side handles for large query results. The toolkit used to fetch every
+# row into Python, stringify it and push it into the LLM context, so a 50k-row
+# answer meant a memory spike in the worker and a blown token budget. Reads
+# now run on a streaming (server-side) cursor: only a bounded preview is read
+# for the agent and the rest stays in the database. The client pages through
+# the full result with GET /results/<id>?cursor=..., which continues the open
+# cursor lazily. The agent is told the row count (a COUNT bounded at
+# RESULT_COUNT_LIMIT rows) and nulls/min/max of the preview rows; exact
+# per-column stats over the whole result (one aggregate over the statement)
+# are computed on the first page request, not on every read.
+#
+# Open cursors hold a pooled connection, so only a few are kept open, fewer
+# per database than the pool size (least recently used ones are closed), and
+# idle ones are closed after a short timeout. A handle outlives its cursor:
+# paging a closed handle re-runs the statement and skips to the requested row.
+# A session's handles are released when it disconnects.
+
+import base64
+import contextvars
+import datetime
+import decimal
+import itertools
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from bson.json_util import dumps
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+from utils.rate_limit import current_session
+
+RESULT_HANDLES_ENABLED = os.getenv('RESULT_HANDLES', 'true').lower() in ('1', 'true', 'yes')
+# Rows shown to the agent; larger results get a handle
+RESULT_PREVIEW_ROWS = int(os.getenv('RESULT_PREVIEW_ROWS', 20))
+RESULT_PAGE_SIZE = int(os.getenv('RESULT_PAGE_SIZE', 500))
+RESULT_MAX_PAGE_SIZE = int(os.getenv('RESULT_MAX_PAGE_SIZE', 5000))
+RESULT_HANDLE_TTL = float(os.getenv('RESULT_HANDLE_TTL_SECONDS', 1800))
+RESULT_MAX_OPEN_CURSORS = int(os.getenv('RESULT_MAX_OPEN_CURSORS', 8))
+# Per database, so open cursors never take most of a tenant's connection pool
+RESULT_MAX_OPEN_CURSORS_PER_DATABASE = int(os.getenv('RESULT_MAX_OPEN_CURSORS_PER_DATABASE', 2))
+RESULT_MAX_HANDLES_PER_DATABASE = int(os.getenv('RESULT_MAX_HANDLES_PER_DATABASE', 50))
+RESULT_CURSOR_IDLE = float(os.getenv('RESULT_CURSOR_IDLE_SECONDS', 60))
+# Columns summarised (COUNT/MIN/MAX) for the agent
+RESULT_STATS_MAX_COLUMNS = int(os.getenv('RESULT_STATS_MAX_COLUMNS', 20))
+# Rows counted when a handle opens; larger results are reported as "more than" this
+RESULT_COUNT_LIMIT = int(os.getenv('RESULT_COUNT_LIMIT', 100000))
+
+# Handles opened while answering the current request; set by run_llm_query
+current_results = contextvars.ContextVar('current_results', default=None)
+
+
+def jsonable(value):
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return base64.b64encode(bytes(value)).decode('ascii')
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    return value
+
+
+def preview_stats(columns, rows):
+    """Nulls/min/max per column over the preview rows (tuples, or documents keyed by column)."""
+    stats = {}
+    for index, column in enumerate(columns[:RESULT_STATS_MAX_COLUMNS]):
+        values = [row.get(column) if isinstance(row, dict) else row[index] for row in rows]
+        present = [value for value in values if value is not None]
+        try:
+            low, high = (min(present), max(present)) if present else (None, None)
+        except TypeError:  # Mixed or unordered types (e.g. MongoDB documents)
+            low, high = None, None
+        stats[column] = {'nulls': len(values) - len(present), 'min': low, 'max': high}
+    return stats
+
+
+def encode_cursor(offset):
+    return str(offset)
+
+
+def decode_cursor(cursor):
+    """Parses a page cursor (a row offset); raises ValueError for anything else."""
+    offset = int(cursor or 0)
+    if offset < 0:
+        raise ValueError('cursor must not be negative')
+    return offset
+
+
+class _SQLSource:
+    """Re-runnable SQL statement on a pooled engine."""
+
+    kind = 'sql'
+
+    def __init__(self, engine, statement):
+        self.engine = engine
+        self.statement = statement
+        self._connection = None
+
+    def open(self, page_size):
+        connection = self.engine.connect()
+        try:
+            result = connection.execution_options(stream_results=True, yield_per=page_size).execute(
+                text(self.statement)
+            )
+        except Exception:
+            connection.close()
+            raise
+        self._connection = connection
+        return result
+
+    def columns(self, result):
+        return list(result.keys())
+
+    def fetch(self, result, count):
+        return [tuple(jsonable(value) for value in row) for row in result.fetchmany(count)]
+
+    def close(self, result):
+        try:
+            result.close()
+        finally:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def bounded_count(self, limit):
+        """Rows in the result, counting at most `limit` + 1 of them; None if the count fails."""
+        inner = self.statement.strip().rstrip(';')
+        try:
+            with self.engine.connect() as connection:
+                return connection.execute(text(
+                    f'SELECT COUNT(*) FROM (SELECT 1 AS counted FROM ({inner}) AS counted_result '
+                    f'LIMIT {limit + 1}) AS bounded_result'
+                )).scalar()
+        except SQLAlchemyError:
+            return None
+
+    def count_and_stats(self, columns):
+        """Total row count plus COUNT/MIN/MAX per column, in one aggregate over the statement."""
+        inner = self.statement.strip().rstrip(';')
+        quote = self.engine.dialect.identifier_preparer.quote
+        summarised = columns[:RESULT_STATS_MAX_COLUMNS] if len(set(columns)) == len(columns) else []
+        parts = ['COUNT(*)']
+        for column in summarised:
+            name = f'counted_result.{quote(column)}'
+            parts += [f'COUNT({name})', f'MIN({name})', f'MAX({name})']
+        try:
+            with self.engine.connect() as connection:
+                row = connection.execute(text(f"SELECT {', '.join(parts)} FROM ({inner}) AS counted_result")).one()
+        except SQLAlchemyError:
+            if not summarised:
+                return None, {}
+            # MIN/MAX isn't defined for every type (json, boolean in Postgres, ...)
+            try:
+                with self.engine.connect() as connection:
+                    row = connection.execute(text(f'SELECT COUNT(*) FROM ({inner}) AS counted_result')).one()
+            except SQLAlchemyError:
+                return None, {}
+            return row[0], {}
+        total, stats = row[0], {}
+        for i, column in enumerate(summarised):
+            non_null, low, high = row[1 + 3 * i:4 + 3 * i]
+            stats[column] = {'nulls': total - non_null, 'min': jsonable(low), 'max': jsonable(high)}
+        return total, stats
+
+
+class _MongoSource:
+    """Re-runnable aggregation pipeline on one collection."""
+
+    kind = 'mongodb'
+
+    def __init__(self, database, collection, pipeline):
+        self.database = database
+        self.collection = collection
+        self.pipeline = pipeline
+        self._columns = []
+
+    def open(self, page_size):
+        return self.database[self.collection].aggregate(self.pipeline, batchSize=page_size)
+
+    def columns(self, result):
+        return self._columns
+
+    def fetch(self, result, count):
+        # Documents go through bson's JSON encoding so ObjectIds/dates are serializable
+        documents = json.loads(dumps(list(itertools.islice(result, count))))
+        for document in documents:
+            for key in document:
+                if key not in self._columns:
+                    self._columns.append(key)
+        return documents
+
+    def close(self, result):
+        result.close()
+
+    def bounded_count(self, limit):
+        try:
+            counted = list(self.database[self.collection].aggregate(
+                self.pipeline + [{'$limit': limit + 1}, {'$count': 'n'}]
+            ))
+        except Exception:
+            return None
+        return counted[0]['n'] if counted else 0
+
+    def count_and_stats(self, columns):
+        try:
+            counted = list(self.database[self.collection].aggregate(self.pipeline + [{'$count': 'n'}]))
+        except Exception:
+            return None, {}
+        return (counted[0]['n'] if counted else 0), {}
+
+
+class ResultHandle:
+    def __init__(self, source, identity, columns, owner=None):
+        self.id = uuid.uuid4().hex
+        self.source = source
+        # Paging is allowed for sessions connected to the same database
+        self.identity = identity
+        # Session that ran the statement; its handles go when it disconnects
+        self.owner = owner
+        self.columns = columns
+        self.row_count = None
+        self.count_limit = None  # Set when the bounded count stopped at the limit
+        self.stats = {}
+        self.preview_stats = {}
+        self.counted = False
+        self.created_at = time.time()
+        self.used_at = self.created_at
+        self.lock = threading.Lock()
+        self._result = None
+        self._position = 0  # Rows already taken from the open cursor
+        self._preview = []
+        self.reopens = 0
+
+    @property
+    def is_open(self):
+        return self._result is not None
+
+    def close_cursor(self):
+        if self._result is not None:
+            try:
+                self.source.close(self._result)
+            except Exception as e:
+                print(f"Error closing result cursor {self.id}: {e}")
+            self._result = None
+
+    def _reopen(self, offset, page_size):
+        """Re-runs the statement and skips forward to `offset`, page by page."""
+        self.close_cursor()
+        self._result = self.source.open(page_size)
+        self._position = 0
+        self.reopens += 1
+        while self._position < offset:
+            skipped = self.source.fetch(self._result, min(page_size, offset - self._position))
+            if not skipped:
+                break
+            self._position += len(skipped)
+
+    def count(self):
+        """Total row count and column stats, computed once. Caller holds `lock`."""
+        if not self.counted:
+            self.row_count, self.stats = self.source.count_and_stats(self.columns)
+            self.counted = True
+
+    def read(self, offset, limit):
+        """Rows [offset, offset + limit). Caller holds `lock`."""
+        # The first rows were read ahead for the preview; serve those without the cursor
+        rows = self._preview[offset:offset + limit]
+        offset, limit = offset + len(rows), limit - len(rows)
+        if limit > 0:
+            if self._result is None or self._position != offset:
+                self._reopen(offset, limit)
+            fetched = self.source.fetch(self._result, limit)
+            self._position += len(fetched)
+            rows = rows + fetched
+        self.used_at = time.time()
+        return rows
+
+
+class ResultStore:
+    """Process-wide registry of result handles with a cap on open cursors."""
+
+    def __init__(self, ttl=RESULT_HANDLE_TTL, max_open=RESULT_MAX_OPEN_CURSORS, idle=RESULT_CURSOR_IDLE,
+                 max_open_per_database=RESULT_MAX_OPEN_CURSORS_PER_DATABASE,
+                 max_handles_per_database=RESULT_MAX_HANDLES_PER_DATABASE):
+        self.ttl = ttl
+        self.max_open = max_open
+        self.idle = idle
+        self.max_open_per_database = max_open_per_database
+        self.max_handles_per_database = max_handles_per_database
+        self._handles = OrderedDict()
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reopened = 0
+
+    def _sweep(self):
+        """Drops expired or excess handles and closes idle or excess cursors."""
+        now = time.time()
+        with self._lock:
+            expired = [handle for handle in self._handles.values() if now - handle.used_at > self.ttl]
+            by_database = {}
+            for handle in self._handles.values():
+                if handle not in expired:
+                    by_database.setdefault(handle.identity, []).append(handle)
+            for handles in by_database.values():
+                # Least recently used first
+                handles.sort(key=lambda handle: handle.used_at)
+                expired += handles[:max(0, len(handles) - self.max_handles_per_database)]
+            for handle in expired:
+                self._handles.pop(handle.id, None)
+            open_handles = [handle for handle in self._handles.values() if handle.is_open]
+        idle = [handle for handle in open_handles if now - handle.used_at > self.idle]
+        # Least recently used first, so the newest cursors stay open
+        open_handles.sort(key=lambda handle: handle.used_at)
+        excess = open_handles[:max(0, len(open_handles) - self.max_open)]
+        open_by_database = {}
+        for handle in open_handles:
+            open_by_database.setdefault(handle.identity, []).append(handle)
+        for handles in open_by_database.values():
+            excess += handles[:max(0, len(handles) - self.max_open_per_database)]
+        for handle in set(expired) | set(idle) | set(excess):
+            if handle.lock.acquire(blocking=False):  # Skip cursors that are mid-read
+                try:
+                    handle.close_cursor()
+                finally:
+                    handle.lock.release()
+
+    def _open(self, source, identity, preview_rows):
+        """
+        Runs the source on a streaming cursor and reads one row past the preview.
+        Returns (columns, rows, handle); `handle` is None when the preview holds the whole result.
+        """
+        self._sweep()
+        result = source.open(max(preview_rows + 1, RESULT_PAGE_SIZE))
+        try:
+            rows = source.fetch(result, preview_rows + 1)
+            columns = source.columns(result)
+        except Exception:
+            source.close(result)
+            raise
+        opened = current_results.get()
+        if len(rows) <= preview_rows:
+            source.close(result)
+            if opened is not None:
+                opened.append(None)  # The latest read was small; nothing to page
+            return columns, rows, None
+
+        handle = ResultHandle(source, identity, columns, owner=current_session.get())
+        handle._result = result
+        handle._position = len(rows)
+        handle._preview = rows
+        handle.preview_stats = preview_stats(columns, rows[:preview_rows])
+        counted = source.bounded_count(RESULT_COUNT_LIMIT)
+        if counted is not None and counted > RESULT_COUNT_LIMIT:
+            handle.count_limit = RESULT_COUNT_LIMIT
+        elif counted is not None:
+            handle.row_count = counted
+        with self._lock:
+            self._handles[handle.id] = handle
+            self.created += 1
+        if opened is not None:
+            opened.append(handle.id)
+        # Enforce the cursor caps now that this one is open too
+        self._sweep()
+        return columns, rows[:preview_rows], handle
+
+    def open_sql(self, engine, identity, statement, preview_rows=RESULT_PREVIEW_ROWS):
+        return self._open(_SQLSource(engine, statement), identity, preview_rows)
+
+    def open_mongo(self, database, collection, pipeline, identity, preview_rows=RESULT_PREVIEW_ROWS):
+        return self._open(_MongoSource(database, collection, pipeline), identity, preview_rows)
+
+    def get(self, result_id, identity):
+        """Returns the handle if it exists and belongs to the given database, else None."""
+        self._sweep()
+        with self._lock:
+            handle = self._handles.get(result_id)
+            if handle is None or handle.identity != identity:
+                return None
+            self._handles.move_to_end(result_id)
+            return handle
+
+    def page(self, handle, cursor=None, limit=None):
+        """One page of rows as a JSON-ready dict, with the cursor for the next page."""
+        offset = decode_cursor(cursor)
+        limit = max(1, min(int(limit or RESULT_PAGE_SIZE), RESULT_MAX_PAGE_SIZE))
+        with handle.lock:
+            handle.count()
+            reopens = handle.reopens
+            rows = handle.read(offset, limit)
+            self.reopened += handle.reopens - reopens
+        more = len(rows) == limit and (handle.row_count is None or offset + limit < handle.row_count)
+        return {
+            'result_id': handle.id,
+            # For MongoDB this is the union of the document keys seen so far
+            'columns': handle.columns,
+            'rows': [list(row) for row in rows] if handle.source.kind == 'sql' else rows,
+            'row_count': handle.row_count,
+            'cursor': encode_cursor(offset),
+            'next_cursor': encode_cursor(offset + len(rows)) if more else None,
+        }
+
+    def release(self, identity, owner=None):
+        """Closes and forgets the handles for a database, optionally only one session's (on disconnect)."""
+        with self._lock:
+            handles = [handle for handle in self._handles.values()
+                       if handle.identity == identity and (owner is None or handle.owner == owner)]
+            for handle in handles:
+                del self._handles[handle.id]
+        for handle in handles:
+            with handle.lock:
+                handle.close_cursor()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'handles': len(self._handles),
+                'open_cursors': sum(1 for handle in self._handles.values() if handle.is_open),
+                'created': self.created,
+                'reopened': self.reopened,
+            }
+
+
+# Process-wide singleton
+result_store = ResultStore()
+
+
+def describe_handle(handle, shown):
+    """Summary appended to the agent's preview: total rows and per-column nulls/min/max."""
+    if handle.row_count is not None:
+        total = f'{handle.row_count:,}'
+    else:
+        total = f'more than {handle.count_limit or shown:,}'
+    lines = [f'-- Showing the first {shown} of {total} rows. The user can page through the full result, '
+             'so do not re-query just to see more rows; use aggregates to summarise them.']
+    stats, scope = (handle.stats, 'all rows') if handle.stats else (handle.preview_stats, f'first {shown} rows')
+    if stats:
+        described = ', '.join(
+            f"{column} (min {stat['min']!r}, max {stat['max']!r}, {stat['nulls']} nulls)"
+            for column, stat in stats.items()
+        )
+        lines.append(f'-- Columns ({scope}): {described}')
+    return '\n'.join(lines)
+
+
+def latest_result_id():
+    """Handle id of the last read run while answering the current request (None if it was small)."""
+    opened = current_results.get()
+    return opened[-1] if opened else None
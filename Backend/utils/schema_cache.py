@@ -0,0 +1,446 @@
+# Backend/utils/schema_cache.py
+#
+# Schema reflection cache shared by every request that talks to the same
+# database. Reflecting a large schema (hundreds of tables) takes seconds, and
+# the agent asks for the same table list / table definitions on every query.
+# Table definitions are cached per table and only the tables whose catalog
+# fingerprint changed are dropped and re-reflected.
+#
+# current_table_scope narrows the tables a request's agent is shown (see
+# utils/table_ranker.py); tables outside it can still be looked up by name.
+
+import hashlib
+import os
+import re
+import threading
+import time
+from contextvars import ContextVar
+
+from langchain_community.utilities import SQLDatabase
+from langchain_community.utilities.sql_database import truncate_word
+from sqlalchemy import inspect, text
+
+from utils.cost_guard import guard_sql
+from utils.metrics import db_query_seconds, db_rows
+from utils.pool import database_identity, get_engine
+from utils.profiler import categorical_hints, describe_profile, profile_store
+from utils.result_cache import normalize_sql, referenced_tables, result_cache
+from utils.result_handles import RESULT_HANDLES_ENABLED, describe_handle, result_store
+from utils.single_shot import READ_STATEMENT
+from utils.sql_validator import validate_sql, validation_available
+from utils.undo import UNDO_CAPTURE_ENABLED, execute_write
+
+# How often (seconds) the cheap catalog fingerprint is re-checked per database
+CHECK_INTERVAL = float(os.getenv('SCHEMA_CACHE_CHECK_SECONDS', 30))
+
+# Tables the current request is restricted to (None: all of them)
+current_table_scope = ContextVar('current_table_scope', default=None)
+
+DDL_PATTERN = re.compile(r'^\s*(create|alter|drop|rename|truncate|comment)\b', re.IGNORECASE)
+
+# One round trip that returns a per-table hash of the column definitions.
+# Any ADD/DROP/ALTER COLUMN or CREATE/DROP TABLE changes the result.
+FINGERPRINT_QUERIES = {
+    'postgresql': """
+        SELECT c.table_name,
+               md5(string_agg(c.column_name || ':' || c.data_type || ':' || c.is_nullable || ':' ||
+                              coalesce(c.column_default, ''), ',' ORDER BY c.ordinal_position))
+        FROM information_schema.columns c
+        JOIN information_schema.tables t
+          ON t.table_schema = c.table_schema AND t.table_name = c.table_name
+        WHERE c.table_schema = current_schema() AND t.table_type = 'BASE TABLE'
+        GROUP BY c.table_name
+    """,
+    # GROUP_CONCAT truncates at group_concat_max_len, so combine row CRCs instead
+    'mysql': """
+        SELECT c.table_name,
+               CONCAT(COUNT(*), '-', BIT_XOR(CRC32(CONCAT_WS(':', c.ordinal_position, c.column_name,
+                                                             c.column_type, c.is_nullable,
+                                                             IFNULL(c.column_default, '')))))
+        FROM information_schema.columns c
+        JOIN information_schema.tables t
+          ON t.table_schema = c.table_schema AND t.table_name = c.table_name
+        WHERE c.table_schema = DATABASE() AND t.table_type = 'BASE TABLE'
+        GROUP BY c.table_name
+    """,
+}
+
+# Every name an unqualified query can read: tables and views, and on Postgres
+# every schema on the search_path (the fingerprint only covers base tables of
+# the current schema). Only used to validate statements (utils/sql_validator.py).
+RELATION_QUERIES = {
+    'postgresql': """
+        SELECT DISTINCT table_name FROM information_schema.tables
+        WHERE table_schema = ANY(current_schemas(false))
+    """,
+    'mysql': """
+        SELECT table_name FROM information_schema.tables WHERE table_schema = DATABASE()
+    """,
+}
+
+
+def _relation_names(engine):
+    """Returns the names of every table and view a query can reference without a schema."""
+    query = RELATION_QUERIES.get(engine.dialect.name)
+    if query is not None:
+        with engine.connect() as connection:
+            return {row[0] for row in connection.execute(text(query))}
+    inspector = inspect(engine)
+    return set(inspector.get_table_names()) | set(inspector.get_view_names())
+
+
+def _fingerprint_tables(engine):
+    """Returns {table_name: fingerprint} for every base table in the database."""
+    query = FINGERPRINT_QUERIES.get(engine.dialect.name)
+    if query is not None:
+        with engine.connect() as connection:
+            return {row[0]: str(row[1]) for row in connection.execute(text(query))}
+
+    # Fallback for other dialects (e.g. SQLite in development): use the inspector
+    inspector = inspect(engine)
+    fingerprints = {}
+    for table in inspector.get_table_names():
+        columns = inspector.get_columns(table)
+        raw = ','.join(f"{col['name']}:{col['type']}:{col.get('nullable')}" for col in columns)
+        fingerprints[table] = hashlib.md5(raw.encode('utf-8')).hexdigest()
+    return fingerprints
+
+
+class _SchemaEntry:
+    def __init__(self):
+        self.fingerprints = {}
+        self.relations = set()
+        self.table_info = {}
+        self.digests = {}
+        self.columns = {}
+        self.details = {}
+        self.checked_at = 0.0
+        self.lock = threading.Lock()
+        # Cached agents share their SQLDatabase (and its MetaData) between concurrent
+        # requests; reflecting drops and re-adds Table objects, so it is serialised
+        self.reflect_lock = threading.RLock()
+
+    @property
+    def fingerprint(self):
+        """A single hash that changes whenever any table definition changes."""
+        raw = ';'.join(f'{name}={fp}' for name, fp in sorted(self.fingerprints.items()))
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:16]
+
+
+class SchemaCache:
+    """Process-wide cache of table names and table definitions keyed by database identity."""
+
+    def __init__(self, check_interval=CHECK_INTERVAL):
+        self.check_interval = check_interval
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _entry(self, identity):
+        with self._lock:
+            entry = self._entries.get(identity)
+            if entry is None:
+                entry = self._entries[identity] = _SchemaEntry()
+            return entry
+
+    def get(self, engine, identity, force=False):
+        """
+        Returns the cache entry for a database, re-checking the catalog fingerprint
+        if the check interval elapsed. Changed or dropped tables are evicted.
+        """
+        entry = self._entry(identity)
+        with entry.lock:
+            if force or time.time() - entry.checked_at >= self.check_interval:
+                fingerprints = _fingerprint_tables(engine)
+                for table, old_fp in entry.fingerprints.items():
+                    if fingerprints.get(table) != old_fp:
+                        entry.table_info.pop(table, None)
+                        entry.digests.pop(table, None)
+                        entry.columns.pop(table, None)
+                        entry.details.pop(table, None)
+                entry.fingerprints = fingerprints
+                entry.relations = _relation_names(engine) | set(fingerprints)
+                entry.checked_at = time.time()
+        return entry
+
+    def fingerprint(self, engine, identity):
+        """Returns the combined schema fingerprint for a database."""
+        return self.get(engine, identity).fingerprint
+
+    def mark_stale(self, identity):
+        """Forces the next access to re-check the catalog (e.g. after DDL)."""
+        self._entry(identity).checked_at = 0.0
+
+
+# Process-wide singleton
+schema_cache = SchemaCache()
+
+
+class CachedSQLDatabase(SQLDatabase):
+    """
+    SQLDatabase that serves `get_usable_table_names` / `get_table_info` (the calls
+    behind the `sql_db_list_tables` and `sql_db_schema` tools) from the shared
+    schema cache, reflecting only tables that are missing or changed.
+    In read-only mode, `run` (behind `sql_db_query`) also serves repeated reads
+    from the shared result cache; writes invalidate the tables they touch and,
+    in read-write mode, run with their before-image captured (utils/undo.py).
+    """
+
+    def __init__(self, engine, db_uri, mode='read-only', cache=None, **kwargs):
+        # Set before super().__init__, which already calls get_usable_table_names()
+        self._cache = cache or schema_cache
+        self._identity = database_identity(db_uri)
+        self._mode = mode
+        kwargs.setdefault('lazy_table_reflection', True)
+        super().__init__(engine, **kwargs)
+
+    @property
+    def identity(self):
+        return self._identity
+
+    @property
+    def schema_fingerprint(self):
+        return self._cache.fingerprint(self._engine, self._identity)
+
+    def _schema_entry(self):
+        return self._cache.get(self._engine, self._identity)
+
+    def _all_table_names(self):
+        tables = set(self._schema_entry().fingerprints)
+        if self._include_tables:
+            return sorted(self._include_tables & tables)
+        return sorted(tables - self._ignore_tables)
+
+    def get_usable_table_names(self):
+        """Get names of tables available, from the cached catalog fingerprint, within the request's table scope."""
+        scope = current_table_scope.get()
+        tables = self._all_table_names()
+        return [name for name in tables if name in scope] if scope else tables
+
+    def _reflect(self, entry, table_names):
+        """Reflects the given tables (dropping stale Table objects first) and caches their digests."""
+        to_reflect = set(table_names)
+        with entry.reflect_lock:
+            for table in list(self._metadata.sorted_tables):
+                if table.name in to_reflect:
+                    self._metadata.remove(table)
+            self._metadata.reflect(
+                views=self._view_support,
+                bind=self._engine,
+                only=list(to_reflect),
+                schema=self._schema,
+            )
+            for table in self._metadata.sorted_tables:
+                if table.name in to_reflect:
+                    columns = ', '.join(f'{col.name} {col.type}' for col in table.columns)
+                    entry.digests[table.name] = f'{table.name}({columns})'
+                    entry.columns[table.name] = [col.name for col in table.columns]
+                    entry.details[table.name] = [
+                        (col.name, str(col.type), col.nullable, col.primary_key) for col in table.columns
+                    ]
+
+    def _validate_table_names(self, table_names):
+        if table_names is None:
+            return self.get_usable_table_names()
+        # Named tables outside the request's scope are still allowed
+        missing_tables = set(table_names).difference(self._all_table_names())
+        if missing_tables:
+            raise ValueError(f"table_names {missing_tables} not found in database")
+        return table_names
+
+    def get_table_info(self, table_names=None, get_col_comments=False):
+        """Get information about specified tables, reflecting only uncached ones."""
+        all_table_names = self._validate_table_names(table_names)
+        # SQLDatabase.get_table_info checks names against get_usable_table_names(); lift the scope for it
+        scope_token = current_table_scope.set(None)
+        entry = self._schema_entry()
+        try:
+            # SQLDatabase.get_table_info reads (and lazily reflects into) the shared MetaData
+            with entry.reflect_lock:
+                if get_col_comments:
+                    # Comment-enriched output is not cached
+                    return super().get_table_info(all_table_names, get_col_comments=True)
+
+                to_build = [name for name in all_table_names if name not in entry.table_info]
+                if to_build:
+                    self._reflect(entry, to_build)
+                    for name in to_build:
+                        entry.table_info[name] = super().get_table_info([name])
+                infos = {name: entry.table_info.get(name) for name in all_table_names}
+        finally:
+            current_table_scope.reset(scope_token)
+
+        tables = [self._with_profile(name, info) for name, info in infos.items() if info]
+        tables.sort()
+        return "\n\n".join(tables)
+
+    def _with_profile(self, table_name, info):
+        """Appends the table's column profile (utils/profiler.py), if one has been gathered."""
+        profile = profile_store.get(self._identity, table_name)
+        return f'{info}\n\n{describe_profile(profile)}' if profile else info
+
+    def get_schema_digest(self, table_names=None):
+        """
+        Returns a compact one-line-per-table schema (`table(col TYPE, ...)`),
+        without sample rows, suitable for putting straight into a prompt.
+        """
+        all_table_names = self._validate_table_names(table_names)
+        entry = self._schema_entry()
+        missing = [name for name in all_table_names if name not in entry.digests]
+        if missing:
+            self._reflect(entry, missing)
+        lines = []
+        for name in all_table_names:
+            if name not in entry.digests:
+                continue
+            lines.append(entry.digests[name])
+            # Stored values of categorical columns (utils/profiler.py), so filters match them exactly
+            profile = profile_store.get(self._identity, name)
+            hints = categorical_hints(profile) if profile else []
+            if hints:
+                lines.append(f"  -- values: {'; '.join(hints)}")
+        return "\n".join(lines)
+
+    def get_table_columns(self, table_names):
+        """Returns {table: [column names]} for the given tables, reflecting only uncached ones."""
+        all_table_names = self._validate_table_names(table_names)
+        entry = self._schema_entry()
+        missing = [name for name in all_table_names if name not in entry.columns]
+        if missing:
+            self._reflect(entry, missing)
+        return {name: entry.columns[name] for name in all_table_names if name in entry.columns}
+
+    def get_column_details(self, table_name):
+        """Returns [(column, type, nullable, primary key)] for one table, reflecting it only if uncached."""
+        self._validate_table_names([table_name])
+        entry = self._schema_entry()
+        if table_name not in entry.details:
+            self._reflect(entry, [table_name])
+        return entry.details.get(table_name, [])
+
+    def inspect_catalog(self):
+        """
+        Returns {table: (comment, [(column, comment)], {referenced tables})} for every
+        usable table, in a few batched catalog queries (get_multi_* on Postgres/MySQL).
+        """
+        tables = self._all_table_names()
+        inspector = inspect(self._engine)
+        columns = inspector.get_multi_columns(schema=self._schema, filter_names=tables)
+        foreign_keys = inspector.get_multi_foreign_keys(schema=self._schema, filter_names=tables)
+        try:
+            comments = inspector.get_multi_table_comment(schema=self._schema, filter_names=tables)
+        except NotImplementedError:
+            comments = {}
+        catalog = {}
+        for (_, table), table_columns in columns.items():
+            key = (self._schema, table)
+            comment = (comments.get(key) or {}).get('text') or ''
+            referenced = {fk['referred_table'] for fk in foreign_keys.get(key, []) if fk.get('referred_table')}
+            catalog[table] = (comment, [(col['name'], col.get('comment') or '') for col in table_columns], referenced)
+        return catalog
+
+    def quote_identifier(self, name):
+        return self._engine.dialect.identifier_preparer.quote(name)
+
+    def table_fingerprints(self):
+        """{table: fingerprint of its column definitions}, from the cached catalog check."""
+        return dict(self._schema_entry().fingerprints)
+
+    def fetch_rows(self, command, limit, parameters=None):
+        """Runs a read and returns (columns, up to `limit` rows), for callers that format rows themselves."""
+        with self._engine.connect() as connection:
+            result = connection.execute(text(command), parameters or {})
+            return list(result.keys()), result.fetchmany(limit)
+
+    def prepare_statement(self, command):
+        """
+        Validates and auto-repairs a statement locally (utils/sql_validator.py).
+        Returns (statement_to_run, repairs); raises SQLValidationError if unfixable.
+        """
+        if not validation_available(self.dialect):
+            return command, []
+        tables = set(self._all_table_names())
+        # Views and tables from other schemas on the search_path are known by name only
+        relations = tables | (self._schema_entry().relations - self._ignore_tables)
+        return validate_sql(command, self.dialect, relations,
+                            lambda names: self.get_table_columns([name for name in names if name in tables]))
+
+    def run(self, command, fetch='all', include_columns=False, *, parameters=None, execution_options=None):
+        if not isinstance(command, str) or parameters or fetch == 'cursor':
+            return super().run(command, fetch, include_columns,
+                               parameters=parameters, execution_options=execution_options)
+
+        command, repairs = self.prepare_statement(command)
+        result = self._run_statement(command, fetch, include_columns, execution_options)
+        if repairs:
+            print(f"Auto-repaired SQL ({'; '.join(repairs)}): {command}")
+            # The agent sees what actually ran, so an answer about a guessed name can't pass unnoticed
+            result = f"{result}\n-- auto-repaired ({'; '.join(repairs)}); ran: {command}"
+        return result
+
+    def _run_statement(self, command, fetch, include_columns, execution_options):
+        """Runs a validated statement through the result cache, cost guard and undo capture."""
+        statement = normalize_sql(command, self.dialect)
+        is_read = bool(READ_STATEMENT.match(statement))
+        if is_read and self._mode == 'read-only':
+            key = (statement, fetch, include_columns)
+            cached = result_cache.get(self._identity, key)
+            if cached is not None:
+                return cached
+            result, handle = self._run_guarded(command, fetch, include_columns, execution_options, is_read)
+            if handle is None:
+                # Large results are served through their handle, not kept in memory
+                result_cache.put(self._identity, key, result, referenced_tables(statement, self.dialect))
+            return result
+
+        result, _ = self._run_guarded(command, fetch, include_columns, execution_options, is_read)
+        if not is_read:
+            # A write through a read-write session makes cached reads of those tables stale
+            result_cache.invalidate(self._identity, referenced_tables(statement, self.dialect) or None)
+            if DDL_PATTERN.match(statement):
+                self._cache.mark_stale(self._identity)
+        return result
+
+    def _format_rows(self, columns, rows, include_columns):
+        """Same output as SQLDatabase.run for rows read from a result handle."""
+        res = [
+            {column: truncate_word(value, length=self._max_string_length) for column, value in zip(columns, row)}
+            for row in rows
+        ]
+        if not include_columns:
+            res = [tuple(row.values()) for row in res]
+        return str(res) if res else ""
+
+    def _run_guarded(self, command, fetch, include_columns, execution_options, is_read):
+        """
+        Runs a statement after the EXPLAIN cost check (utils/cost_guard.py), noting any
+        rewrite. Reads go through a streaming result handle (utils/result_handles.py), so
+        only a preview is fetched; writes record a before-image for /revert.
+        Returns (result, handle or None).
+        """
+        started = time.perf_counter()
+        command, note = guard_sql(self._execute, self.dialect, command)
+        handle = None
+        if is_read and fetch == 'all' and RESULT_HANDLES_ENABLED and not execution_options and self._schema is None:
+            columns, rows, handle = result_store.open_sql(self._engine, self._identity, command)
+            result = self._format_rows(columns, rows, include_columns)
+            db_rows.observe(len(rows), db_type=self.dialect)
+            if handle is not None:
+                result = f"{result}\n{describe_handle(handle, len(rows))}"
+        elif (not is_read and self._mode == 'read-write' and UNDO_CAPTURE_ENABLED and fetch == 'all'
+              and not execution_options and self._schema is None):
+            returned = execute_write(self._engine, self._identity, command)
+            result = self._format_rows(*returned, include_columns) if returned else ""
+        else:
+            result = super().run(command, fetch, include_columns, execution_options=execution_options)
+        db_query_seconds.observe(time.perf_counter() - started, db_type=self.dialect,
+                                 kind='read' if is_read else 'write')
+        if note and result:
+            print(f"Cost guard: {note}")
+            # The agent sees the note with the rows, so it knows the result was capped
+            result = f"{result}\n-- {note}"
+        return result, handle
+
+
+def get_sql_database(db_uri, mode='read-only', **kwargs):
+    """Returns a SQLDatabase backed by the pooled engine and the shared schema cache."""
+    return CachedSQLDatabase(get_engine(db_uri, mode), db_uri, mode=mode, **kwargs)
@@ -0,0 +1,257 @@
+# Backend/utils/scratchpad.py
+#
+# Compaction of tool outputs before they go back into the agent's scratchpad.
+# Every agent step resends all earlier tool outputs, so a run that reads a
+# few schemas and wide results grows the prompt (and the Groq TPM bill) with
+# every iteration. The formatter below, passed to create_tool_calling_agent,
+# rewrites the observations each time the scratchpad is built:
+#   - wide rows are cut down to a per-cell width
+#   - results with many rows become a row count, per-column stats and a few
+#     sample rows (SQL tuples/dicts and MongoDB documents alike)
+#   - schema blocks repeated in several steps are kept only in the latest one
+#   - if the outputs are still over SCRATCHPAD_TOKEN_BUDGET, the oldest ones
+#     are reduced to a one-line digest, newest kept longest
+# Each rewritten output says what was dropped, so the agent can re-query.
+# intermediate_steps keep the raw outputs (the query cache still sees them).
+
+import ast
+import datetime
+import json
+import os
+from functools import lru_cache
+
+from langchain.agents.format_scratchpad.tools import format_to_tool_messages
+
+SCRATCHPAD_TOKEN_BUDGET = int(os.getenv('SCRATCHPAD_TOKEN_BUDGET', 4000))
+# Results with more rows than this are summarized
+SCRATCHPAD_MAX_ROWS = int(os.getenv('SCRATCHPAD_MAX_ROWS', 25))
+SCRATCHPAD_SAMPLE_ROWS = int(os.getenv('SCRATCHPAD_SAMPLE_ROWS', 5))
+SCRATCHPAD_MAX_ROW_CHARS = int(os.getenv('SCRATCHPAD_MAX_ROW_CHARS', 400))
+# Schema blocks shorter than this aren't worth collapsing
+MIN_BLOCK_CHARS = 80
+# Same rough estimate as utils/llm_client.py
+CHARS_PER_TOKEN = 4
+
+RESULT_TOOLS = ('sql_db_query', 'mongodb_query')
+
+
+def _tokens(text):
+    return len(text) // CHARS_PER_TOKEN
+
+
+def _literal(node):
+    """
+    ast.literal_eval for SQLDatabase.run output, which may contain reprs like
+    Decimal('1.5') or datetime.date(2024, 1, 1); those become floats and ISO strings.
+    """
+    if isinstance(node, ast.Constant):
+        return node.value
+    if isinstance(node, (ast.Tuple, ast.List)):
+        return [_literal(item) for item in node.elts]
+    if isinstance(node, ast.Dict):
+        return {_literal(key): _literal(value) for key, value in zip(node.keys, node.values)}
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub) and isinstance(node.operand, ast.Constant):
+        return -node.operand.value
+    if isinstance(node, ast.Call):
+        name = ast.unparse(node.func).split('.')[-1]
+        args = [arg.value for arg in node.args if isinstance(arg, ast.Constant)]
+        if name == 'Decimal' and len(args) == 1:
+            return float(args[0])
+        if name in ('date', 'datetime') and args and len(args) == len(node.args):
+            try:
+                return getattr(datetime, name)(*args).isoformat()
+            except (TypeError, ValueError):
+                pass
+    return ast.unparse(node)
+
+
+def _parse_rows(text):
+    """Rows of a query tool result (a Python list repr or a JSON array), or None."""
+    text = text.strip()
+    if not text.startswith('['):
+        return None
+    try:
+        rows = json.loads(text)
+    except ValueError:
+        try:
+            tree = ast.parse(text, mode='eval').body
+        except (SyntaxError, ValueError, RecursionError):
+            return None
+        if not isinstance(tree, ast.List):
+            return None
+        rows = _literal(tree)
+    return rows if all(isinstance(row, (list, dict)) for row in rows) else None
+
+
+def _render(rows, dicts):
+    if dicts:
+        return json.dumps(rows, default=str)
+    return repr([tuple(row) for row in rows])
+
+
+def _shrink(value, width):
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value, default=str)
+    if isinstance(value, str) and len(value) > width:
+        return value[:width] + '…'
+    return value
+
+
+def _narrow_rows(rows):
+    """Cuts the cells of rows wider than SCRATCHPAD_MAX_ROW_CHARS. Returns (rows, cells cut)."""
+    narrowed, cut = [], 0
+    for row in rows:
+        values = list(row.values()) if isinstance(row, dict) else row
+        if len(repr(values)) <= SCRATCHPAD_MAX_ROW_CHARS:
+            narrowed.append(row)
+            continue
+        width = max(20, SCRATCHPAD_MAX_ROW_CHARS // max(1, len(values)))
+        shrunk = [_shrink(value, width) for value in values]
+        cut += sum(1 for value in shrunk if isinstance(value, str) and value.endswith('…'))
+        narrowed.append(dict(zip(row, shrunk)) if isinstance(row, dict) else shrunk)
+    return narrowed, cut
+
+
+def _column_stats(name, values):
+    present = [value for value in values if value is not None]
+    nulls = len(values) - len(present)
+    numbers = [value for value in present if isinstance(value, (int, float)) and not isinstance(value, bool)]
+    if present and len(numbers) == len(present):
+        return f'{name}: numeric, min {min(numbers):g}, max {max(numbers):g}, avg {sum(numbers) / len(numbers):g}, {nulls} nulls'
+    texts = [value if isinstance(value, str) else json.dumps(value, default=str) for value in present]
+    distinct = len(set(texts))
+    if not texts:
+        return f'{name}: all null'
+    return (f'{name}: {distinct} distinct, {nulls} nulls, min {_shrink(min(texts), 40)!r}, '
+            f'max {_shrink(max(texts), 40)!r}')
+
+
+def _summarize(rows):
+    """Row count, per-column stats and a few sample rows for a large result."""
+    dicts = isinstance(rows[0], dict)
+    if dicts:
+        columns = list(dict.fromkeys(key for row in rows for key in row))
+        table = [[row.get(column) for row in rows] for column in columns]
+    else:
+        width = max(len(row) for row in rows)
+        columns = [f'column {index + 1}' for index in range(width)]
+        table = [[row[index] if index < len(row) else None for row in rows] for index in range(width)]
+    sample, _ = _narrow_rows(rows[:SCRATCHPAD_SAMPLE_ROWS])
+    lines = [
+        f'[Result compacted: {len(rows):,} rows x {len(columns)} columns; showing '
+        f'{len(sample)} sample rows and per-column stats, {len(rows) - len(sample):,} rows omitted.]',
+        f'Sample: {_render(sample, dicts)}',
+        'Columns:',
+    ]
+    lines += [f'  {_column_stats(name, values)}' for name, values in zip(columns, table)]
+    return '\n'.join(lines)
+
+
+def _compact_result(text):
+    """Compacts a query tool result; trailing `-- ...` notes (handles, caps) are kept as they are."""
+    body, separator, notes = text.partition('\n--')
+    rows = _parse_rows(body)
+    if not rows:
+        return text, []
+    if len(rows) > SCRATCHPAD_MAX_ROWS:
+        compacted, dropped = _summarize(rows), [f'{len(rows) - SCRATCHPAD_SAMPLE_ROWS:,} result rows summarized']
+    else:
+        narrowed, cut = _narrow_rows(rows)
+        if not cut:
+            return text, []
+        compacted = f'{_render(narrowed, isinstance(rows[0], dict))}\n[{cut} wide cells truncated]'
+        dropped = [f'{cut} wide cells truncated']
+    return compacted + (separator + notes if separator else ''), dropped
+
+
+@lru_cache(maxsize=64)
+def _compact_observation(tool, text):
+    """Per-output compaction, independent of the other steps (cached: it reruns every iteration)."""
+    if tool in RESULT_TOOLS:
+        return _compact_result(text)
+    return text, []
+
+
+def _collapse_repeated_blocks(observations):
+    """
+    Replaces schema/sample blocks that a later step shows again with a short
+    reference, newest first, so the copy that survives is the one kept longest.
+    """
+    seen = set()
+    collapsed_total = 0
+    result = []
+    for text in reversed(observations):
+        blocks = text.split('\n\n')
+        kept = []
+        for block in blocks:
+            key = block.strip()
+            if len(key) >= MIN_BLOCK_CHARS and key in seen:
+                kept.append(f'[{key.splitlines()[0][:80]} ... repeated in a later step]')
+                collapsed_total += 1
+            else:
+                seen.add(key)
+                kept.append(block)
+        result.append('\n\n'.join(kept))
+    return list(reversed(result)), collapsed_total
+
+
+def _digest(tool, text):
+    first = text.strip().splitlines()[0] if text.strip() else ''
+    return (f'[Output of {tool} dropped to stay within the token budget '
+            f'(~{_tokens(text):,} tokens); it began: {first[:120]}]')
+
+
+def _truncate(text, budget_tokens):
+    keep = max(200, budget_tokens * CHARS_PER_TOKEN)
+    if len(text) <= keep:
+        return text
+    head = text[:keep * 3 // 4]
+    tail = text[-(keep // 4):]
+    return f'{head}\n[... {len(text) - len(head) - len(tail):,} characters omitted ...]\n{tail}'
+
+
+def compact_observations(steps, budget=SCRATCHPAD_TOKEN_BUDGET):
+    """
+    Returns the compacted observation for each (action, observation) step and
+    the list of what was dropped.
+    """
+    observations, dropped = [], []
+    for action, observation in steps:
+        text, notes = _compact_observation(action.tool, str(observation))
+        observations.append(text)
+        dropped += notes
+
+    observations, collapsed = _collapse_repeated_blocks(observations)
+    if collapsed:
+        dropped.append(f'{collapsed} repeated schema blocks collapsed')
+
+    # Over budget: reduce the oldest outputs first; the latest one is what the agent is working on
+    total = sum(_tokens(text) for text in observations)
+    digested = 0
+    for index in range(len(observations) - 1):
+        if total <= budget:
+            break
+        digest = _digest(steps[index][0].tool, observations[index])
+        total -= _tokens(observations[index]) - _tokens(digest)
+        observations[index] = digest
+        digested += 1
+    if digested:
+        dropped.append(f'{digested} older outputs reduced to a digest')
+    if observations and total > budget:
+        latest = observations[-1]
+        observations[-1] = _truncate(latest, budget - (total - _tokens(latest)))
+        dropped.append('latest output truncated')
+    return observations, dropped
+
+
+def compact_scratchpad(intermediate_steps):
+    """message_formatter for create_tool_calling_agent: format_to_tool_messages over compacted outputs."""
+    steps = list(intermediate_steps)
+    if not steps:
+        return []
+    observations, dropped = compact_observations(steps)
+    if dropped:
+        before = sum(_tokens(str(observation)) for _, observation in steps)
+        after = sum(_tokens(text) for text in observations)
+        print(f"Scratchpad compaction: ~{before:,} -> ~{after:,} tokens ({'; '.join(dropped)})")
+    return format_to_tool_messages([(action, text) for (action, _), text in zip(steps, observations)])
@@ -0,0 +1,134 @@
+# Backend/utils/single_shot.py
+#
+# Fast path for simple questions: instead of letting the tool-calling agent
+# discover the schema over 4-6 sequential LLM calls, put a compact schema
+# digest straight into the prompt, ask for the SQL in one completion, run it,
+# and phrase the answer in a second short call. Anything the fast path cannot
+# handle (invalid SQL, execution errors, write statements) returns None so the
+# caller can fall back to the full agent.
+
+import asyncio
+import os
+import re
+
+from langchain_core.messages import HumanMessage, SystemMessage
+from sqlalchemy.exc import SQLAlchemyError
+
+# Opt-in default for requests that don't say; the request body can override it
+SINGLE_SHOT_DEFAULT = os.getenv('SINGLE_SHOT_MODE', 'false').lower() in ('1', 'true', 'yes')
+
+# Keep the prompt small even when the result is large
+MAX_RESULT_CHARS = int(os.getenv('SINGLE_SHOT_MAX_RESULT_CHARS', 4000))
+
+CANNOT_ANSWER = 'CANNOT_ANSWER'
+
+READ_STATEMENT = re.compile(r'^\s*(select|with|show|explain)\b', re.IGNORECASE)
+SQL_BLOCK = re.compile(r'```(?:sql)?\s*(.*?)```', re.IGNORECASE | re.DOTALL)
+
+
+def extract_sql(text: str) -> str:
+    """Pulls the SQL statement out of a completion (fenced block or bare text)."""
+    match = SQL_BLOCK.search(text)
+    sql = match.group(1) if match else text
+    return sql.strip().rstrip(';').strip()
+
+
+def validate_single_shot_sql(sql: str) -> tuple[bool, str]:
+    """Checks that the generated SQL is a single read statement the fast path may run."""
+    if not sql or CANNOT_ANSWER in sql:
+        return False, "The model could not answer from the schema digest."
+    if ';' in sql:
+        return False, "Multiple statements are not allowed in single-shot mode."
+    if not READ_STATEMENT.match(sql):
+        # Writes always go through the agent, which shows affected rows first
+        return False, "Only read statements are run in single-shot mode."
+    return True, ""
+
+
+def _generation_messages(user_query: str, dialect: str, digest: str, examples: str = '') -> list:
+    return [
+        SystemMessage(content=(
+            f"You are an expert {dialect} SQL writer.\n"
+            "Given the database schema below, write ONE read-only SQL query that answers the user's question.\n"
+            "- Use only the tables and columns listed.\n"
+            "- Limit large result sets to at most 100 rows unless the user asks for more.\n"
+            "- Return only the SQL inside a ```sql code block, with no explanation.\n"
+            f"- If the question cannot be answered with a single SELECT, reply with {CANNOT_ANSWER}.\n\n"
+            f"Schema:\n{digest}"
+            + (f"\n\n{examples}" if examples else "")
+        )),
+        HumanMessage(content=user_query),
+    ]
+
+
+def _answer_messages(user_query: str, sql: str, result) -> list:
+    result_text = str(result) if result else "(no rows)"
+    if len(result_text) > MAX_RESULT_CHARS:
+        result_text = result_text[:MAX_RESULT_CHARS] + " ... (truncated)"
+    return [
+        SystemMessage(content=(
+            "You are a helpful AI assistant for querying a SQL database.\n"
+            "Answer the user's question clearly and concisely in natural language, "
+            "using only the SQL result provided."
+        )),
+        HumanMessage(content=f"Question: {user_query}\n\nSQL:\n{sql}\n\nResult:\n{result_text}"),
+    ]
+
+
+def _run_generated_sql(db, sql: str):
+    """Runs the generated SQL, or returns None (after logging why) if the fast path should give up."""
+    is_valid, reason = validate_single_shot_sql(sql)
+    if not is_valid:
+        print(f"Single-shot fallback: {reason}")
+        return None
+    try:
+        return db.run(sql, include_columns=True)
+    except SQLAlchemyError as e:
+        print(f"Single-shot fallback: SQL execution failed: {e}")
+        return None
+
+
+def run_single_shot_query(user_query: str, db, llm, callbacks: list = None, examples: str = ''):
+    """
+    Answers a question with one SQL-generation call and one answer call.
+    `examples` (utils/examples.py) are appended to the generation prompt.
+    Returns {'response', 'sql', 'rows'} on success (`rows` is the raw result, for
+    the caller's caches), or None if the caller should fall back to the agent.
+    """
+    try:
+        digest = db.get_schema_digest()
+        generation = llm.invoke(_generation_messages(user_query, db.dialect, digest, examples),
+                                config={'callbacks': callbacks})
+        sql = extract_sql(generation.content)
+
+        result = _run_generated_sql(db, sql)
+        if result is None:
+            return None
+
+        answer = llm.invoke(_answer_messages(user_query, sql, result), config={'callbacks': callbacks})
+        return {'response': answer.content, 'sql': sql, 'rows': result}
+
+    except ValueError as e:
+        # Schema digest problems (e.g. tables vanished mid-request)
+        print(f"Single-shot fallback: {e}")
+        return None
+
+
+async def arun_single_shot_query(user_query: str, db, llm, callbacks: list = None, examples: str = ''):
+    """Async twin of run_single_shot_query; database calls run in a worker thread."""
+    try:
+        digest = await asyncio.to_thread(db.get_schema_digest)
+        generation = await llm.ainvoke(_generation_messages(user_query, db.dialect, digest, examples),
+                                       config={'callbacks': callbacks})
+        sql = extract_sql(generation.content)
+
+        result = await asyncio.to_thread(_run_generated_sql, db, sql)
+        if result is None:
+            return None
+
+        answer = await llm.ainvoke(_answer_messages(user_query, sql, result), config={'callbacks': callbacks})
+        return {'response': answer.content, 'sql': sql, 'rows': result}
+
+    except ValueError as e:
+        print(f"Single-shot fallback: {e}")
+        return None
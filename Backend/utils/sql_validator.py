@@ -0,0 +1,310 @@
+# Backend/utils/sql_validator.py
+#
+# Local replacement for the toolkit's LLM-based `sql_db_query_checker`, which
+# spent a full LLM round trip just to syntax-check generated SQL (and a failed
+# statement then cost another agent iteration). Statements are parsed for the
+# connected dialect with sqlglot, tables and columns are checked against the
+# cached schema, and common mistakes are repaired locally:
+#   - syntax/functions from another dialect are transpiled (GETDATE(), TOP, backticks, ...)
+#   - identifiers are matched case-insensitively and re-quoted for the dialect
+#   - near-miss table/column names are corrected when there is one clear match
+#     (reads only: a write naming a near-miss gets the suggestion back as an
+#     error, and a write in another dialect's syntax gets the rewritten form,
+#     so nothing is modified on a guess)
+#   - double-quoted string literals in Postgres comparisons become real strings
+# Only when repair fails does the model get the statement back, with a precise
+# error naming the line, table or column that is wrong.
+
+import difflib
+import os
+from typing import Any
+
+from langchain_core.tools import BaseTool
+from sqlalchemy.exc import SQLAlchemyError
+
+try:
+    import sqlglot
+    from sqlglot import exp
+    from sqlglot.errors import ParseError
+except ImportError:  # Optional: without sqlglot the toolkit's LLM checker stays in place
+    sqlglot = None
+
+SQL_VALIDATION_ENABLED = os.getenv('SQL_VALIDATION', 'true').lower() in ('1', 'true', 'yes')
+
+# SQLAlchemy dialect name -> sqlglot dialect
+SQLGLOT_DIALECTS = {'postgresql': 'postgres', 'mysql': 'mysql', 'sqlite': 'sqlite'}
+# Dialects tried when the statement doesn't parse (or uses unknown functions) in the target
+REPAIR_SOURCE_DIALECTS = ['postgres', 'mysql', 'tsql', 'sqlite', 'bigquery', 'snowflake']
+# How similar a misspelt name must be to a real one to be corrected automatically
+NAME_MATCH_CUTOFF = float(os.getenv('SQL_REPAIR_NAME_CUTOFF', 0.85))
+# Cap on how many tables/columns are listed in an error message
+MAX_SUGGESTIONS = 25
+# Catalog tables/views aren't in the usable-table list but are legitimate to query
+SYSTEM_TABLE_PREFIXES = ('pg_', 'sqlite_')
+
+
+class SQLValidationError(SQLAlchemyError):
+    """
+    A statement failed local validation and could not be repaired. Subclasses
+    SQLAlchemyError so the query tool's run_no_throw reports it to the agent
+    as an "Error: ..." observation, just like a database error.
+    """
+
+
+def validation_available(dialect: str) -> bool:
+    return SQL_VALIDATION_ENABLED and sqlglot is not None and dialect in SQLGLOT_DIALECTS
+
+
+def _format_parse_error(error) -> str:
+    details = []
+    for item in getattr(error, 'errors', [])[:3]:
+        details.append(f"line {item.get('line')}, column {item.get('col')}: {item.get('description')}"
+                       + (f" near '{item['highlight']}'" if item.get('highlight') else ''))
+    return 'Syntax error: ' + ('; '.join(details) if details else str(error))
+
+
+def _count_unknown_functions(tree) -> int:
+    return sum(1 for _ in tree.find_all(exp.Anonymous))
+
+
+def _parse(sql: str, dialect: str):
+    """
+    Parses a single statement for `dialect`. Falls back to other dialects when
+    the SQL doesn't parse or calls functions the target doesn't know, so the
+    result can be transpiled. Returns (tree, dialect it was read as); raises
+    SQLValidationError if nothing parses.
+    """
+    first_error = None
+    try:
+        statements = [tree for tree in sqlglot.parse(sql, read=dialect) if tree is not None]
+    except ParseError as e:
+        statements, first_error = None, e
+
+    if statements is not None:
+        if len(statements) != 1:
+            raise SQLValidationError('Run exactly one SQL statement at a time.')
+        tree = statements[0]
+        if not _count_unknown_functions(tree):
+            return tree, dialect
+    else:
+        tree = None
+
+    best, best_dialect = tree, dialect
+    for source in REPAIR_SOURCE_DIALECTS:
+        if source == dialect:
+            continue
+        try:
+            candidates = [item for item in sqlglot.parse(sql, read=source) if item is not None]
+        except ParseError:
+            continue
+        if len(candidates) != 1:
+            continue
+        # A statement that parses for the target is only rewritten when another
+        # dialect understands every function in it (e.g. GETDATE() -> CURRENT_TIMESTAMP);
+        # functions nobody knows (user-defined ones) are left for the database
+        if not _count_unknown_functions(candidates[0]):
+            best, best_dialect = candidates[0], source
+            break
+        if best is None:
+            best, best_dialect = candidates[0], source
+
+    if best is None:
+        raise SQLValidationError(_format_parse_error(first_error))
+    return best, best_dialect
+
+
+def _is_write(tree) -> bool:
+    """Anything but a plain read, including data-modifying CTEs inside a SELECT."""
+    if not isinstance(tree, (exp.Select, exp.Union)):
+        return True
+    return tree.find(exp.Insert, exp.Update, exp.Delete) is not None
+
+
+def _resolve(name: str, candidates, kind: str, repairs: list, fuzzy: bool = True):
+    """
+    Maps a name to the real one: exact, then case-insensitive, then one clear
+    near-miss. Without `fuzzy` a near-miss is raised as a suggestion instead.
+    """
+    if name in candidates:
+        return name
+    by_lower = {candidate.lower(): candidate for candidate in candidates}
+    if name.lower() in by_lower:
+        # Still a repair: the rewritten identifier must make it into the returned SQL
+        repairs.append(f"{kind} '{name}' -> '{by_lower[name.lower()]}'")
+        return by_lower[name.lower()]
+    matches = difflib.get_close_matches(name.lower(), list(by_lower), n=2, cutoff=NAME_MATCH_CUTOFF)
+    if len(matches) == 1:
+        if not fuzzy:
+            raise SQLValidationError(
+                f"{kind.capitalize()} '{name}' does not exist. Did you mean '{by_lower[matches[0]]}'? "
+                f"Check the name and resubmit."
+            )
+        repairs.append(f"{kind} '{name}' -> '{by_lower[matches[0]]}'")
+        return by_lower[matches[0]]
+    return None
+
+
+def _identifier(name: str, dialect: str):
+    # Postgres folds unquoted identifiers to lower case, so mixed case needs quotes
+    return exp.to_identifier(name, quoted=dialect == 'postgres' and name != name.lower())
+
+
+def _suggest(names) -> str:
+    names = sorted(names)
+    listed = ', '.join(names[:MAX_SUGGESTIONS])
+    return listed + (f', ... ({len(names)} total)' if len(names) > MAX_SUGGESTIONS else '')
+
+
+def _check_tables(tree, dialect, usable_tables, repairs, fuzzy=True):
+    """
+    Resolves every real table reference. Returns ({alias or name: real table},
+    {misspelt unaliased name: real table}) for resolving column qualifiers.
+    """
+    cte_names = {cte.alias_or_name.lower() for cte in tree.find_all(exp.CTE)}
+    sources, renamed = {}, {}
+    for table in tree.find_all(exp.Table):
+        name = table.name
+        if not name or name.lower() in cte_names or table.args.get('db') or name.lower().startswith(SYSTEM_TABLE_PREFIXES):
+            # CTEs, catalog tables and schema-qualified tables aren't checked
+            continue
+        real = _resolve(name, usable_tables, 'table', repairs, fuzzy)
+        if real is None:
+            raise SQLValidationError(
+                f"Table '{name}' does not exist. Available tables: {_suggest(usable_tables)}"
+            )
+        if real != name:
+            if not table.alias:
+                renamed[name.lower()] = real  # Columns may still be qualified with the old spelling
+            table.set('this', _identifier(real, dialect))
+        sources[table.alias_or_name.lower()] = real
+    sources.update(renamed)
+    return sources, renamed
+
+
+def _string_literal_repair(column, dialect, repairs):
+    """In Postgres, "text" in a comparison is an identifier; the model almost always meant 'text'."""
+    identifier = column.this
+    if dialect != 'postgres' or column.table or not getattr(identifier, 'quoted', False):
+        return False
+    if not isinstance(column.parent, (exp.EQ, exp.NEQ, exp.Like, exp.ILike, exp.In)):
+        return False
+    column.replace(exp.Literal.string(column.name))
+    repairs.append(f'"{column.name}" treated as a string literal')
+    return True
+
+
+def _check_columns(tree, dialect, sources, renamed, columns_by_table, repairs, fuzzy=True):
+    select_aliases = {alias.alias.lower() for alias in tree.find_all(exp.Alias) if alias.alias}
+    # Unqualified columns can only be checked when every source is a table with known columns (not a view)
+    derived = (any(True for _ in tree.find_all(exp.Subquery, exp.CTE, exp.Unnest, exp.Lateral))
+               or any(table not in columns_by_table for table in sources.values()))
+    all_columns = {column for table in set(sources.values()) for column in columns_by_table.get(table, [])}
+
+    for column in list(tree.find_all(exp.Column)):
+        name = column.name
+        if not name or name == '*' or isinstance(column.this, exp.Star):
+            continue
+        qualifier = column.table
+        if qualifier:
+            table = sources.get(qualifier.lower())
+            if table is None:
+                continue  # Subquery/CTE alias or schema-qualified reference
+            if qualifier.lower() in renamed:
+                column.set('table', _identifier(table, dialect))
+            if table not in columns_by_table:
+                continue  # A view: its columns aren't known
+            candidates = columns_by_table[table]
+            real = _resolve(name, candidates, 'column', repairs, fuzzy)
+            if real is None:
+                raise SQLValidationError(
+                    f"Column '{name}' does not exist in table '{table}'. Columns: {_suggest(candidates)}"
+                )
+        else:
+            if name.lower() in select_aliases or derived or not sources:
+                continue
+            real = _resolve(name, all_columns, 'column', repairs, fuzzy)
+            if real is None:
+                if _string_literal_repair(column, dialect, repairs):
+                    continue
+                tables = ', '.join(sorted(set(sources.values())))
+                raise SQLValidationError(
+                    f"Column '{name}' does not exist in {tables}. Columns: {_suggest(all_columns)}"
+                )
+        if real != name:
+            column.set('this', _identifier(real, dialect))
+
+
+def _check_insert_columns(tree, dialect, columns_by_table, repairs):
+    """The column list of INSERT INTO t (a, b) holds identifiers, not column references."""
+    schema = tree.this
+    if not isinstance(schema, exp.Schema) or not isinstance(schema.this, exp.Table):
+        return
+    table = schema.this.name
+    if table not in columns_by_table:
+        return
+    candidates = columns_by_table[table]
+    for identifier in schema.expressions:
+        if not isinstance(identifier, exp.Identifier):
+            continue
+        real = _resolve(identifier.name, candidates, 'column', repairs, fuzzy=False)
+        if real is None:
+            raise SQLValidationError(
+                f"Column '{identifier.name}' does not exist in table '{table}'. Columns: {_suggest(candidates)}"
+            )
+        if real != identifier.name:
+            identifier.replace(_identifier(real, dialect))
+
+
+def validate_sql(sql: str, dialect: str, usable_tables, get_columns):
+    """
+    Validates (and if possible repairs) one statement for a SQLAlchemy dialect.
+    `usable_tables` holds every table and view name; `get_columns(tables)` returns
+    {table: [columns]} for the referenced ones whose columns are known.
+    Returns (sql_to_run, repairs). Raises SQLValidationError with a precise
+    message when the statement is invalid and can't be repaired. Writes and
+    DDL only get case and quoting repairs.
+    """
+    target = SQLGLOT_DIALECTS[dialect]
+    repairs = []
+    tree, source = _parse(sql, target)
+    write = _is_write(tree)
+    if source != target:
+        if write:
+            raise SQLValidationError(
+                f"This statement uses {source} syntax, which {target} doesn't accept. "
+                f"Written for {target} it is:\n{tree.sql(dialect=target)}\nCheck it and resubmit."
+            )
+        repairs.append(f'rewrote {source} syntax for {target}')
+
+    # DDL and other statements are only syntax-checked; their tables may not exist yet
+    if isinstance(tree, (exp.Select, exp.Union, exp.Insert, exp.Update, exp.Delete)):
+        sources, renamed = _check_tables(tree, target, list(usable_tables), repairs, fuzzy=not write)
+        columns_by_table = get_columns(sorted(set(sources.values()))) if sources else {}
+        _check_columns(tree, target, sources, renamed, columns_by_table, repairs, fuzzy=not write)
+        if isinstance(tree, exp.Insert):
+            _check_insert_columns(tree, target, columns_by_table, repairs)
+
+    if not repairs:
+        return sql, repairs
+    return tree.sql(dialect=target), repairs
+
+
+class LocalQueryCheckerTool(BaseTool):
+    """Drop-in replacement for the toolkit's `sql_db_query_checker` that needs no LLM call."""
+
+    name: str = 'sql_db_query_checker'
+    description: str = (
+        'Use this tool to double check if your query is correct before executing it. '
+        'Returns the (possibly auto-repaired) query to run, or a precise error to fix. '
+        'Always use this tool before executing a query with sql_db_query!'
+    )
+    db: Any
+
+    def _run(self, query: str, run_manager=None) -> str:
+        try:
+            sql, repairs = self.db.prepare_statement(query)
+        except SQLValidationError as e:
+            return f'Error: {e}'
+        if repairs:
+            return f"{sql}\n-- auto-repaired: {'; '.join(repairs)}"
+        return sql
@@ -0,0 +1,57 @@
+# Backend/utils/sqlite_store.py
+#
+# Shared plumbing for the small SQLite files under instance/ (change history,
+# few-shot examples, column profiles). Each store opens one short-lived
+# connection per call, so stores are safe to use from any thread and from
+# several workers sharing the file. The schema is created on first use, and
+# WAL lets readers run while another connection writes.
+
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+INSTANCE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'instance')
+
+
+def instance_path(filename):
+    """Default location of a store's file, under Backend/instance."""
+    return os.path.join(INSTANCE_DIR, filename)
+
+
+class SQLiteStore:
+    """Base class: subclasses set `schema` (a CREATE ... IF NOT EXISTS script) and use _connect()."""
+
+    schema = ''
+
+    def __init__(self, path):
+        self.path = path
+        self._initialized = False
+        self._lock = threading.Lock()
+
+    def _initialize(self):
+        with self._lock:
+            if self._initialized:
+                return
+            if self.path != ':memory:':
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            connection = sqlite3.connect(self.path)
+            try:
+                connection.execute('PRAGMA journal_mode=WAL')
+                connection.executescript(self.schema)
+            finally:
+                connection.close()
+            self._initialized = True
+
+    @contextmanager
+    def _connect(self):
+        """A connection that commits on success and is always closed."""
+        if not self._initialized:
+            self._initialize()
+        connection = sqlite3.connect(self.path, timeout=10)
+        connection.row_factory = sqlite3.Row
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
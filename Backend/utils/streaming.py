@@ -0,0 +1,129 @@
+# Backend/utils/streaming.py
+#
+# Server-Sent Events support for /query/stream. The query runs in a worker
+# thread; a LangChain callback handler turns agent progress (tool calls,
+# generated SQL, partial rows, LLM tokens) into events on a queue, and the
+# response generator drains that queue to the client as it fills. If the
+# client disconnects, the next callback raises and the remaining work stops.
+
+import json
+import os
+import queue
+import threading
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+HEARTBEAT_SECONDS = float(os.getenv('SSE_HEARTBEAT_SECONDS', 15))
+PREVIEW_CHARS = int(os.getenv('SSE_PREVIEW_CHARS', 2000))
+
+SQL_TOOLS = {'sql_db_query', 'sql_db_query_checker', 'mongodb_query', 'mongodb_query_checker'}
+
+_DONE = object()
+
+
+class QueryCancelled(Exception):
+    """Raised inside the agent run when the streaming client went away."""
+
+
+def format_sse(event: str, data) -> str:
+    """Formats one Server-Sent Event frame."""
+    payload = json.dumps(data, default=str)
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+def _preview(value) -> str:
+    text = value if isinstance(value, str) else str(value)
+    if len(text) > PREVIEW_CHARS:
+        return text[:PREVIEW_CHARS] + ' ... (truncated)'
+    return text
+
+
+class StreamingCallbackHandler(BaseCallbackHandler):
+    """Pushes agent progress onto a queue and aborts the run once cancelled."""
+
+    raise_error = True  # Let QueryCancelled propagate out of the agent
+
+    def __init__(self):
+        self.events = queue.Queue()
+        self.cancelled = threading.Event()
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def emit(self, event, data):
+        if self.cancelled.is_set():
+            raise QueryCancelled('Client disconnected')
+        self.events.put((event, data))
+
+    def on_tool_start(self, serialized, input_str, **kwargs):
+        name = (serialized or {}).get('name') or kwargs.get('name')
+        self.emit('tool_start', {'tool': name, 'input': _preview(input_str)})
+        if name in SQL_TOOLS:
+            self.emit('sql', {'tool': name, 'statement': input_str})
+
+    def on_tool_end(self, output, **kwargs):
+        name = kwargs.get('name')
+        self.emit('tool_end', {'tool': name, 'output': _preview(getattr(output, 'content', output))})
+        if name in ('sql_db_query', 'mongodb_query'):
+            self.emit('rows', {'preview': _preview(getattr(output, 'content', output))})
+
+    def on_tool_error(self, error, **kwargs):
+        self.emit('tool_error', {'tool': kwargs.get('name'), 'error': str(error)})
+
+    def on_llm_new_token(self, token, **kwargs):
+        if token:
+            self.emit('token', {'text': token})
+
+    def on_text(self, text, **kwargs):
+        # LLM calls queued behind the shared rate limiter (utils/rate_limit.py)
+        if kwargs.get('rate_limit'):
+            self.emit('queued', kwargs['rate_limit'])
+        # Transient LLM failures being retried or sent to a fallback model
+        if kwargs.get('llm_retry'):
+            self.emit('retry', kwargs['llm_retry'])
+
+    def on_agent_action(self, action, **kwargs):
+        if self.cancelled.is_set():
+            raise QueryCancelled('Client disconnected')
+
+
+def stream_query(run_query, *args, **kwargs):
+    """
+    Runs `run_query(*args, callbacks=[handler], **kwargs)` in a worker thread and
+    yields SSE frames for its progress, ending with an `answer` or `error` event.
+    Closing the generator (client disconnect) cancels the remaining work.
+    """
+    handler = StreamingCallbackHandler()
+
+    def worker():
+        try:
+            result = run_query(*args, callbacks=[handler], **kwargs)
+            if 'error' in result:
+                handler.events.put(('error', result))
+            else:
+                handler.events.put(('answer', result))
+        except QueryCancelled:
+            pass
+        except Exception as e:
+            handler.events.put(('error', {'error': f'An unexpected error occurred: {str(e)}'}))
+        finally:
+            handler.events.put(_DONE)
+
+    thread = threading.Thread(target=worker, name='query-stream', daemon=True)
+    try:
+        # Flush something immediately so time-to-first-byte doesn't wait on the LLM
+        yield format_sse('start', {'status': 'running'})
+        thread.start()
+        while True:
+            try:
+                item = handler.events.get(timeout=HEARTBEAT_SECONDS)
+            except queue.Empty:
+                yield ': keep-alive\n\n'
+                continue
+            if item is _DONE:
+                break
+            event, data = item
+            yield format_sse(event, data)
+    finally:
+        # Runs on normal completion and on GeneratorExit when the client disconnects
+        handler.cancel()
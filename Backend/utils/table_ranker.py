@@ -0,0 +1,192 @@
+# Backend/utils/table_ranker.py
+#
+# Table pre-selection for large schemas. With hundreds of tables, the agent's
+# sql_db_list_tables output and the single-shot schema digest alone fill a
+# good part of the context window, and every LLM call pays for them again.
+# Before a question reaches the LLM, the tables are ranked by relevance and
+# the request is scoped (schema_cache.current_table_scope) to the best
+# TABLE_SELECTION_TOP_N plus the tables they reference or are referenced by,
+# up to TABLE_SELECTION_MAX_TABLES. Relevance combines:
+#   - question words found in table names, column names and comments
+#     (identifiers split on `_` and camelCase, weighted by rarity)
+#   - tables used by similar past questions (utils/examples.py)
+#   - foreign-key neighbours of the best matches, so joins stay possible
+# The term index is built once per schema fingerprint from a few batched
+# catalog queries; ranking a question is a dictionary walk (well under a
+# millisecond for a thousand tables). Databases below
+# TABLE_SELECTION_MIN_TABLES, and questions that match nothing, are not scoped.
+
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+
+from utils.examples import example_store
+from utils.result_cache import referenced_tables
+
+TABLE_SELECTION_ENABLED = os.getenv('TABLE_SELECTION', 'true').lower() in ('1', 'true', 'yes')
+TABLE_SELECTION_MIN_TABLES = int(os.getenv('TABLE_SELECTION_MIN_TABLES', 40))
+TABLE_SELECTION_TOP_N = int(os.getenv('TABLE_SELECTION_TOP_N', 12))
+TABLE_SELECTION_MAX_TABLES = int(os.getenv('TABLE_SELECTION_MAX_TABLES', 25))
+# Catalog comments and foreign keys don't change the schema fingerprint, so rebuild now and then
+TABLE_INDEX_TTL_SECONDS = float(os.getenv('TABLE_INDEX_TTL_SECONDS', 3600))
+
+# Weight of a question word found in each part of a table's description
+NAME_WEIGHT = 3.0
+COLUMN_WEIGHT = 1.0
+COMMENT_WEIGHT = 0.5
+# Added per similar past question (scaled by its similarity) that used a table
+USAGE_WEIGHT = 2.0
+
+STOP_WORDS = {
+    'a', 'an', 'the', 'and', 'or', 'of', 'in', 'on', 'for', 'to', 'by', 'with', 'from', 'at', 'as',
+    'is', 'are', 'was', 'were', 'be', 'do', 'does', 'did', 'what', 'which', 'who', 'whom', 'how',
+    'many', 'much', 'show', 'list', 'give', 'get', 'find', 'me', 'all', 'each', 'per', 'their', 'there',
+    'that', 'this', 'these', 'those', 'have', 'has', 'had', 'than', 'more', 'less', 'most', 'top',
+    'please', 'can', 'you', 'tell', 'it', 'its', 'my', 'our', 'we', 'i',
+}
+_CAMEL = re.compile(r'([a-z0-9])([A-Z])')
+
+
+def _stem(word):
+    if len(word) > 4 and word.endswith('ies'):
+        return word[:-3] + 'y'
+    if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+        return word[:-1]
+    return word
+
+
+def identifier_tokens(text):
+    """Lowercase, singular word tokens of a question, identifier or comment."""
+    words = re.findall(r'[a-z0-9]+', _CAMEL.sub(r'\1 \2', text or '').lower())
+    return [_stem(word) for word in words if word not in STOP_WORDS and len(word) > 1 and not word.isdigit()]
+
+
+class _TableIndex:
+    """Inverted index from tokens to the tables they describe, with the FK neighbourhood of each table."""
+
+    def __init__(self, fingerprint, catalog):
+        self.fingerprint = fingerprint
+        self.built_at = time.time()
+        self.size = len(catalog)
+        self.tables = {table.lower(): table for table in catalog}
+        # Per term and table, the weight of the most important part it appears in
+        postings = defaultdict(dict)
+        self.neighbours = defaultdict(set)
+        for table, (comment, columns, references) in catalog.items():
+            fields = [(identifier_tokens(table), NAME_WEIGHT), (identifier_tokens(comment), COMMENT_WEIGHT)]
+            for column, column_comment in columns:
+                fields.append((identifier_tokens(column), COLUMN_WEIGHT))
+                fields.append((identifier_tokens(column_comment), COMMENT_WEIGHT))
+            for tokens, weight in fields:
+                for token in tokens:
+                    if postings[token].get(table, 0.0) < weight:
+                        postings[token][table] = weight
+            for referenced in references:
+                if referenced in catalog and referenced != table:
+                    self.neighbours[table].add(referenced)
+                    self.neighbours[referenced].add(table)
+        self.postings = dict(postings)
+        self.idf = {term: math.log((self.size + 1) / len(tables)) for term, tables in self.postings.items()}
+
+    def rank(self, terms, boosts):
+        """[(table, score)] for tables that match any term or have a boost, best first."""
+        scores = defaultdict(float)
+        for term in set(terms):
+            idf = self.idf.get(term, 0.0)
+            for table, weight in self.postings.get(term, {}).items():
+                scores[table] += idf * weight
+        for table, boost in boosts.items():
+            name = self.tables.get(table)
+            if name is not None:
+                scores[name] += boost
+        return sorted(((table, score) for table, score in scores.items() if score > 0),
+                      key=lambda item: (-item[1], item[0]))
+
+
+class TableIndexCache:
+    """Table indexes keyed by database identity, rebuilt when the schema fingerprint changes."""
+
+    def __init__(self, ttl=TABLE_INDEX_TTL_SECONDS):
+        self.ttl = ttl
+        self._indexes = {}
+        self._lock = threading.Lock()
+        self._building = defaultdict(threading.Lock)
+
+    def get(self, db):
+        fingerprint = db.schema_fingerprint
+        index = self._indexes.get(db.identity)
+        if index is not None and index.fingerprint == fingerprint and time.time() - index.built_at < self.ttl:
+            return index
+        with self._lock:
+            building = self._building[db.identity]
+        # One build per database at a time; concurrent requests wait for it instead of repeating it
+        with building:
+            index = self._indexes.get(db.identity)
+            if index is None or index.fingerprint != fingerprint or time.time() - index.built_at >= self.ttl:
+                started = time.perf_counter()
+                index = _TableIndex(fingerprint, db.inspect_catalog())
+                self._indexes[db.identity] = index
+                print(f"Table index built: {index.size} tables, {len(index.postings)} terms "
+                      f"in {(time.perf_counter() - started) * 1000:.0f} ms")
+        return index
+
+    def invalidate(self, identity):
+        with self._lock:
+            self._indexes.pop(identity, None)
+
+
+def _usage_boosts(identity, dialect, question):
+    """Tables used by similar past questions, weighted by how similar they are."""
+    boosts = defaultdict(float)
+    try:
+        examples = example_store.search(identity, question, k=5)
+    except sqlite3.Error:
+        return boosts
+    for example in examples:
+        for table in referenced_tables(example.statement, dialect):
+            boosts[table] += USAGE_WEIGHT * example.score
+    return boosts
+
+
+def select_tables(db, question):
+    """
+    The set of tables a question should be answered from, or None to show every
+    table (small schema, nothing matched, or selection disabled). Blocking on
+    the first call per schema, which builds the index.
+    """
+    if not TABLE_SELECTION_ENABLED:
+        return None
+    try:
+        index = table_indexes.get(db)
+    except Exception as e:
+        # Selection only trims the prompt; without it the agent sees every table as before
+        print(f"Table selection skipped: {e}")
+        return None
+    if index.size < TABLE_SELECTION_MIN_TABLES:
+        return None
+
+    started = time.perf_counter()
+    ranked = index.rank(identifier_tokens(question), _usage_boosts(db.identity, db.dialect, question))
+    if not ranked:
+        return None
+    scores = dict(ranked)
+    selected = [table for table, _ in ranked[:TABLE_SELECTION_TOP_N]]
+    chosen = set(selected)
+    # Tables the best matches join to, most relevant first
+    neighbours = sorted({neighbour for table in selected for neighbour in index.neighbours.get(table, ())} - chosen,
+                        key=lambda table: (-scores.get(table, 0.0), table))
+    for neighbour in neighbours[:max(0, TABLE_SELECTION_MAX_TABLES - len(selected))]:
+        selected.append(neighbour)
+        chosen.add(neighbour)
+    print(f"Table selection: {len(selected)} of {index.size} tables in "
+          f"{(time.perf_counter() - started) * 1000:.1f} ms ({', '.join(selected[:5])}"
+          f"{', ...' if len(selected) > 5 else ''})")
+    return chosen
+
+
+# Process-wide singleton
+table_indexes = TableIndexCache()
@@ -0,0 +1,621 @@
+# Backend/utils/undo.py
+#
+# Before-images for the writes the agent runs, so /revert can actually undo
+# them. Each write statement is captured in the same transaction that runs it:
+#   - UPDATE / DELETE: a pre-write `SELECT <key + changed columns> ... WHERE
+#     <same condition> FOR UPDATE`, streamed from a server-side cursor and
+#     stored in batches, so the rows can't change between capture and write
+#   - INSERT: the new rows' primary keys, via RETURNING (Postgres, SQLite) or
+#     LAST_INSERT_ID() + row count for MySQL auto-increment keys
+#   - MongoDB $merge: the target documents the merge will touch, looked up by
+#     the `on` keys; $out: the target collection as it was
+# Rows go to the history database (utils/history.py) one batch at a time, so
+# capturing a 100k-row update never holds the table in memory.
+#
+# Reverting applies the inverse of every statement of a change, newest first,
+# as batched executemany calls in one transaction (INSERT the deleted rows,
+# UPDATE the old values back by key, DELETE the inserted keys). Statements
+# that can't be inverted reliably (DDL, joins, upserts, tables without a
+# primary key) still run, but their change is recorded as not revertible.
+
+import base64
+import contextvars
+import datetime
+import decimal
+import json
+import os
+import re
+import uuid
+
+from bson import json_util
+from pymongo import DeleteOne, ReplaceOne
+from pymongo.errors import OperationFailure
+from sqlalchemy import inspect, text
+
+from utils.history import history_store
+from utils.pool import database_identity, get_engine, get_mongo_client
+from utils.rate_limit import current_session
+from utils.result_cache import result_cache
+
+UNDO_CAPTURE_ENABLED = os.getenv('UNDO_CAPTURE', 'true').lower() in ('1', 'true', 'yes')
+UNDO_BATCH_ROWS = int(os.getenv('UNDO_BATCH_ROWS', 1000))
+# Larger changes still run, but are recorded as not revertible. The cost guard's
+# QUERY_MAX_WRITE_ROWS defaults to this, so writes over it are refused before they run.
+UNDO_MAX_ROWS = int(os.getenv('UNDO_MAX_ROWS', 200000))
+
+# Snapshot ids captured while answering the current request (set per query in utils/llm.py)
+current_changes = contextvars.ContextVar('current_changes', default=None)
+
+WRITE_STATEMENT = re.compile(r'^\s*(insert|update|delete|replace|merge|upsert)\b', re.IGNORECASE)
+DDL_STATEMENT = re.compile(r'^\s*(create|alter|drop|rename|truncate|comment)\b', re.IGNORECASE)
+
+IDENTIFIER = r'(?:"[^"]*"|`[^`]*`|\[[^\]]*\]|\w+)'
+TABLE = rf'(?P<table>{IDENTIFIER}(?:\s*\.\s*{IDENTIFIER})?)'
+ALIAS = r'(?:\s+(?:as\s+)?(?P<alias>(?!(?:set|where|using|returning|order|limit)\b)\w+))?'
+UPDATE_HEAD = re.compile(rf'^\s*update\s+{TABLE}{ALIAS}\s+set\s', re.IGNORECASE)
+DELETE_HEAD = re.compile(rf'^\s*delete\s+from\s+{TABLE}{ALIAS}(?=\s|$)', re.IGNORECASE)
+UPDATE_TAIL = re.compile(r'\b(where|order\s+by|limit)\b', re.IGNORECASE)
+INSERT_HEAD = re.compile(rf'^\s*insert\s+into\s+{TABLE}\s*(?P<columns>\([^)]*\))?\s*(?P<source>\w+)', re.IGNORECASE)
+
+
+class RevertError(ValueError):
+    """The change can't be reverted (unknown, already reverted, nothing captured); reported as a 400."""
+
+
+class RevertConflict(RevertError):
+    """The rows no longer match the before-image; the revert was rolled back. Reported as a 409."""
+
+
+class _NotCaptured(Exception):
+    """The before-image can't be stored; the statement still runs, as not revertible."""
+
+
+# --- Value encoding --------------------------------------------------------
+# Before-images are stored as JSON; values JSON can't represent are tagged so
+# they come back as the same Python type the driver returned.
+
+def _encode_value(value):
+    if isinstance(value, datetime.datetime):
+        return {'$datetime': value.isoformat()}
+    if isinstance(value, datetime.date):
+        return {'$date': value.isoformat()}
+    if isinstance(value, datetime.time):
+        return {'$time': value.isoformat()}
+    if isinstance(value, datetime.timedelta):
+        return {'$timedelta': value.total_seconds()}
+    if isinstance(value, decimal.Decimal):
+        return {'$decimal': str(value)}
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return {'$bytes': base64.b64encode(bytes(value)).decode('ascii')}
+    if isinstance(value, uuid.UUID):
+        return {'$uuid': str(value)}
+    if isinstance(value, dict):
+        return {'$json': value}
+    if isinstance(value, (list, tuple)):
+        return [_encode_value(item) for item in value]
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, list):
+        return [_decode_value(item) for item in value]
+    if not isinstance(value, dict):
+        return value
+    (tag, raw), = value.items()
+    if tag == '$datetime':
+        return datetime.datetime.fromisoformat(raw)
+    if tag == '$date':
+        return datetime.date.fromisoformat(raw)
+    if tag == '$time':
+        return datetime.time.fromisoformat(raw)
+    if tag == '$timedelta':
+        return datetime.timedelta(seconds=raw)
+    if tag == '$decimal':
+        return decimal.Decimal(raw)
+    if tag == '$bytes':
+        return base64.b64decode(raw)
+    if tag == '$uuid':
+        return uuid.UUID(raw)
+    return json.dumps(raw)  # '$json': drivers accept JSON text for json/jsonb columns
+
+
+def _encode_row(values):
+    return json.dumps([_encode_value(value) for value in values], separators=(',', ':'))
+
+
+def _decode_row(data):
+    return [_decode_value(value) for value in json.loads(data)]
+
+
+# --- Statement parsing -----------------------------------------------------
+
+def _mask(sql):
+    """
+    Blanks out everything inside quotes and parentheses (keeping the length),
+    so keyword searches only see the statement's top level.
+    """
+    masked = []
+    quote = None
+    depth = 0
+    for char in sql:
+        if quote:
+            masked.append(char if char == quote else ' ')
+            if char == quote:
+                quote = None
+        elif char in '\'"`':
+            quote = char
+            masked.append(char)
+        elif char == '(':
+            depth += 1
+            masked.append(char if depth == 1 else ' ')
+        elif char == ')':
+            depth -= 1
+            masked.append(char if depth == 0 else ' ')
+        else:
+            masked.append(' ' if depth else char)
+    return ''.join(masked)
+
+
+def _keyword(masked, word, start=0):
+    """Position of a top-level keyword at or after `start`, or None."""
+    match = re.compile(rf'\b{word}\b', re.IGNORECASE).search(masked, start)
+    return match.start() if match else None
+
+
+def _unquote(identifier):
+    identifier = identifier.strip()
+    if identifier[:1] in '"`[':
+        return identifier[1:-1]
+    return identifier
+
+
+def _table_parts(table, dialect):
+    """(schema or None, name) of a possibly qualified table name, as the catalog spells them."""
+    masked = _mask(table)
+    dot = masked.find('.')
+    parts = [table[:dot], table[dot + 1:]] if dot >= 0 else [None, table]
+    names = []
+    for part in parts:
+        if part is not None and part.strip()[:1] not in '"`[' and dialect == 'postgresql':
+            part = part.lower()  # Postgres folds unquoted names to lower case
+        names.append(_unquote(part) if part is not None else None)
+    return names[0], names[1]
+
+
+def _assigned_columns(assignments):
+    """Column names on the left of each top-level `col = expr` in a SET list, or None if unclear."""
+    masked = _mask(assignments)
+    columns, start = [], 0
+    for end in [match.start() for match in re.finditer(',', masked)] + [len(assignments)]:
+        left, equals, _ = assignments[start:end].partition('=')
+        if not equals or not left.strip():
+            return None
+        columns.append(_unquote(left.strip().split('.')[-1]))
+        start = end + 1
+    return columns
+
+
+class _WritePlan:
+    """What to capture for one write statement, or why it can't be."""
+
+    def __init__(self, operation, statement, table=None, alias=None, condition='', columns=None,
+                 insert_columns=None, insert_source=None, note=None):
+        self.operation = operation
+        self.statement = statement
+        self.table = table
+        self.alias = alias
+        self.condition = condition
+        self.columns = columns
+        self.insert_columns = insert_columns
+        self.insert_source = insert_source
+        self.note = note
+
+    @property
+    def revertible(self):
+        return self.note is None
+
+
+def plan_write(sql, dialect):
+    """Works out how to capture a write statement. Returns a _WritePlan, or None for non-writes."""
+    sql = sql.strip().rstrip(';')
+    if DDL_STATEMENT.match(sql):
+        return _WritePlan('ddl', sql, note='Schema changes (DDL) are not reverted automatically.')
+    if not WRITE_STATEMENT.match(sql):
+        return None
+    masked = _mask(sql)
+    if ';' in masked:
+        return _WritePlan('write', sql, note='Several statements in one call can\'t be captured.')
+    returning = _keyword(masked, 'returning')
+
+    match = UPDATE_HEAD.match(masked)
+    if match:
+        table, alias = sql[match.start('table'):match.end('table')], match.group('alias')
+        if _keyword(masked, 'from', match.end()) is not None:
+            return _WritePlan('update', sql, note='UPDATE ... FROM (joined updates) can\'t be captured.')
+        end = returning if returning is not None else len(sql)
+        # The condition is everything from WHERE (or MySQL's ORDER BY/LIMIT) up to RETURNING
+        tail = UPDATE_TAIL.search(masked, match.end(), end)
+        tail = tail.start() if tail else end
+        columns = _assigned_columns(sql[match.end():tail])
+        condition = sql[tail:end].strip()
+        return _WritePlan('update', sql, table, alias, condition, columns)
+
+    match = DELETE_HEAD.match(masked)
+    if match:
+        if _keyword(masked, 'using', match.end()) is not None:
+            return _WritePlan('delete', sql, note='DELETE ... USING (joined deletes) can\'t be captured.')
+        table, alias = sql[match.start('table'):match.end('table')], match.group('alias')
+        end = returning if returning is not None else len(sql)
+        return _WritePlan('delete', sql, table, alias, sql[match.end():end].strip())
+
+    match = INSERT_HEAD.match(masked)
+    if match:
+        upsert = re.search(r'\bon\s+(duplicate\s+key|conflict\b[^;]*\bdo\s+update)\b', masked, re.IGNORECASE)
+        if upsert:
+            return _WritePlan('insert', sql, note='Upserts (ON CONFLICT/ON DUPLICATE KEY UPDATE) can\'t be captured.')
+        if returning is not None:
+            return _WritePlan('insert', sql, note='INSERT ... RETURNING can\'t be captured.')
+        columns = match.group('columns')
+        return _WritePlan(
+            'insert', sql, sql[match.start('table'):match.end('table')],
+            insert_columns=[_unquote(column) for column in sql[match.start('columns') + 1:match.end('columns') - 1].split(',')]
+            if columns else None,
+            insert_source=match.group('source').lower(),
+        )
+    return _WritePlan('write', sql, note='This kind of statement can\'t be captured.')
+
+
+# --- SQL capture -----------------------------------------------------------
+
+def _remember(snapshot_id):
+    captured = current_changes.get()
+    if captured is not None:
+        captured.append(snapshot_id)
+
+
+def take_captured_changes():
+    """Snapshot ids captured while answering the current request; clears the list."""
+    captured = current_changes.get()
+    if not captured:
+        return []
+    snapshot_ids = list(captured)
+    captured.clear()
+    return snapshot_ids
+
+
+def _encoded_batches(partitions):
+    total = 0
+    for rows in partitions:
+        total += len(rows)
+        if total > UNDO_MAX_ROWS:
+            raise _NotCaptured(f'More than {UNDO_MAX_ROWS:,} rows were affected; too large to capture.')
+        yield [_encode_row(row) for row in rows]
+
+
+def _primary_key(connection, schema, name):
+    return inspect(connection).get_pk_constraint(name, schema=schema).get('constrained_columns') or []
+
+
+def _capture_before(connection, plan, snapshot_id, keys):
+    """Streams the rows an UPDATE/DELETE will touch into the snapshot, locking them until commit."""
+    preparer = connection.dialect.identifier_preparer
+    if plan.operation == 'update':
+        columns = list(dict.fromkeys(keys + plan.columns))
+        selected = ', '.join(preparer.quote(column) for column in columns)
+    else:
+        columns, selected = None, '*'
+    statement = f"SELECT {selected} FROM {plan.table}{' ' + plan.alias if plan.alias else ''} {plan.condition}"
+    if connection.dialect.name in ('postgresql', 'mysql'):
+        statement += ' FOR UPDATE'
+    result = connection.execute(
+        text(statement), execution_options={'stream_results': True, 'yield_per': UNDO_BATCH_ROWS}
+    )
+    try:
+        columns = columns or list(result.keys())
+        history_store.append_snapshot_rows(snapshot_id, _encoded_batches(result.partitions(UNDO_BATCH_ROWS)))
+    finally:
+        result.close()
+    return columns
+
+
+def _inserted_keys(connection, result, plan, schema, name, keys):
+    """Primary keys of the rows an INSERT created (MySQL: from LAST_INSERT_ID and the row count)."""
+    if connection.dialect.name != 'mysql':
+        return result.partitions(UNDO_BATCH_ROWS)
+    column = next(column for column in inspect(connection).get_columns(name, schema=schema) if column['name'] == keys[0])
+    step = connection.execute(text('SELECT @@auto_increment_increment')).scalar() or 1
+    first, count = result.lastrowid, result.rowcount
+    if not column.get('autoincrement') or not first or count < 0:
+        raise _NotCaptured('The inserted keys are not known.')
+    ids = [(first + step * index,) for index in range(count)]
+    return (ids[start:start + UNDO_BATCH_ROWS] for start in range(0, len(ids), UNDO_BATCH_ROWS))
+
+
+def execute_write(engine, identity, sql):
+    """
+    Runs a write statement with its before-image captured in the same transaction.
+    Returns (columns, rows) when the statement itself returns rows, else None.
+    Database errors propagate unchanged (the query tool reports them to the agent).
+    """
+    dialect = engine.dialect.name
+    plan = plan_write(sql, dialect)
+    if plan is None or not UNDO_CAPTURE_ENABLED:
+        with engine.begin() as connection:
+            result = connection.execute(text(sql))
+            return (list(result.keys()), result.fetchall()) if result.returns_rows else None
+
+    sid = current_session.get()
+    schema, name = _table_parts(plan.table, dialect) if plan.table else (None, None)
+    meta = {'dialect': dialect, 'statement': plan.statement[:2000]}
+    snapshot_id = history_store.create_snapshot(sid, identity, plan.operation, name, meta,
+                                                revertible=plan.revertible, note=plan.note)
+    try:
+        with engine.begin() as connection:
+            statement = plan.statement
+            keys = _primary_key(connection, schema, name) if plan.revertible else []
+            if plan.revertible and not keys and plan.operation != 'delete':
+                plan.note = f'{name} has no primary key to match rows by.'
+            elif plan.revertible and plan.operation == 'update':
+                if plan.columns is None:
+                    plan.note = 'The SET clause could not be parsed.'
+                elif set(plan.columns) & set(keys):
+                    plan.note = 'Updates that change primary key values can\'t be captured.'
+            elif plan.revertible and plan.operation == 'insert':
+                if dialect == 'mysql' and (len(keys) != 1 or plan.insert_source != 'values'
+                                           or not plan.insert_columns or keys[0] in plan.insert_columns):
+                    plan.note = 'Only INSERT ... VALUES with an auto-increment key can be captured on MySQL.'
+                elif dialect != 'mysql':
+                    preparer = connection.dialect.identifier_preparer
+                    statement += ' RETURNING ' + ', '.join(preparer.quote(key) for key in keys)
+            if plan.note:
+                history_store.disable_snapshot(snapshot_id, plan.note)
+
+            columns = None
+            if plan.revertible and plan.operation in ('update', 'delete'):
+                # A savepoint keeps a failed capture from aborting the write's transaction
+                try:
+                    with connection.begin_nested():
+                        columns = _capture_before(connection, plan, snapshot_id, keys)
+                except _NotCaptured as e:
+                    plan.note = str(e)
+                    history_store.disable_snapshot(snapshot_id, plan.note)
+
+            result = connection.execute(text(statement))
+            returned = None
+            if plan.revertible and plan.operation == 'insert':
+                columns = keys
+                try:
+                    history_store.append_snapshot_rows(
+                        snapshot_id, _encoded_batches(_inserted_keys(connection, result, plan, schema, name, keys))
+                    )
+                except _NotCaptured as e:
+                    plan.note = str(e)
+                    history_store.disable_snapshot(snapshot_id, plan.note)
+            elif result.returns_rows:
+                returned = (list(result.keys()), result.fetchall())
+
+            if plan.revertible:
+                meta.update(schema=schema, table=name, keys=keys, columns=columns)
+                history_store.update_snapshot_meta(snapshot_id, meta)
+    except Exception:
+        history_store.delete_snapshot(snapshot_id)
+        raise
+    _remember(snapshot_id)
+    return returned
+
+
+def _qualified(preparer, meta):
+    table = preparer.quote(meta['table'])
+    return f"{preparer.quote_schema(meta['schema'])}.{table}" if meta.get('schema') else table
+
+
+def _apply_sql(connection, snapshot):
+    """Runs the inverse of one captured statement in batches. Returns the rows restored."""
+    meta = snapshot['meta']
+    preparer = connection.dialect.identifier_preparer
+    table = _qualified(preparer, meta)
+    columns, keys = meta['columns'], meta['keys']
+    names = {column: f'p{index}' for index, column in enumerate(columns)}
+    match = ' AND '.join(f'{preparer.quote(key)} = :{names[key]}' for key in keys)
+
+    if snapshot['operation'] == 'delete':
+        statement = (f"INSERT INTO {table} ({', '.join(preparer.quote(column) for column in columns)}) "
+                     f"VALUES ({', '.join(':' + names[column] for column in columns)})")
+    elif snapshot['operation'] == 'update':
+        assignments = ', '.join(f'{preparer.quote(column)} = :{names[column]}' for column in columns if column not in keys)
+        statement = f'UPDATE {table} SET {assignments} WHERE {match}'
+    else:
+        statement = f'DELETE FROM {table} WHERE {match}'
+
+    restored = 0
+    for batch in history_store.snapshot_rows(snapshot['id'], UNDO_BATCH_ROWS):
+        parameters = [dict(zip(names.values(), _decode_row(data))) for data in batch]
+        result = connection.execute(text(statement), parameters)
+        # Inserts always land; updates/deletes that miss rows mean the data changed since
+        if (snapshot['operation'] != 'delete' and connection.dialect.supports_sane_multi_rowcount
+                and result.rowcount != len(parameters)):
+            raise RevertConflict(
+                f"{meta['table']} changed since this change was made: expected {len(parameters)} rows "
+                f'to match, found {result.rowcount}. Nothing was reverted.'
+            )
+        restored += len(parameters)
+    return restored
+
+
+# --- MongoDB capture -------------------------------------------------------
+
+def _write_stage(pipeline):
+    last = pipeline[-1] if pipeline else None
+    if isinstance(last, dict) and ({'$out', '$merge'} & set(last)):
+        return last
+    return None
+
+
+def is_write_pipeline(pipeline):
+    return _write_stage(pipeline) is not None
+
+
+def _mongo_target(database, spec):
+    if isinstance(spec, dict):
+        return spec.get('db') or database.name, spec.get('coll')
+    return database.name, spec
+
+
+def _encode_document(document):
+    return json_util.dumps(document, json_options=json_util.CANONICAL_JSON_OPTIONS)
+
+
+def run_write_pipeline(database, identity, collection, pipeline):
+    """Runs a $out/$merge pipeline after capturing the target documents it will replace."""
+    stage = _write_stage(pipeline)
+    if not UNDO_CAPTURE_ENABLED:
+        return list(database[collection].aggregate(pipeline))
+
+    if '$out' in stage:
+        db_name, target_name = _mongo_target(database, stage['$out'])
+        operation, on = 'out', None
+    else:
+        spec = stage['$merge']
+        db_name, target_name = _mongo_target(database, spec if isinstance(spec, str) else spec.get('into'))
+        operation = 'merge'
+        on = spec.get('on', '_id') if isinstance(spec, dict) else '_id'
+        on = [on] if isinstance(on, str) else list(on)
+    target = database.client[db_name][target_name]
+    meta = {'database': db_name, 'collection': target_name, 'on': on,
+            'existed': target_name in database.client[db_name].list_collection_names(filter={'name': target_name})}
+    snapshot_id = history_store.create_snapshot(current_session.get(), identity, operation, target_name, meta)
+
+    def before_images():
+        if operation == 'out':
+            for document in target.find({}, batch_size=UNDO_BATCH_ROWS):
+                yield {'before': document}
+            return
+        # Keys the merge will write, then the documents currently stored under them
+        keys = database[collection].aggregate(
+            pipeline[:-1] + [{'$project': {**{field: 1 for field in on}, **({} if '_id' in on else {'_id': 0})}}],
+            batchSize=UNDO_BATCH_ROWS,
+        )
+        batch = []
+        for key in keys:
+            batch.append({field: key.get(field) for field in on})
+            if len(batch) >= UNDO_BATCH_ROWS:
+                yield from _merge_before_images(target, on, batch)
+                batch = []
+        if batch:
+            yield from _merge_before_images(target, on, batch)
+
+    def batches():
+        batch, total = [], 0
+        for image in before_images():
+            batch.append(_encode_document(image))
+            total += 1
+            if total > UNDO_MAX_ROWS:
+                raise _NotCaptured(f'More than {UNDO_MAX_ROWS:,} documents were affected; too large to capture.')
+            if len(batch) >= UNDO_BATCH_ROWS:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    try:
+        try:
+            history_store.append_snapshot_rows(snapshot_id, batches())
+        except _NotCaptured as e:
+            history_store.disable_snapshot(snapshot_id, str(e))
+        documents = list(database[collection].aggregate(pipeline))
+    except Exception:
+        history_store.delete_snapshot(snapshot_id)
+        raise
+    _remember(snapshot_id)
+    return documents
+
+
+def _merge_before_images(target, on, keys):
+    if on == ['_id']:
+        found = {json_util.dumps(document['_id']): document
+                 for document in target.find({'_id': {'$in': [key['_id'] for key in keys]}})}
+        for key in keys:
+            yield {'key': key, 'before': found.get(json_util.dumps(key['_id']))}
+        return
+    found = {}
+    for document in target.find({'$or': keys}):
+        found[json_util.dumps({field: document.get(field) for field in on})] = document
+    for key in keys:
+        yield {'key': key, 'before': found.get(json_util.dumps(key))}
+
+
+def _apply_mongo(client, snapshots, session=None):
+    restored = 0
+    for snapshot in snapshots:
+        meta = snapshot['meta']
+        target = client[meta['database']][meta['collection']]
+        if snapshot['operation'] == 'out':
+            target.delete_many({}, session=session)
+        for batch in history_store.snapshot_rows(snapshot['id'], UNDO_BATCH_ROWS):
+            images = [json_util.loads(data) for data in batch]
+            if snapshot['operation'] == 'out':
+                target.insert_many([image['before'] for image in images], session=session)
+            else:
+                target.bulk_write([
+                    ReplaceOne({'_id': image['before']['_id']}, image['before'], upsert=True)
+                    if image['before'] is not None else DeleteOne(image['key'])
+                    for image in images
+                ], ordered=True, session=session)
+            restored += len(images)
+    return restored
+
+
+def _revert_mongo(db_uri, mode, snapshots):
+    client = get_mongo_client(db_uri, mode)
+    try:
+        with client.start_session() as mongo_session:
+            restored = mongo_session.with_transaction(lambda s: _apply_mongo(client, snapshots, s))
+    except OperationFailure as e:
+        if e.code != 20:  # IllegalOperation: transactions need a replica set
+            raise
+        restored = _apply_mongo(client, snapshots)
+    for snapshot in snapshots:
+        meta = snapshot['meta']
+        if snapshot['operation'] == 'out' and not meta['existed']:
+            client[meta['database']].drop_collection(meta['collection'])
+    return restored
+
+
+# --- Revert ----------------------------------------------------------------
+
+def undo_change(db_uri, db_type, mode, sid, change_id):
+    """
+    Undoes a recorded change of the session's database in one transaction.
+    Returns the history entry; raises RevertError/RevertConflict if it can't.
+    """
+    entry = history_store.get(sid, change_id) if isinstance(change_id, int) else None
+    if entry is None:
+        raise RevertError('Invalid history ID.')
+    if entry['reverted']:
+        raise RevertError('This change has already been reverted.')
+    snapshots = history_store.snapshots(sid, change_id)
+    if not snapshots:
+        raise RevertError('Nothing was captured for this change, so it can\'t be reverted.')
+    unrevertible = [snapshot['note'] for snapshot in snapshots if not snapshot['revertible']]
+    if unrevertible:
+        raise RevertError(f"This change can't be reverted: {'; '.join(unrevertible)}")
+    identity = database_identity(db_uri)
+    if any(snapshot['identity'] != identity for snapshot in snapshots):
+        raise RevertError('This change was made on a different database; connect to it to revert.')
+
+    # Claim the change first, so two concurrent reverts can't both apply it
+    if not history_store.mark_reverted(sid, change_id):
+        raise RevertError('This change has already been reverted.')
+    try:
+        if db_type == 'mongodb':
+            restored = _revert_mongo(db_uri, mode, snapshots)
+        else:
+            with get_engine(db_uri, mode).begin() as connection:
+                restored = sum(_apply_sql(connection, snapshot) for snapshot in snapshots)
+            result_cache.invalidate(identity, {snapshot['target'] for snapshot in snapshots} or None)
+    except Exception:
+        history_store.clear_reverted(sid, change_id)
+        raise
+    print(f"Reverted change {change_id}: {restored} rows restored")
+    entry.update(reverted=True, rows_restored=restored)
+    return entry
@@ -853,6 +853,21 @@ const FloatingErrorDialog = ({ error, onClose }) => {
   );
 };
 
+// --- Result decoding ---
+
+// Media type of the columnar layout: column names once, one typed array per
+// column, instead of repeating every name per row (see Backend/utils/negotiation.py)
+const COLUMNAR_JSON = "application/vnd.dbassistant.columnar+json";
+
+// Turns a columnar payload back into the row layout the table renders
+const decodeColumnar = (payload) => {
+  if (payload.layout !== "columnar") return payload;
+  const rows = Array.from({ length: payload.length }, (_, i) =>
+    payload.data.map((values) => values[i]),
+  );
+  return { ...payload, rows };
+};
+
 // --- Main App Component (Logic Unchanged, Colors Updated) ---
 
 export default function App() {
@@ -869,6 +884,7 @@ export default function App() {
 
   const [activeTab, setActiveTab] = useState("query");
   const [history, setHistory] = useState([]);
+  const [historyCursor, setHistoryCursor] = useState(null);
 
   // Form states (PRESERVED)
   const [dbType, setDbType] = useState("supabase");
@@ -879,6 +895,13 @@ export default function App() {
   // Query states (PRESERVED)
   const [query, setQuery] = useState("");
   const [response, setResponse] = useState("");
+  // Live progress events from /query/stream (tool calls, generated SQL)
+  const [progress, setProgress] = useState([]);
+  // Current page of a large result (GET /results/<id>) and the cursors of earlier pages
+  const [resultPage, setResultPage] = useState(null);
+  const [pageCursors, setPageCursors] = useState([]);
+  // Statement behind the last answer, for POST /export
+  const [lastSql, setLastSql] = useState("");
 
   // UI state for showing/hiding form
   const [showConnectForm, setShowConnectForm] = useState(true);
@@ -890,15 +913,19 @@ export default function App() {
 
   // --- FUNCTION LOGIC ---
 
-  const fetchHistory = useCallback(async () => {
+  // History is paginated newest-first; passing the previous next_cursor appends the following page
+  const fetchHistory = useCallback(async (cursor = null) => {
     if (!isConnected) return;
     try {
-      const res = await fetch(`${API_URL}/history`, {
+      const params = cursor ? `?cursor=${encodeURIComponent(cursor)}` : "";
+      const res = await fetch(`${API_URL}/history${params}`, {
         credentials: "include",
       });
       const data = await res.json();
       if (res.ok) {
-        setHistory(data.history || []);
+        const entries = data.history || [];
+        setHistory((previous) => (cursor ? [...previous, ...entries] : entries));
+        setHistoryCursor(data.next_cursor || null);
       }
     } catch (err) {
       console.error("Failed to fetch history:", err);
@@ -987,38 +1014,156 @@ export default function App() {
       setCredentials({});
       setQuery("");
       setResponse("");
+      setProgress([]);
       setConnectionError("");
       setInvalidFields({}); // Clear invalid fields on disconnect
       setQueryError("");
       setHistory([]);
+      setHistoryCursor(null);
       setActiveTab("query");
       setShowConnectForm(true);
     }
   };
 
+  // Parses a Server-Sent Events body and calls onEvent(event, data) per frame
+  const readEventStream = async (res, onEvent) => {
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+    for (;;) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+      let boundary;
+      while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+        const frame = buffer.slice(0, boundary);
+        buffer = buffer.slice(boundary + 2);
+        let event = "message";
+        let data = "";
+        for (const line of frame.split("\n")) {
+          if (line.startsWith("event:")) event = line.slice(6).trim();
+          else if (line.startsWith("data:")) data += line.slice(5).trim();
+        }
+        if (data) onEvent(event, JSON.parse(data));
+      }
+    }
+  };
+
+  // Fetches one page of a large result held server-side
+  const fetchResultPage = async (resultId, cursor) => {
+    const params = new URLSearchParams({ limit: "100" });
+    if (cursor) params.set("cursor", cursor);
+    try {
+      // The browser negotiates compression (zstd/br/gzip) and decompresses itself
+      const res = await fetch(`${API_URL}/results/${resultId}?${params}`, {
+        credentials: "include",
+        headers: { Accept: `${COLUMNAR_JSON}, application/json;q=0.5` },
+      });
+      const data = await res.json();
+      if (!res.ok) {
+        setQueryError(data.error || "Failed to fetch results.");
+        return;
+      }
+      setResultPage(decodeColumnar(data));
+    } catch (err) {
+      setQueryError(err.message);
+    }
+  };
+
+  const handleNextPage = () => {
+    setPageCursors((prev) => [...prev, resultPage.cursor]);
+    fetchResultPage(resultPage.result_id, resultPage.next_cursor);
+  };
+
+  const handlePreviousPage = () => {
+    const cursor = pageCursors[pageCursors.length - 1];
+    setPageCursors((prev) => prev.slice(0, -1));
+    fetchResultPage(resultPage.result_id, cursor);
+  };
+
+  // Downloads the full result of the last answer's statement
+  const handleExport = async (format) => {
+    setQueryError("");
+    try {
+      const res = await fetch(`${API_URL}/export`, {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        credentials: "include",
+        body: JSON.stringify({ sql: lastSql, format }),
+      });
+      if (!res.ok) {
+        const data = await res.json();
+        setQueryError(data.error || "Export failed.");
+        return;
+      }
+      const url = URL.createObjectURL(await res.blob());
+      const link = document.createElement("a");
+      link.href = url;
+      link.download = `export.${format}`;
+      link.click();
+      URL.revokeObjectURL(url);
+    } catch (err) {
+      setQueryError(err.message);
+    }
+  };
+
   const handleQuerySubmit = async (e) => {
     e.preventDefault();
     if (!query) return;
     setIsLoading(true);
     setQueryError("");
     setResponse("");
+    setProgress([]);
+    setResultPage(null);
+    setPageCursors([]);
+    setLastSql("");
     try {
-      const res = await fetch(`${API_URL}/query`, {
+      const res = await fetch(`${API_URL}/query/stream`, {
         method: "POST",
         headers: { "Content-Type": "application/json" },
         credentials: "include",
         body: JSON.stringify({ query }),
       });
-      const data = await res.json();
-      if (res.ok) {
-        setResponse(data.response);
-        if (mode === "read-write") {
-          fetchHistory();
-        }
-      } else {
-        const errorMessage = data.error || "Query failed.";
-        setQueryError(errorMessage);
+      if (!res.ok) {
+        const data = await res.json();
+        setQueryError(data.error || "Query failed.");
+        return;
       }
+      await readEventStream(res, (event, data) => {
+        if (event === "tool_start") {
+          // Tokens so far belonged to an intermediate step, not the answer
+          setResponse("");
+          setProgress((prev) => [...prev, `Running ${data.tool}...`]);
+        } else if (event === "sql") {
+          setProgress((prev) => [...prev, data.statement]);
+        } else if (event === "queued") {
+          setProgress((prev) => [
+            ...prev,
+            `Waiting ~${data.expected_wait_seconds}s for LLM capacity (${data.queue_depth} queued)...`,
+          ]);
+        } else if (event === "retry") {
+          setProgress((prev) => [
+            ...prev,
+            data.action === "fallback"
+              ? `${data.model} is busy, switching to a fallback model...`
+              : `${data.model} hiccup, retrying in ${data.delay_seconds}s...`,
+          ]);
+        } else if (event === "token") {
+          setResponse((prev) => prev + data.text);
+        } else if (event === "answer") {
+          setResponse(data.response);
+          setLastSql(data.sql || "");
+          if (data.result_id) {
+            // Large result: the agent only saw a preview; page through the rest
+            fetchResultPage(data.result_id);
+          }
+          if (mode === "read-write") {
+            fetchHistory();
+          }
+        } else if (event === "error") {
+          setQueryError(data.error || "Query failed.");
+        }
+      });
     } catch (err) {
       setQueryError(err.message);
     } finally {
@@ -1395,6 +1540,15 @@ export default function App() {
           <div className="text-center text-cyan-400 p-4 bg-gray-800 rounded-lg flex-shrink-0">
             <Loader2 className="animate-spin mx-auto" size={20} />
             Processing your query...
+            {progress.length > 0 && (
+              <ul className="mt-2 text-left text-xs text-gray-400 font-mono space-y-1">
+                {progress.map((step, i) => (
+                  <li key={i} className="truncate">
+                    {step}
+                  </li>
+                ))}
+              </ul>
+            )}
           </div>
         )}
         {/* INLINE ERROR DISPLAY FOR QUERY INTERFACE - Changed to dark mode error styles */}
@@ -1413,6 +1567,84 @@ export default function App() {
             {response}
           </pre>
         )}
+        {resultPage && renderResultTable()}
+        {lastSql && !isLoading && (
+          <div className="mt-2 flex items-center gap-2 flex-shrink-0 text-xs text-gray-400">
+            Export full result:
+            {["csv", "ndjson"].map((format) => (
+              <Button
+                key={format}
+                variant="outline"
+                onClick={() => handleExport(format)}
+                className="py-1 px-3 text-xs"
+              >
+                {format.toUpperCase()}
+              </Button>
+            ))}
+          </div>
+        )}
+      </div>
+    </div>
+  );
+
+  const renderResultTable = () => (
+    <div className="mt-4 flex-shrink-0 border border-gray-800 rounded-lg bg-gray-950">
+      <div className="max-h-80 overflow-auto">
+        <table className="min-w-full text-xs font-mono text-gray-300">
+          <thead className="sticky top-0 bg-gray-900 text-cyan-400">
+            <tr>
+              {resultPage.columns.map((column) => (
+                <th key={column} className="px-3 py-2 text-left font-semibold">
+                  {column}
+                </th>
+              ))}
+            </tr>
+          </thead>
+          <tbody>
+            {resultPage.rows.map((row, i) => (
+              <tr key={i} className="border-t border-gray-800">
+                {resultPage.columns.map((column, j) => {
+                  // SQL rows are arrays; MongoDB rows are documents
+                  const value = Array.isArray(row) ? row[j] : row[column];
+                  return (
+                    <td key={column} className="px-3 py-1 whitespace-nowrap">
+                      {value === null || value === undefined
+                        ? ""
+                        : typeof value === "object"
+                          ? JSON.stringify(value)
+                          : String(value)}
+                    </td>
+                  );
+                })}
+              </tr>
+            ))}
+          </tbody>
+        </table>
+      </div>
+      <div className="flex items-center justify-between p-2 text-xs text-gray-400">
+        <span>
+          Rows {Number(resultPage.cursor) + 1}-
+          {Number(resultPage.cursor) + resultPage.rows.length}
+          {resultPage.row_count !== null && ` of ${resultPage.row_count}`}
+        </span>
+        <div className="flex gap-2">
+          <Button
+            variant="outline"
+            onClick={handlePreviousPage}
+            disabled={pageCursors.length === 0}
+            className="py-1 px-3 text-xs"
+          >
+            Previous
+          </Button>
+          <Button
+            variant="outline"
+            onClick={handleNextPage}
+            disabled={!resultPage.next_cursor}
+            className="py-1 px-3 text-xs"
+          >
+            Next
+          </Button>
+        </div>
       </div>
     </div>
   );
@@ -1430,9 +1662,9 @@ export default function App() {
         </p>
       ) : (
         <ul className="space-y-3 overflow-y-auto pr-2 flex-grow">
-          {history.map((item, index) => (
+          {history.map((item) => (
             <li
-              key={index}
+              key={item.id}
               // Changed list item colors
               className={`flex justify-between items-center p-4 rounded-xl border transition-shadow ${item.reverted ? "bg-gray-800 border-gray-700" : "bg-gray-900 border-cyan-700 shadow-md shadow-black/30"}`}
             >
@@ -1447,8 +1679,9 @@ export default function App() {
                 </p>
               </div>
               <Button
-                onClick={() => handleRevert(index)}
-                disabled={item.reverted || isLoading || mode !== "read-write"}
+                onClick={() => handleRevert(item.id)}
+                disabled={item.reverted || !item.revertible || isLoading || mode !== "read-write"}
+                title={item.revertible ? undefined : item.revert_note || "This change can't be reverted."}
                 variant={item.reverted ? "secondary" : "danger"}
                 className="text-xs py-1.5 px-3"
               >
@@ -1461,6 +1694,17 @@ export default function App() {
               </Button>
             </li>
           ))}
+          {historyCursor && (
+            <li className="flex justify-center">
+              <Button
+                onClick={() => fetchHistory(historyCursor)}
+                variant="outline"
+                className="text-xs py-1.5 px-3"
+              >
+                Load older changes
+              </Button>
+            </li>
+          )}
         </ul>
       )}
     </div>